@@ -1,4 +1,5 @@
 import numpy as np
+from pyMFI import MFI, geometry
 import matplotlib.pyplot as plt
 import glob
 import os
@@ -62,35 +63,6 @@ grid_ext = (1/2) * periodic_extension * (max_grid-min_grid)
 Flim=50
 
 
-def find_periodic_point(x_coord,y_coord):
-    coord_list = []
-    #There are potentially 4 points, 1 original and 3 periodic copies
-    coord_list.append([x_coord,y_coord])
-    copy_record = [0,0,0,0]
-    #check for x-copy
-    if x_coord < min_grid+grid_ext:
-        coord_list.append([x_coord + 2*np.pi,y_coord])
-        copy_record[0] = 1
-    elif x_coord > max_grid-grid_ext:
-        coord_list.append([x_coord - 2*np.pi,y_coord])
-        copy_record[1] = 1
-    #check for y-copy
-    if y_coord < min_grid+grid_ext:
-        coord_list.append([x_coord, y_coord + 2 * np.pi])
-        copy_record[2] = 1
-    elif y_coord > max_grid-grid_ext:
-        coord_list.append([x_coord, y_coord - 2 * np.pi])
-        copy_record[3] = 1
-    #check for xy-copy
-    if sum(copy_record) == 2:
-        if copy_record[0] == 1 and copy_record[2] == 1: coord_list.append([x_coord + 2 * np.pi, y_coord + 2 * np.pi])
-        elif copy_record[1] == 1 and copy_record[2] == 1: coord_list.append([x_coord - 2 * np.pi, y_coord + 2 * np.pi])
-        elif copy_record[0] == 1 and copy_record[3] == 1: coord_list.append([x_coord + 2 * np.pi, y_coord - 2 * np.pi])
-        elif copy_record[1] == 1 and copy_record[3] == 1: coord_list.append([x_coord - 2 * np.pi, y_coord - 2 * np.pi])
-
-    return coord_list
-
-
 def find_cutoff_matrix(input_FES):
     len_x, len_y = np.shape(input_FES)
     cutoff_matrix = np.ones((len_x, len_y))
@@ -133,8 +105,7 @@ def find_FES_adj(X_old, Y_old, FES_old):
 
 def MSintegral(FX,FY,X_old=X, Y_old=Y, i_bins=(nbins,nbins)):
 
-    if i_bins != (nbins,nbins):
-
+    if i_bins != (nbins,nbins): #interpolate
         r = np.stack([X_old.ravel(), Y_old.ravel()]).T
         Sx = interpolate.CloughTocher2DInterpolator(r, FX.ravel())
         Sy = interpolate.CloughTocher2DInterpolator(r, FY.ravel())
@@ -148,54 +119,7 @@ def MSintegral(FX,FY,X_old=X, Y_old=Y, i_bins=(nbins,nbins)):
         FX = Sx(ri).reshape(X_new.shape)
         FY = Sy(ri).reshape(Y_new.shape)
 
-        grid_diff = np.diff(x_new)[0]
-
-    else:
-        grid_diff = grid_space
-        X_new = X_old
-        Y_new = Y_old
-
-
-    SdZx = np.cumsum(FX, axis=1) * grid_diff  # cumulative sum along x-axis
-    SdZy = np.cumsum(FY, axis=0) * grid_diff  # cumulative sum along y-axis
-    SdZx3 = np.cumsum(FX[::-1], axis=1) * grid_diff  # cumulative sum along x-axis
-    SdZy3 = np.cumsum(FY[::-1], axis=0) * grid_diff  # cumulative sum along y-axis
-    SdZx5 = np.cumsum(FX[:, ::-1], axis=1) * grid_diff  # cumulative sum along x-axis
-    SdZy5 = np.cumsum(FY[:, ::-1], axis=0) * grid_diff  # cumulative sum along y-axis
-    SdZx7 = np.cumsum(FX[::-1, ::-1], axis=1) * grid_diff  # cumulative sum along x-axis
-    SdZy7 = np.cumsum(FY[::-1, ::-1], axis=0) * grid_diff  # cumulative sum along y-axis
-
-
-    FES = np.zeros(i_bins)
-    FES2 = np.zeros(i_bins)
-    FES3 = np.zeros(i_bins)
-    FES4 = np.zeros(i_bins)
-    FES5 = np.zeros(i_bins)
-    FES6 = np.zeros(i_bins)
-    FES7 = np.zeros(i_bins)
-    FES8 = np.zeros(i_bins)
-
-    for i in range(FES.shape[0]):
-        for j in range(FES.shape[1]):
-            FES[i, j]  += np.sum([SdZy[i, 0], -SdZy[0, 0], SdZx[i, j], -SdZx[i, 0]])
-            FES2[i, j] += np.sum([SdZx[0, j], -SdZx[0, 0], SdZy[i, j], -SdZy[0, j]])
-            FES3[i, j] += np.sum([-SdZy3[i, 0], SdZy3[0, 0], SdZx3[i, j], -SdZx3[i, 0]])
-            FES4[i, j] += np.sum([SdZx3[0, j], -SdZx3[0, 0], -SdZy3[i, j], SdZy3[0, j]])
-            FES5[i, j] += np.sum([SdZy5[i, 0], -SdZy5[0, 0], -SdZx5[i, j], SdZx5[i, 0]])
-            FES6[i, j] += np.sum([-SdZx5[0, j], SdZx5[0, 0], SdZy5[i, j], -SdZy5[0, j]])
-            FES7[i, j] += np.sum([-SdZy7[i, 0], SdZy7[0, 0], -SdZx7[i, j], SdZx7[i, 0]])
-            FES8[i, j] += np.sum([-SdZx7[0, j], SdZx7[0, 0], -SdZy7[i, j], SdZy7[0, j]])
-
-    FES = FES - np.min(FES)
-    FES2 = FES2 - np.min(FES2)
-    FES3 = FES3[::-1] - np.min(FES3)
-    FES4 = FES4[::-1] - np.min(FES4)
-    FES5 = FES5[:,::-1] - np.min(FES5)
-    FES6 = FES6[:,::-1] - np.min(FES6)
-    FES7 = FES7[::-1,::-1] - np.min(FES7)
-    FES8 = FES8[::-1,::-1] - np.min(FES8)
-    FES_a = (FES + FES2 + FES3 + FES4 + FES5 + FES6 + FES7 + FES8) / 8
-    FES_a = FES_a - np.min(FES_a)
+    [X_new, Y_new, FES_a] = MFI.intg_2D(FX, FY, min_grid=np.array((min_grid, min_grid)), max_grid=np.array((max_grid, max_grid)), nbins=np.array(i_bins), all_directions=True)
 
     if i_bins != (nbins,nbins):
         return (FES_a, X_new, Y_new)
@@ -205,16 +129,10 @@ def MSintegral(FX,FY,X_old=X, Y_old=Y, i_bins=(nbins,nbins)):
 
 def FWIntegration(FX, FY, i_bins=(nbins,nbins)):
 
-    if i_bins == (nbins,nbins):
-        freq_1d = np.fft.fftfreq(nbins, grid_space)
-        freq_x, freq_y = np.meshgrid(freq_1d, freq_1d)
-
-    else: #interpolate
+    if i_bins != (nbins,nbins): #interpolate
         grid_new_x = np.linspace(grid.min(), grid.max(), i_bins[0])
         grid_new_y = np.linspace(grid.min(), grid.max(), i_bins[1])
         X_new, Y_new = np.meshgrid(grid_new_x, grid_new_y)
-        grid_space_x = (grid.max() - grid.min()) / (i_bins[0] - 1)
-        grid_space_y = (grid.max() - grid.min()) / (i_bins[1] - 1)
 
         r = np.stack([X.ravel(), Y.ravel()]).T
         Sx = interpolate.CloughTocher2DInterpolator(r, FX.ravel())
@@ -224,76 +142,15 @@ def FWIntegration(FX, FY, i_bins=(nbins,nbins)):
         FX = Sx(ri).reshape(X_new.shape)
         FY = Sy(ri).reshape(Y_new.shape)
 
-        freq_1d_x = np.fft.fftfreq(i_bins[0], grid_space_x)
-        freq_1d_y = np.fft.fftfreq(i_bins[1], grid_space_y)
-        freq_x, freq_y = np.meshgrid(freq_1d_x, freq_1d_y)
-
-
-    freq_hypot = np.hypot(freq_x, freq_y)
-    freq_sq = np.where(freq_hypot != 0, freq_hypot ** 2, 1E-10)
-
-    fourier_x = (np.fft.fft2(FX) * freq_x) / (2 * np.pi * 1j * freq_sq)
-    fes_x = np.real(np.fft.ifft2(fourier_x))
-
-    fourier_y = (np.fft.fft2(FY) * freq_y) / (2 * np.pi * 1j * freq_sq)
-    fes_y = np.real(np.fft.ifft2(fourier_y))
-
-    fes = fes_x + fes_y
-    fes = fes - np.min(fes)
+    [X_new, Y_new, fes] = MFI.FFT_intg_2D(FX, FY, min_grid=np.array((min_grid, min_grid)), max_grid=np.array((max_grid, max_grid)), nbins=np.array(i_bins))
 
     if i_bins == (nbins, nbins): return fes
     else: return (X_new, Y_new, fes)
 
 
-def find_hp_force(hp_centre_x, hp_centre_y, hp_kappa_x, hp_kappa_y, X , Y, min_grid, max_grid, grid_space, periodic):
-    #Calculate x-force
-    F_harmonic_x = hp_kappa_x * (X - hp_centre_x)
-    if periodic == 1:
-        grid_length = max_grid[0] - min_grid[0]
-        grid_centre = min_grid[0] + grid_length/2
-        if hp_centre_x < grid_centre:
-            index_period = index(hp_centre_x + grid_length/2, min_grid[0], grid_space[0])
-            F_harmonic_x[:, index_period:] = hp_kappa_x * (X[:, index_period:] - hp_centre_x - grid_length)
-        elif hp_centre_x > grid_centre:
-            index_period = index(hp_centre_x - grid_length/2, min_grid[0], grid_space[0])
-            F_harmonic_x[:, :index_period] = hp_kappa_x * (X[:, :index_period] - hp_centre_x + grid_length)
-    #Calculate y-force
-    F_harmonic_y = hp_kappa_y * (Y - hp_centre_y)
-    if periodic == 1:
-        grid_length = max_grid[0] - min_grid[0]
-        grid_centre = min_grid[0] + grid_length / 2
-        if hp_centre_y < grid_centre:
-            index_period = index(hp_centre_y + grid_length/2, min_grid[1], grid_space[1])
-            F_harmonic_y[index_period:, :] = hp_kappa_y * (Y[index_period:, :] - hp_centre_y - grid_length)
-        elif hp_centre_y > grid_centre:
-            index_period = index(hp_centre_y - grid_length/2, min_grid[1], grid_space[1])
-            F_harmonic_y[:index_period, :] = hp_kappa_y * (Y[:index_period, :] - hp_centre_y + grid_length)
-
-
-    #Calculate x-force
-    P_harmonic_x = hp_kappa_x/2 * (X - hp_centre_x)**2
-    if periodic == 1:
-        grid_length = max_grid[0] - min_grid[0]
-        grid_centre = min_grid[0] + grid_length/2
-        if hp_centre_x < grid_centre:
-            index_period = index(hp_centre_x + grid_length/2, min_grid[0], grid_space[0])
-            P_harmonic_x[:, index_period:] = hp_kappa_x/2 * (X[:, index_period:] - hp_centre_x - grid_length)**2
-        elif hp_centre_x > grid_centre:
-            index_period = index(hp_centre_x - grid_length/2, min_grid[0], grid_space[0])
-            P_harmonic_x[:, :index_period] = hp_kappa_x/2 * (X[:, :index_period] - hp_centre_x + grid_length)**2
-    #Calculate y-force
-    P_harmonic_y = hp_kappa_y/2 * (Y - hp_centre_y)**2
-    if periodic == 1:
-        grid_length = max_grid[0] - min_grid[0]
-        grid_centre = min_grid[0] + grid_length / 2
-        if hp_centre_y < grid_centre:
-            index_period = index(hp_centre_y + grid_length/2, min_grid[1], grid_space[1])
-            P_harmonic_y[index_period:, :] = hp_kappa_y/2 * (Y[index_period:, :] - hp_centre_y - grid_length)**2
-        elif hp_centre_y > grid_centre:
-            index_period = index(hp_centre_y - grid_length/2, min_grid[1], grid_space[1])
-            P_harmonic_y[:index_period, :] = hp_kappa_y/2 * (Y[:index_period, :] - hp_centre_y + grid_length)**2
-
-    return [F_harmonic_x, F_harmonic_y, P_harmonic_x, P_harmonic_y]
+def find_hp_force(hp_centre_x, hp_centre_y, hp_kappa_x, hp_kappa_y, X , Y, min_grid, max_grid, periodic):
+    #Force and potential of the restraint, with the minimum-image convention along periodic CVs (period = box length)
+    return geometry.harmonic_restraint_2D([hp_centre_x, hp_centre_y], [hp_kappa_x, hp_kappa_y], X, Y, min_grid, max_grid, periodic)
 
 Ftot_master = []; Ftot_patch = [] ; sd_patch = []; error_patch = [];
 count = 0; simulation_count = 1;
@@ -334,7 +191,7 @@ for i in range(total_number_of_hills):
     sigma_meta2_y = HILLS[i, 4] ** 2  # width of gausian
     gamma = HILLS[i, 6]
     height_meta = HILLS[i, 5] * ((gamma - 1) / (gamma))  # Height of Gausian
-    periodic_points = find_periodic_point(s_x,s_y)
+    periodic_points = geometry.find_periodic_points(np.array([[s_x, s_y]]), min_grid, max_grid, 1)
     for j in range(len(periodic_points)):
         kernelmeta = np.exp(-0.5 * (((X - periodic_points[j][0]) ** 2) / sigma_meta2_x + ((Y - periodic_points[j][1]) ** 2) / sigma_meta2_y))  # potential erorr in calc. of s-s_t
         # kernelmeta = np.where(((X-periodic_points[j][0]) ** 2 + (Y - periodic_points[j][1]) ** 2) ** (1 / 2) >= grid_ext, 0, kernelmeta)
@@ -352,14 +209,13 @@ for i in range(total_number_of_hills):
 
 
     # Biased probability density component of the force
-    for j in range(stride):
-        periodic_points = find_periodic_point(data_x[j], data_y[j])
-        for k in range(len(periodic_points)):
-            kernel = const * np.exp(- (1 / (2 * bw2)) * ((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2));  # check index of j
-            # kernel = np.where(((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2) ** (1 / 2) >= grid_ext, 0,kernel)
-            pb_t = pb_t + kernel;
-            Fpbt_x = Fpbt_x + kernel * kT * (X - periodic_points[k][0]) / bw2
-            Fpbt_y = Fpbt_y + kernel * kT * (Y - periodic_points[k][1]) / bw2
+    periodic_points = geometry.find_periodic_points(np.column_stack((data_x, data_y)), min_grid, max_grid, 1)  # images of all the samples of the window
+    for k in range(len(periodic_points)):
+        kernel = const * np.exp(- (1 / (2 * bw2)) * ((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2));  # check index of j
+        # kernel = np.where(((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2) ** (1 / 2) >= grid_ext, 0,kernel)
+        pb_t = pb_t + kernel;
+        Fpbt_x = Fpbt_x + kernel * kT * (X - periodic_points[k][0]) / bw2
+        Fpbt_y = Fpbt_y + kernel * kT * (Y - periodic_points[k][1]) / bw2
 
     Fpbt_x_test += Fpbt_x
 
@@ -789,57 +645,8 @@ PRINT FILE=restraint ARG=phi,psi,restraint.bias,restraint.force2 STRIDE=100
 
 
     ######### FIND HARMONIC FORCE (taking into account PBC)##################
-    F_harmonic_x = np.zeros((len(grid), len(grid)))
-    F_harmonic_y = np.zeros((len(grid), len(grid)))
-    #Calculate x-force
-    if abs(grid[IPOSX]) < grid_space: F_harmonic_x = kappa[simulation] * (X - grid[IPOSX])
-    elif grid[IPOSX] < 0:
-        SEPR = round((grid[IPOSX] + 2*np.pi) / grid_space)
-        F_harmonic_x[:, :SEPR] += kappa[simulation] * (X[:, :SEPR] - grid[IPOSX])
-        F_harmonic_x[:, SEPR:] += kappa[simulation] * (X[:, SEPR:] - grid[IPOSX] - (np.max(grid) - np.min(grid)))
-    elif grid[IPOSX] > 0:
-        SEPR = round((grid[IPOSX]) / grid_space)
-        F_harmonic_x[:, :SEPR] += kappa[simulation] * (X[:, :SEPR] - grid[IPOSX] + (np.max(grid) - np.min(grid)))
-        F_harmonic_x[:, SEPR:] += kappa[simulation] * (X[:, SEPR:] - grid[IPOSX])
-    #Calculate y-force
-    if abs(grid[IPOSY]) < grid_space: F_harmonic_y = kappa[simulation] * (Y - grid[IPOSY])
-    elif grid[IPOSY] < 0:
-        SEPR = round((grid[IPOSY] + 2*np.pi) / grid_space)
-        F_harmonic_y[:SEPR, :] += kappa[simulation] * (Y[:SEPR, :] - grid[IPOSY])
-        F_harmonic_y[SEPR:, :] += kappa[simulation] * (Y[SEPR:, :] - grid[IPOSY] - (np.max(grid) - np.min(grid)))
-    elif grid[IPOSY] > 0:
-        SEPR = round((grid[IPOSY]) / grid_space)
-        F_harmonic_y[:SEPR, :] += kappa[simulation] * (Y[:SEPR, :] - grid[IPOSY] + (np.max(grid) - np.min(grid)))
-        F_harmonic_y[SEPR:, :] += kappa[simulation] * (Y[SEPR:, :] - grid[IPOSY])
-
+    [F_harmonic_x, F_harmonic_y, P_harmonic_x, P_harmonic_y] = find_hp_force(grid[IPOSX], grid[IPOSY], kappa[simulation], kappa[simulation], X, Y, min_grid, max_grid, 1)
     F_harmonic = F_harmonic_x + F_harmonic_y
-
-
-
-
-    P_harmonic_x = np.zeros((len(grid), len(grid)))
-    P_harmonic_y = np.zeros((len(grid), len(grid)))
-    #Calculate x-force
-    if abs(grid[IPOSX]) < grid_space: P_harmonic_x = kappa[simulation]/2 * (X - grid[IPOSX])**2
-    elif grid[IPOSX] < 0:
-        SEPR = round((grid[IPOSX] + 2*np.pi) / grid_space)
-        P_harmonic_x[:, :SEPR] += kappa[simulation]/2 * (X[:, :SEPR] - grid[IPOSX])**2
-        P_harmonic_x[:, SEPR:] += kappa[simulation]/2 * (X[:, SEPR:] - grid[IPOSX] - (np.max(grid) - np.min(grid)))**2
-    elif grid[IPOSX] > 0:
-        SEPR = round((grid[IPOSX]) / grid_space)
-        P_harmonic_x[:, :SEPR] += kappa[simulation]/2 * (X[:, :SEPR] - grid[IPOSX] + (np.max(grid) - np.min(grid)))**2
-        P_harmonic_x[:, SEPR:] += kappa[simulation]/2 * (X[:, SEPR:] - grid[IPOSX])**2
-    #Calculate y-force
-    if abs(grid[IPOSY]) < grid_space: P_harmonic_y = kappa[simulation]/2 * (Y - grid[IPOSY])**2
-    elif grid[IPOSY] < 0:
-        SEPR = round((grid[IPOSY] + 2*np.pi) / grid_space)
-        P_harmonic_y[:SEPR, :] += kappa[simulation]/2 * (Y[:SEPR, :] - grid[IPOSY])**2
-        P_harmonic_y[SEPR:, :] += kappa[simulation]/2 * (Y[SEPR:, :] - grid[IPOSY] - (np.max(grid) - np.min(grid)))**2
-    elif grid[IPOSY] > 0:
-        SEPR = round((grid[IPOSY]) / grid_space)
-        P_harmonic_y[:SEPR, :] += kappa[simulation]/2 * (Y[:SEPR, :] - grid[IPOSY] + (np.max(grid) - np.min(grid)))**2
-        P_harmonic_y[SEPR:, :] += kappa[simulation]/2 * (Y[SEPR:, :] - grid[IPOSY])**2
-
     P_harmonic = P_harmonic_x + P_harmonic_y
 
 
@@ -919,7 +726,7 @@ PRINT FILE=restraint ARG=phi,psi,restraint.bias,restraint.force2 STRIDE=100
         sigma_meta2_x = HILLS[i, 3] ** 2 ; sigma_meta2_y = HILLS[i, 4] ** 2  # width of gausian
         gamma = HILLS[i, 6]; height_meta = HILLS[i, 5] * ((gamma - 1) / (gamma))  # Height of Gausian
 
-        periodic_points = find_periodic_point(s_x, s_y)
+        periodic_points = geometry.find_periodic_points(np.array([[s_x, s_y]]), min_grid, max_grid, 1)
         for j in range(len(periodic_points)):
             kernelmeta = np.exp(-0.5 * (((X - periodic_points[j][0]) ** 2) / sigma_meta2_x + ((Y - periodic_points[j][1]) ** 2) / sigma_meta2_y))  # potential erorr in calc. of s-s_t
             # kernelmeta = np.where(((X-periodic_points[j][0]) ** 2 + (Y - periodic_points[j][1]) ** 2) ** (1 / 2) >= grid_ext, 0, kernelmeta)
@@ -936,15 +743,14 @@ PRINT FILE=restraint ARG=phi,psi,restraint.bias,restraint.force2 STRIDE=100
         data_y = position_y[i * stride: (i + 1) * stride]
 
         # Biased probability density component of the force
-        for j in range(stride):
-            periodic_points = find_periodic_point(data_x[j], data_y[j])
-            for k in range(len(periodic_points)):
-                # kernel = const * np.exp( - (1 / (2 * bw2)) * ((X - data_x[j]) ** 2 + (Y - data_y[j]) ** 2));  # check index of j
-                kernel = const * np.exp(- (1 / (2 * bw2)) * ((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2));  # check index of j
-                # kernel = np.where(((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2) ** (1 / 2) >= grid_ext, 0,kernel)
-                pb_t = pb_t + kernel;
-                Fpbt_x = Fpbt_x + kernel * kT * (X - periodic_points[k][0]) / bw2
-                Fpbt_y = Fpbt_y + kernel * kT * (Y - periodic_points[k][1]) / bw2
+        periodic_points = geometry.find_periodic_points(np.column_stack((data_x, data_y)), min_grid, max_grid, 1)  # images of all the samples of the window
+        for k in range(len(periodic_points)):
+            # kernel = const * np.exp( - (1 / (2 * bw2)) * ((X - data_x[j]) ** 2 + (Y - data_y[j]) ** 2));  # check index of j
+            kernel = const * np.exp(- (1 / (2 * bw2)) * ((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2));  # check index of j
+            # kernel = np.where(((X - periodic_points[k][0]) ** 2 + (Y - periodic_points[k][1]) ** 2) ** (1 / 2) >= grid_ext, 0,kernel)
+            pb_t = pb_t + kernel;
+            Fpbt_x = Fpbt_x + kernel * kT * (X - periodic_points[k][0]) / bw2
+            Fpbt_y = Fpbt_y + kernel * kT * (Y - periodic_points[k][1]) / bw2
 
         Fpbt_x_test += Fpbt_x
 
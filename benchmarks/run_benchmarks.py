@@ -0,0 +1,276 @@
+"""Offline performance benchmarks of pyMFI on slices of the bundled simulation data.
+
+Times the loaders, MFI_2D, MFI_1D, FFT_intg_2D, intg_2D and patch_2D_error, scaling along the number of hills, the stride, nbins and the number of walkers,
+and writes the results as JSON: for every benchmark its name and parameters, the best wall time, the throughput items_per_s (hills/s for MFI_2D and MFI_1D,
+rows/s for the loaders, walkers/s for patch_2D_error, calls/s for the integrators) and the peak memory allocated by one call. With --baseline, the results are compared to an earlier JSON file and the script exits with status 1 if any benchmark got slower
+(or its peak memory grew) by more than the tolerance.
+Keyword arguments added to MFI_2D and MFI_1D after the baseline (callback, cutoff, separable, dtype) are only passed when the checked-out version accepts them,
+and the benchmarks of options it does not have are skipped, so the same script also runs on older commits to record their baseline.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --output new.json --baseline baseline.json
+    python benchmarks/run_benchmarks.py --quick --filter MFI_2D
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from pyMFI import MFI, MFI1D  # noqa: E402
+
+ANTONIU = os.path.join(REPO, "Antoniu_2D_potential")
+INVERNIZZI = os.path.join(REPO, "Invernizzi_2D_potential")
+ALANINE = os.path.join(REPO, "AlanineDipeptide_pyMFI")
+BJOLA = os.path.join(REPO, "Bjola_upgrade_report_files")
+
+# Analysis settings of the bundled datasets: [min_grid, max_grid, bw, periodic]
+GRIDS = {"antoniu": [np.array((-3, -3)), np.array((3, 3)), 0.1, 0],
+         "invernizzi": [np.array((-3, -3)), np.array((3, 3)), 0.1, 0],
+         "alanine": [np.array((-np.pi, -np.pi)), np.array((np.pi, np.pi)), 0.1, 1]}
+
+
+def supported(function, options):
+    """Whether function accepts all the keyword arguments in options."""
+    parameters = inspect.signature(function).parameters
+    return all(name in parameters for name in options)
+
+
+def silent(function):
+    """callback=[] if function accepts it (no progress printed during the timings), else no keyword arguments."""
+    return {"callback": []} if supported(function, ["callback"]) else {}
+
+
+def count_rows(file_name):
+    """Number of data (non-comment) rows of a PLUMED file."""
+    with open(file_name, "rb") as f:
+        return sum(1 for line in f if line.strip() and not line.startswith(b"#"))
+
+
+def measure(function, repeat):
+    """Best wall time of repeat calls of function, and the peak memory allocated by one call (traced separately, as tracing slows the call down).
+    Calls faster than 50 ms are looped, and timed together, until a timing lasts at least 50 ms.
+
+    Returns:
+        time_s: best wall time per call in seconds.
+        peak_memory_mb: peak memory allocated during the call, in MB.
+    """
+    start = time.perf_counter()
+    function()
+    loops = max(1, int(0.05 / max(time.perf_counter() - start, 1E-6)))
+    times = []
+    for k in range(repeat):
+        start = time.perf_counter()
+        for loop in range(loops):
+            function()
+        times.append((time.perf_counter() - start) / loops)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return [min(times), peak / 1024**2]
+
+
+def load_2D(dataset, walker=0):
+    """HILLS and [position_x, position_y] of one walker of a bundled 2D dataset."""
+    if dataset == "antoniu":
+        [hills_name, position_name] = [os.path.join(ANTONIU, "HILLS_" + str(walker)), os.path.join(ANTONIU, "position_" + str(walker))]
+    elif dataset == "invernizzi":
+        [hills_name, position_name] = [os.path.join(INVERNIZZI, "HILLSinve_" + str(walker)), os.path.join(INVERNIZZI, "positioninve_" + str(walker))]
+    else:
+        [hills_name, position_name] = [os.path.join(ALANINE, "HILLS"), os.path.join(ALANINE, "position")]
+    return [MFI.load_HILLS_2D(hills_name=hills_name), MFI.load_position_2D(position_name=position_name)]
+
+
+def run_MFI_2D(dataset, nhills, nbins, subsample=1, walker=0, **kwargs):
+    """MFI_2D on the first nhills hills of a walker; subsample > 1 keeps every subsample-th position, i.e. divides the stride."""
+    [HILLS, [position_x, position_y]] = load_2D(dataset, walker)
+    [min_grid, max_grid, bw, periodic] = GRIDS[dataset]
+    stride = len(position_x) // len(HILLS)
+    [position_x, position_y] = [position_x[:nhills * stride:subsample], position_y[:nhills * stride:subsample]]
+    return lambda: MFI.MFI_2D(HILLS=HILLS[:nhills], position_x=position_x, position_y=position_y, bw=bw, min_grid=min_grid, max_grid=max_grid,
+                              nbins=np.array((nbins, nbins)), periodic=periodic, error_pace=10, log_pace=10, **dict(silent(MFI.MFI_2D), **kwargs))
+
+
+def load_1D(simulation, nhills):
+    """HILLS and position of the first nhills hill windows of a bundled 1D simulation.
+    simple_simulation is unbiased and has no HILLS file: its hills are zero-height kernels placed every 10 positions (the pace of the biased runs),
+    so that MFI_1D reduces to the KDE estimate of the unbiased mean force."""
+    position = MFI1D.load_position(position_name=os.path.join(BJOLA, simulation, "position"))
+    if simulation == "simple_simulation":
+        HILLS = np.zeros((len(position) // 10, 5))
+        [HILLS[:, 0], HILLS[:, 1], HILLS[:, 2], HILLS[:, 4]] = [np.arange(len(HILLS)), position[::10][:len(HILLS)], 0.1, 1]
+    else:
+        HILLS = MFI1D.load_HILLS(hills_name=os.path.join(BJOLA, simulation, "HILLS"))
+    stride = len(position) // len(HILLS)
+    return [HILLS[:nhills], position[:nhills * stride]]
+
+
+def benchmarks(quick):
+    """List of the benchmarks: [name, params, setup], setup() returning the function to time and the number of hills (or rows) it processes."""
+    hills = [100, 250] if quick else [100, 250, 500]
+    nbins = [50, 100] if quick else [50, 100, 200]
+    subsamples = [4, 1] if quick else [4, 2, 1]
+    walkers = [1, 4] if quick else [1, 4, 8, 16]
+    grid_sizes = [100, 200] if quick else [100, 200, 400]
+    hills_1D = [1000] if quick else [1000, 5000, 10000]
+    cases = []
+
+    for dataset, prefix in [["antoniu", "HILLS_0"], ["invernizzi", "HILLSinve_0"]]:
+        directory = ANTONIU if dataset == "antoniu" else INVERNIZZI
+        hills_name = os.path.join(directory, prefix)
+        position_name = os.path.join(directory, prefix.replace("HILLS", "position"))
+        cases.append(["load_HILLS_2D", {"dataset": dataset}, lambda name=hills_name: [lambda: MFI.load_HILLS_2D(hills_name=name), count_rows(name)]])
+        cases.append(["load_position_2D", {"dataset": dataset}, lambda name=position_name: [lambda: MFI.load_position_2D(position_name=name), count_rows(name)]])
+
+    for n in hills:
+        cases.append(["MFI_2D", {"dataset": "antoniu", "nhills": n, "nbins": 100}, lambda n=n: [run_MFI_2D("antoniu", n, 100), n]])
+    for size in nbins:
+        cases.append(["MFI_2D", {"dataset": "antoniu", "nhills": 100, "nbins": size}, lambda size=size: [run_MFI_2D("antoniu", 100, size), 100]])
+    for subsample in subsamples:
+        # invernizzi walkers have a stride of 20 positions per hill
+        cases.append(["MFI_2D", {"dataset": "invernizzi", "nhills": 100, "nbins": 100, "stride": 20 // subsample}, lambda subsample=subsample: [run_MFI_2D("invernizzi", 100, 100, subsample), 100]])
+    cases.append(["MFI_2D", {"dataset": "alanine", "nhills": 12, "nbins": 100}, lambda: [run_MFI_2D("alanine", 12, 100), 12]])
+    for options in [{}, {"cutoff": 5}, {"separable": True}, {"dtype": "float32"}, {"dtype": "float32", "cutoff": 5}]:
+        if not supported(MFI.MFI_2D, options):
+            continue
+        cases.append(["MFI_2D", dict({"dataset": "antoniu", "nhills": 250, "nbins": 200}, **options), lambda options=options: [run_MFI_2D("antoniu", 250, 200, **options), 250]])
+
+    # large, mostly unvisited grid: tiled against dense accumulators, both with a cutoff
+    for options in [{"cutoff": 5}, {"cutoff": 5, "tile_size": 64}]:
+        if not supported(MFI.MFI_2D, options):
+            continue
+        cases.append(["MFI_2D", dict({"dataset": "antoniu", "nhills": 250, "nbins": 1000}, **options), lambda options=options: [run_MFI_2D("antoniu", 250, 1000, **options), 250]])
+
+    for simulation in ["simple_simulation", "MetaD_simulation", "MetaD_WT_simulation"]:
+        cases.append(["load_position", {"dataset": simulation}, lambda name=os.path.join(BJOLA, simulation, "position"): [lambda: MFI1D.load_position(position_name=name), count_rows(name)]])
+    for simulation, WellTempered in [["simple_simulation", 0], ["MetaD_simulation", 0], ["MetaD_WT_simulation", 1]]:
+        for n in hills_1D:
+            def setup_1D(simulation=simulation, WellTempered=WellTempered, n=n):
+                [HILLS, position] = load_1D(simulation, n)
+                return [lambda: MFI1D.MFI_1D(HILLS=HILLS, position=position, bw=0.02, min_grid=-2, max_grid=2, nbins=201, WellTempered=WellTempered, **silent(MFI1D.MFI_1D)), n]
+            cases.append(["MFI_1D", {"dataset": simulation, "nhills": n}, setup_1D])
+    if supported(MFI1D.MFI_1D, ["cutoff"]):
+        def setup_1D_cutoff(n=hills_1D[-1]):
+            [HILLS, position] = load_1D("MetaD_WT_simulation", n)
+            return [lambda: MFI1D.MFI_1D(HILLS=HILLS, position=position, bw=0.02, min_grid=-2, max_grid=2, nbins=2001, WellTempered=1, cutoff=5, **silent(MFI1D.MFI_1D)), n]
+        cases.append(["MFI_1D", {"dataset": "MetaD_WT_simulation", "nhills": hills_1D[-1], "nbins": 2001, "cutoff": 5}, setup_1D_cutoff])
+
+    for size in grid_sizes:
+        def setup_integration(function, size=size):
+            X, Y = np.meshgrid(np.linspace(-np.pi, np.pi, size), np.linspace(-np.pi, np.pi, size))
+            [FX, FY] = [np.sin(X) * np.cos(Y), np.cos(X) * np.sin(Y)]
+            return [lambda: function(FX, FY, nbins=np.array((size, size))), 1]
+        cases.append(["FFT_intg_2D", {"nbins": size}, lambda setup=setup_integration: setup(MFI.FFT_intg_2D)])
+        cases.append(["intg_2D", {"nbins": size}, lambda setup=setup_integration: setup(MFI.intg_2D)])
+
+    for n in walkers:
+        def setup_patch(n=n):
+            # terms of the first walkers (cycling through the 24 bundled ones), computed once outside the timed call
+            master = []
+            for walker in range(n):
+                results = run_MFI_2D("antoniu", 50, 100, walker=walker % 24)()
+                [Ftot_den, Ftot_x, Ftot_y, Ftot_den2, ofv_x, ofv_y] = [results[k] for k in [2, 3, 4, 7, 8, 9]]
+                master.append([Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y])
+            master = np.array(master)
+            return [lambda: MFI.patch_2D_error(master, nbins=np.array((100, 100))), n]
+        cases.append(["patch_2D_error", {"walkers": n, "nbins": 100}, setup_patch])
+
+    return cases
+
+
+def environment():
+    """Versions and machine of the run, stored with the results."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "processor": platform.processor(), "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def key(result):
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    """Compare results to a baseline run, print the ratios and return the regressions.
+
+    Args:
+        results (list): Results of this run.
+        baseline (list): Results of the baseline run.
+        tolerance (float): Relative increase of the time flagged as a regression.
+        memory_tolerance (float): Relative increase of the peak memory flagged as a regression.
+
+    Returns:
+        list of the names and params of the benchmarks that regressed.
+    """
+    baseline = {key(result): result for result in baseline}
+    regressions = []
+    print("\n%-60s %10s %10s %8s %8s" % ("benchmark", "time (s)", "base (s)", "time", "memory"))
+    for result in results:
+        reference = baseline.get(key(result))
+        if reference is None:
+            print("%-60s %10.4f %10s" % (key(result)[:60], result["time_s"], "new"))
+            continue
+        time_ratio = result["time_s"] / reference["time_s"]
+        memory_ratio = result["peak_memory_mb"] / reference["peak_memory_mb"] if reference["peak_memory_mb"] > 0 else 1
+        regressed = time_ratio > 1 + tolerance or memory_ratio > 1 + memory_tolerance
+        print("%-60s %10.4f %10.4f %7.2fx %7.2fx%s" % (key(result)[:60], result["time_s"], reference["time_s"], time_ratio, memory_ratio, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(key(result))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="JSON file for the results (default: print them)")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slow-down flagged as a regression (default: 0.25)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.10, help="relative peak memory increase flagged as a regression (default: 0.10)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed calls per benchmark, the best is kept (default: 3)")
+    parser.add_argument("--quick", action="store_true", help="smaller sweeps, for a fast check")
+    parser.add_argument("--filter", help="only run the benchmarks whose name contains this string")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, params, setup in benchmarks(args.quick):
+        if args.filter is not None and args.filter not in name:
+            continue
+        [function, n_items] = setup()
+        with np.errstate(divide="ignore", invalid="ignore"):  # e.g. MFI_1D in single-window bins, irrelevant for the timings
+            [time_s, peak_memory_mb] = measure(function, args.repeat)
+        result = {"name": name, "params": params, "time_s": time_s, "items_per_s": n_items / time_s, "peak_memory_mb": peak_memory_mb}
+        results.append(result)
+        print("%-60s %10.4f s %12.1f /s %10.1f MB" % (key(result)[:60], time_s, result["items_per_s"], peak_memory_mb), file=sys.stderr)
+
+    report = {"environment": environment(), "repeat": args.repeat, "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+        if regressions:
+            print("\n" + str(len(regressions)) + " regression(s)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,89 +1,792 @@
+import functools
 import glob
+import itertools
+import os
+import time
+import warnings
 import matplotlib.pyplot as plt
-#from numba import jit 
-#from numba import njit
 import numpy as np
+import scipy.fft
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.stats
+from . import geometry
+from . import plumed_files
+from . import progress
+try:
+    from . import numba_backend
+except ImportError:
+    numba_backend = None
 
 ### Load files ####
-def load_HILLS_2D(hills_name = "HILLS"):
-    """_summary_
+def load_HILLS_2D(hills_name = "HILLS", cache = False):
+    """Load a 2D HILLS file. The columns are selected by name from the FIELDS header (see plumed_files.load_plumed_file).
+    The hills are shifted by one row, with a first hill of zero height, so that row i is the last hill deposited before the i-th window of positions.
 
     Args:
-        hills_name (str, optional): _description_. Defaults to "HILLS".
+        hills_name (str, optional): Name of the HILLS file. Defaults to "HILLS".
+        cache (bool, optional): Store and reuse a binary .npy sidecar of the file. Defaults to False.
 
     Returns:
-        _type_: _description_
+        array of size (number_of_hills, 7) - time, CV1, CV2, sigma_CV1, sigma_CV2, height, biasfactor (without the biasfactor column, only needed with WellTempered=1, if the file has none).
     """
     for file in glob.glob(hills_name):
-        hills = np.loadtxt(file)
+        hills = plumed_files.load_plumed_file(file, plumed_files.hills_fields(file, 2), cache=cache)
         hills = np.concatenate(([hills[0]], hills[:-1]))
         hills[0][5] = 0
     return hills
 
-def load_position_2D(position_name = "position"):
+def load_position_2D(position_name = "position", fields = None, cache = False):
+    """Load the CVs from a 2D position (COLVAR) file. The last row is discarded.
+
+    Args:
+        position_name (str, optional): Name of the position file. Defaults to "position".
+        fields (list, optional): Names of the CV1 and CV2 columns in the FIELDS header. Defaults to None, i.e. the two columns after time.
+        cache (bool, optional): Store and reuse a binary .npy sidecar of the file. With an up-to-date sidecar the returned arrays are memory-mapped views. Defaults to False.
+
+    Returns:
+        list: [position_x, position_y]
+    """
     for file1 in glob.glob(position_name):
-        colvar = np.loadtxt(file1)
-        position_x = colvar[:-1, 1]
-        position_y = colvar[:-1, 2]
+        colvar = plumed_files.load_plumed_file(file1, fields if fields is not None else (plumed_files.read_fields(file1) or [0, 1, 2])[1:3], cache=cache)
+        position_x = colvar[:-1, 0]
+        position_y = colvar[:-1, 1]
     return [position_x, position_y]
+
+def infer_stride_2D(hills_name = "HILLS", position_name = "position"):
+    """Number of position samples per hill, from the number of rows of the files (as MFI_2D infers it from load_HILLS_2D and load_position_2D, which discards the last position row)."""
+    return int((plumed_files.count_rows(position_name) - 1) / plumed_files.count_rows(hills_name))
+
+def stream_windows_2D(hills_name = "HILLS", position_name = "position", stride = None, fields = None, block_rows = 100000):
+    """Read the HILLS and position files one hill window at a time, in the layout of load_HILLS_2D and load_position_2D.
+    Both files are read in blocks (see plumed_files.iter_plumed_file), so only about block_rows positions are in memory at once, whatever the length of the trajectory.
+
+    Args:
+        hills_name (str, optional): Name of the HILLS file. Defaults to "HILLS".
+        position_name (str, optional): Name of the position (COLVAR) file. Defaults to "position".
+        stride (int, optional): Number of position samples per hill (PLUMED METAD PACE / PRINT STRIDE). Defaults to None, i.e. inferred from the number of rows of the files (see infer_stride_2D).
+        fields (list, optional): Names of the CV1 and CV2 columns of the position file. Defaults to None, i.e. the two columns after time.
+        block_rows (int, optional): Number of position rows read from disk at a time. Defaults to 100000.
+
+    Yields:
+        list: [hill, data_x, data_y] - the row of load_HILLS_2D for window i, and the stride CV1 and CV2 samples of the window.
+    """
+    if stride is None:
+        stride = infer_stride_2D(hills_name, position_name)
+    if fields is None:
+        fields = (plumed_files.read_fields(position_name) or [0, 1, 2])[1:3]
+    hills_blocks = plumed_files.iter_plumed_file(hills_name, plumed_files.hills_fields(hills_name, 2), block_rows=max(1, block_rows // stride))
+    position_blocks = plumed_files.iter_plumed_file(position_name, fields, block_rows=max(block_rows, stride))
+
+    previous_hill = None
+    positions = np.zeros((2, 0))
+    for hills in hills_blocks:
+        for hill in hills:
+            if previous_hill is None:
+                # As in load_HILLS_2D, the first window is analysed without bias
+                window_hill = hill.copy()
+                window_hill[5] = 0
+            else:
+                window_hill = previous_hill
+            previous_hill = hill
+
+            while positions.shape[1] < stride:
+                block = next(position_blocks, None)
+                if block is None:
+                    return
+                positions = np.concatenate((positions, block.T), axis=1)
+            yield [window_hill, positions[0, :stride], positions[1, :stride]]
+            positions = positions[:, stride:]
+
+class FollowedFile:
+    """Incremental reader of a PLUMED output file (HILLS, COLVAR, position) that is still being written.
+    The columns are selected by name from the latest "#! FIELDS" header read so far (PLUMED repeats it after a restart), so extra or reordered columns are handled as by plumed_files.load_plumed_file.
+
+    Args:
+        file_name (str): Name of the file. It does not need to exist yet.
+        fields (list or callable, optional): Columns to return, names of the FIELDS header (or indices for a file without header),
+            or a function of the list of FIELDS names (None for a file without header) returning them, e.g. for HILLS files whose CV names are not known in advance.
+            Defaults to None, i.e. all the columns.
+    """
+
+    def __init__(self, file_name, fields=None):
+        self.file_name = file_name
+        self.fields = fields
+        self._file = None
+        self._partial_line = ""
+        self._all_fields = None
+        self._columns = None
+
+    def _select_columns(self):
+        fields = self.fields(self._all_fields) if callable(self.fields) else self.fields
+        if fields is None:
+            return None
+        if self._all_fields is None:
+            return [int(field) for field in fields]
+        return [field if isinstance(field, (int, np.integer)) else self._all_fields.index(field) for field in fields]
+
+    def read_rows(self):
+        """Read the rows completed since the last call. Comment lines and the incomplete last line are skipped.
+
+        Returns:
+            array of size (n_new_rows, n_columns) - the selected columns of the new rows.
+        """
+        if self._file is None:
+            if not os.path.exists(self.file_name):
+                return np.zeros((0, len(self._columns) if self._columns is not None else 0))
+            self._file = open(self.file_name, "r")
+
+        lines = (self._partial_line + self._file.read()).split("\n")
+        self._partial_line = lines.pop()
+        rows = []
+        for line in lines:
+            if line.startswith("#! FIELDS"):
+                self._all_fields = line.split()[2:]
+                self._columns = self._select_columns()
+            elif line.strip() and not line.startswith("#"):
+                values = line.split()
+                if self._columns is None:
+                    self._columns = self._select_columns() or list(range(len(values)))
+                rows.append([values[k] for k in self._columns])
+        return np.array(rows, dtype=float).reshape(-1, len(self._columns) if self._columns is not None else 0)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+def follow_MFI_2D(hills_name = "HILLS", position_name = "position", stride = 10, fields = None, poll_interval = 1, timeout = 60, **kwargs):
+    """Run MFI on HILLS and position files while PLUMED is still writing them. Only the newly completed hill windows are analysed at every poll.
+
+    Args:
+        hills_name (str, optional): Name of the HILLS file, its columns are selected from the FIELDS header (see plumed_files.hills_fields). Defaults to "HILLS".
+        position_name (str, optional): Name of the position (COLVAR) file. Defaults to "position".
+        stride (int, optional): Number of position samples per hill (PLUMED METAD PACE / PRINT STRIDE). Defaults to 10.
+        fields (list, optional): Names of the CV1 and CV2 columns of the position file. Defaults to None, i.e. the two columns after time.
+        poll_interval (float, optional): Seconds between checks for new data. Defaults to 1.
+        timeout (float, optional): Stop when no new hill window is completed for this many seconds. None to follow the files forever. Defaults to 60.
+        **kwargs: Arguments of MFI2DAccumulator (bw, kT, min_grid, max_grid, nbins, WellTempered, periodic, cutoff, separable, backend).
+
+    Yields:
+        MFI2DAccumulator: the accumulator, after each update that completed new windows (with ofe and ofe_history up to date). Use its results() method for the current force, density and ofe maps.
+    """
+    accumulator = MFI2DAccumulator(stride=stride, **kwargs)
+    hills_file = FollowedFile(hills_name, lambda all_fields: plumed_files.select_hills_fields(all_fields, 2, hills_name))
+    position_file = FollowedFile(position_name, fields if fields is not None else lambda all_fields: (all_fields or [0, 1, 2])[1:3])
+    last_update = time.time()
+    try:
+        while True:
+            new_positions = np.reshape(position_file.read_rows(), (-1, 2))
+            if accumulator.update(hills_file.read_rows(), [new_positions[:, 0], new_positions[:, 1]]) > 0:
+                accumulator.compute_error()
+                last_update = time.time()
+                yield accumulator
+            elif timeout is not None and time.time() - last_update > timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+    finally:
+        hills_file.close()
+        position_file.close()
 #######
 
 ### Periodic CVs utils
-#@jit
 def find_periodic_point(x_coord,y_coord,min_grid,max_grid,periodic):
-    """_summary_
+    """Periodic images of a single point, see geometry.find_periodic_points (used for whole windows of points by MFI_2D).
 
     Args:
-        x_coord (_type_): _description_
-        y_coord (_type_): _description_
-        min_grid (_type_): _description_
-        max_grid (_type_): _description_
-        periodic (_type_): _description_
+        x_coord (float): CV1 coordinate.
+        y_coord (float): CV2 coordinate.
+        min_grid (array): Lower bound of the simulation domain.
+        max_grid (array): Upper bound of the simulation domain.
+        periodic (int or array): Is the CV space periodic? 1 for yes, for both CVs or one value per CV.
 
     Returns:
-        _type_: _description_
+        list: [x, y] coordinates of the point followed by its periodic copies (up to 3), shifted by the box length max_grid - min_grid.
     """
-    
-    #Use periodic extension for defining PBC
-    periodic_extension = periodic * 1 / 2
-    grid_ext = (1/2) * periodic_extension * (max_grid-min_grid)
-    
-    coord_list = []
-    #There are potentially 4 points, 1 original and 3 periodic copies
-    coord_list.append([x_coord,y_coord])
-    copy_record = [0,0,0,0]
-    #check for x-copy
-    if x_coord < min_grid[0]+grid_ext[0]:
-        coord_list.append([x_coord + 2*np.pi,y_coord])
-        copy_record[0] = 1
-    elif x_coord > max_grid[0]-grid_ext[0]:
-        coord_list.append([x_coord - 2*np.pi,y_coord])
-        copy_record[1] = 1
-    #check for y-copy
-    if y_coord < min_grid[1]+grid_ext[1]:
-        coord_list.append([x_coord, y_coord + 2 * np.pi])
-        copy_record[2] = 1
-    elif y_coord > max_grid[1]-grid_ext[1]:
-        coord_list.append([x_coord, y_coord - 2 * np.pi])
-        copy_record[3] = 1
-    #check for xy-copy
-    if sum(copy_record) == 2:
-        if copy_record[0] == 1 and copy_record[2] == 1: coord_list.append([x_coord + 2 * np.pi, y_coord + 2 * np.pi])
-        elif copy_record[1] == 1 and copy_record[2] == 1: coord_list.append([x_coord - 2 * np.pi, y_coord + 2 * np.pi])
-        elif copy_record[0] == 1 and copy_record[3] == 1: coord_list.append([x_coord + 2 * np.pi, y_coord - 2 * np.pi])
-        elif copy_record[1] == 1 and copy_record[3] == 1: coord_list.append([x_coord - 2 * np.pi, y_coord - 2 * np.pi])
-
-    return coord_list
+    return geometry.find_periodic_points(np.array([[x_coord, y_coord]]), min_grid, max_grid, periodic).tolist()
+
+def find_stencil(coord, radius, min_grid, grid_space, nbins):
+    """Find the range of grid indices within a given radius of a coordinate, clipped to the grid.
+
+    Args:
+        coord (float): Centre of the kernel.
+        radius (float): Half-width of the stencil.
+        min_grid (float): Lower bound of the grid.
+        grid_space (float): Distance between neighbouring grid points.
+        nbins (int): Number of grid points.
+
+    Returns:
+        slice: Slice of the grid points within [coord - radius, coord + radius]. Empty if the kernel lies outside the grid.
+    """
+    lower = max(int(np.ceil((coord - radius - min_grid) / grid_space)), 0)
+    upper = min(int(np.floor((coord + radius - min_grid) / grid_space)) + 1, nbins)
+    return slice(lower, max(lower, upper))
+
+def kernel_stencil_2D(x_coord, y_coord, sigma2_x, sigma2_y, gridx, gridy, cutoff):
+    """Evaluate a Gaussian kernel only on the grid points within cutoff standard deviations of its centre.
+
+    Args:
+        x_coord (float): CV1 centre of the kernel.
+        y_coord (float): CV2 centre of the kernel.
+        sigma2_x (float): Variance of the kernel along CV1.
+        sigma2_y (float): Variance of the kernel along CV2.
+        gridx (array): CV1 grid points.
+        gridy (array): CV2 grid points.
+        cutoff (float): Truncation radius, in units of standard deviations.
+
+    Returns:
+        stencil: tuple of (CV2, CV1) slices locating the stencil on the (nbins[1], nbins[0]) grid.
+        dx: array of size (1, width_x) - CV1 distance of the stencil points from the centre.
+        dy: array of size (width_y, 1) - CV2 distance of the stencil points from the centre.
+        kernel: array of size (width_y, width_x) - kernel values on the stencil. None if the stencil is empty.
+    """
+    slice_x = find_stencil(x_coord, cutoff * np.sqrt(sigma2_x), gridx[0], gridx[1] - gridx[0], len(gridx))
+    slice_y = find_stencil(y_coord, cutoff * np.sqrt(sigma2_y), gridy[0], gridy[1] - gridy[0], len(gridy))
+    if slice_x.start == slice_x.stop or slice_y.start == slice_y.stop:
+        return [(slice_y, slice_x), None, None, None]
+
+    dx = (gridx[slice_x] - x_coord)[np.newaxis, :]
+    dy = (gridy[slice_y] - y_coord)[:, np.newaxis]
+    kernel = np.exp(-0.5 * dy ** 2 / sigma2_y) * np.exp(-0.5 * dx ** 2 / sigma2_x)
+    return [(slice_y, slice_x), dx, dy, kernel]
+
+def separable_kernels_2D(centres, sigma2_x, sigma2_y, gridx, gridy, cutoff=None):
+    """Build the 1D factors of a set of axis-aligned Gaussian kernels, exp(-dx**2/(2*sigma2_x)-dy**2/(2*sigma2_y)) = Ky * Kx.
+    Sums of 2D kernels (and of kernels times displacement) over all centres then reduce to matrix products, e.g. Ky.T @ Kx.
+
+    Args:
+        centres (array): array of size (n_kernels, 2) - CV1, CV2 centres of the kernels (periodic images included).
+        sigma2_x (float): Variance of the kernels along CV1, or array of size (n_kernels, 1) with one variance per kernel.
+        sigma2_y (float): Variance of the kernels along CV2, or array of size (n_kernels, 1) with one variance per kernel.
+        gridx (array): CV1 grid points.
+        gridy (array): CV2 grid points.
+        cutoff (float, optional): If set, kernel values further than cutoff standard deviations from the centre are set to zero. Defaults to None.
+
+    Returns:
+        Kx: array of size (n_kernels, nbins[0]) - CV1 factor of the kernels.
+        Ky: array of size (n_kernels, nbins[1]) - CV2 factor of the kernels.
+        dx: array of size (n_kernels, nbins[0]) - CV1 distance of the grid points from the centres.
+        dy: array of size (n_kernels, nbins[1]) - CV2 distance of the grid points from the centres.
+    """
+    dx = gridx[np.newaxis, :] - centres[:, [0]]
+    dy = gridy[np.newaxis, :] - centres[:, [1]]
+    Kx = np.exp(-0.5 * dx ** 2 / sigma2_x)
+    Ky = np.exp(-0.5 * dy ** 2 / sigma2_y)
+    if cutoff is not None:
+        Kx[dx ** 2 > cutoff ** 2 * sigma2_x] = 0
+        Ky[dy ** 2 > cutoff ** 2 * sigma2_y] = 0
+    return [Kx, Ky, dx, dy]
+
+class TiledGrid:
+    """Sparse 2D grid stored as square tiles, allocated when they are first written.
+    Reading a region through grid[stencil] returns zeros for tiles that do not exist yet, and writing it with grid[stencil] = values (or +=) allocates them,
+    so the stencil updates of MFI2DAccumulator work unchanged on dense arrays and on tiled grids.
+
+    Args:
+        shape (tuple): Shape of the full grid, (nbins[1], nbins[0]).
+        tile_size (int): Number of bins along each side of a tile (the tiles on the upper edges can be smaller).
+        dtype (optional): Data type of the tiles. Defaults to np.float64.
+    """
+
+    def __init__(self, shape, tile_size, dtype=np.float64):
+        self.shape = tuple(int(n) for n in shape)
+        self.tile_size = int(tile_size)
+        self.dtype = np.dtype(dtype)
+        self.tiles = {}
+
+    def tile(self, key):
+        """Tile key = (tile row, tile column), allocated (zero) if needed."""
+        if key not in self.tiles:
+            t = self.tile_size
+            self.tiles[key] = np.zeros((min(t, self.shape[0] - key[0] * t), min(t, self.shape[1] - key[1] * t)), dtype=self.dtype)
+        return self.tiles[key]
+
+    def tile_slices(self, key):
+        """(CV2, CV1) slices of tile key in the full grid."""
+        t = self.tile_size
+        return (slice(key[0] * t, min((key[0] + 1) * t, self.shape[0])), slice(key[1] * t, min((key[1] + 1) * t, self.shape[1])))
+
+    def _overlaps(self, stencil):
+        """Yield (key, slices in the tile, slices in the stencil) for every tile overlapping the (CV2, CV1) slices of stencil."""
+        [slice_y, slice_x] = [slice(*axis.indices(n)[:2]) for axis, n in zip(stencil, self.shape)]
+        if slice_y.stop <= slice_y.start or slice_x.stop <= slice_x.start:
+            return
+        t = self.tile_size
+        for ty in range(slice_y.start // t, (slice_y.stop - 1) // t + 1):
+            [y0, y1] = [max(slice_y.start, ty * t), min(slice_y.stop, (ty + 1) * t)]
+            for tx in range(slice_x.start // t, (slice_x.stop - 1) // t + 1):
+                [x0, x1] = [max(slice_x.start, tx * t), min(slice_x.stop, (tx + 1) * t)]
+                yield [(ty, tx), (slice(y0 - ty * t, y1 - ty * t), slice(x0 - tx * t, x1 - tx * t)), (slice(y0 - slice_y.start, y1 - slice_y.start), slice(x0 - slice_x.start, x1 - slice_x.start))]
+
+    def __getitem__(self, stencil):
+        [slice_y, slice_x] = [slice(*axis.indices(n)[:2]) for axis, n in zip(stencil, self.shape)]
+        values = np.zeros((max(slice_y.stop - slice_y.start, 0), max(slice_x.stop - slice_x.start, 0)), dtype=self.dtype)
+        for key, in_tile, in_stencil in self._overlaps(stencil):
+            if key in self.tiles:
+                values[in_stencil] = self.tiles[key][in_tile]
+        return values
+
+    def __setitem__(self, stencil, values):
+        [slice_y, slice_x] = [slice(*axis.indices(n)[:2]) for axis, n in zip(stencil, self.shape)]
+        values = np.broadcast_to(values, (slice_y.stop - slice_y.start, slice_x.stop - slice_x.start))
+        for key, in_tile, in_stencil in self._overlaps(stencil):
+            self.tile(key)[in_tile] = values[in_stencil]
+
+    @classmethod
+    def from_dense(cls, array, tile_size, dtype=np.float64):
+        """Tiled copy of a dense grid. Only the tiles with non-zero values are allocated."""
+        grid = cls(np.shape(array), tile_size, dtype)
+        for ty in range(-(-grid.shape[0] // grid.tile_size)):
+            for tx in range(-(-grid.shape[1] // grid.tile_size)):
+                block = array[grid.tile_slices((ty, tx))]
+                if np.any(block):
+                    grid.tile((ty, tx))[...] = block
+        return grid
+
+    def to_dense(self):
+        """Dense copy of the grid, with zeros in the tiles that were never written."""
+        array = np.zeros(self.shape, dtype=self.dtype)
+        for key, tile in self.tiles.items():
+            array[self.tile_slices(key)] = tile
+        return array
+
+    def sum(self):
+        return sum(tile.sum() for tile in self.tiles.values())
+
+def _accumulate_2D(pb_t, Fpbt_x, Fpbt_y, Fbias_x, Fbias_y, Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y, ofv_x, ofv_y, buffer):
+    """In place update of the sufficient statistics of the Mean Force with the contribution of one window (see numba_backend.accumulate_2D). Fpbt_x and Fpbt_y are overwritten, buffer is a work array."""
+    Ftot_den += pb_t
+    np.square(pb_t, out=buffer)
+    Ftot_den2 += buffer
+    # x-component: dfds_x = Fpbt_x / pb_t + Fbias_x, computed in place (Fpbt_x is zero wherever pb_t is)
+    dfds_x = np.divide(Fpbt_x, pb_t, out=Fpbt_x, where=pb_t != 0)
+    dfds_x += Fbias_x
+    np.multiply(pb_t, dfds_x, out=buffer)
+    Ftot_num_x += buffer
+    np.square(dfds_x, out=buffer)
+    buffer *= pb_t
+    ofv_x += buffer
+    # y-component
+    dfds_y = np.divide(Fpbt_y, pb_t, out=Fpbt_y, where=pb_t != 0)
+    dfds_y += Fbias_y
+    np.multiply(pb_t, dfds_y, out=buffer)
+    Ftot_num_y += buffer
+    np.square(dfds_y, out=buffer)
+    buffer *= pb_t
+    ofv_y += buffer
+
+def _kahan_add(total, compensation, values, y, t):
+    """Kahan summation, in place: total += values, with the rounding error carried over in compensation (the exact sum is total - compensation). y and t are work arrays."""
+    np.subtract(values, compensation, out=y)
+    np.add(total, y, out=t)
+    np.subtract(t, total, out=compensation)
+    compensation -= y
+    total[...] = t
 
 ### Main Mean Force Integration
-#@jit
+# Version of the checkpoint format written by MFI2DAccumulator.save_checkpoint, and the grids it stores
+CHECKPOINT_VERSION = 1
+CHECKPOINT_FIELDS = ["Fbias_x", "Fbias_y", "Ftot_num_x", "Ftot_num_y", "Ftot_den", "Ftot_den2", "ofv_x", "ofv_y"]
+# Grids of the float32 mode: compensated sum of the density, sum of pb_t**2, sum of the cross terms Ftot_den**2 - Ftot_den2,
+# and weighted running means and sums of squared deviations (M2) of the force
+CHECKPOINT_FIELDS_FLOAT32 = ["Fbias_x", "Fbias_y", "Ftot_den", "Ftot_den_c", "Ftot_den2", "Ftot_cross", "Ftot_mean_x", "Ftot_mean_y", "M2_x", "M2_y"]
+
+class MFI2DAccumulator:
+    """Running state of a 2D Mean Force Integration: the bias force and the sufficient statistics of the mean force, updated one hill window at a time.
+    MFI_2D drives one accumulator over a whole HILLS array. The accumulator can also be fed online, with update(), while a simulation is still running (see follow_MFI_2D).
+
+    Args:
+        stride (int, optional): Number of position samples per hill window (PLUMED METAD PACE / PRINT STRIDE). Defaults to 1.
+        bw, kT, min_grid, max_grid, nbins, WellTempered, periodic, cutoff, separable, backend, Fbias, dtype, tile_size: see MFI_2D.
+    """
+
+    def __init__(self, stride=1, bw=1, kT=1, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins=np.array((200,200)),
+                 WellTempered=1, periodic=0, cutoff=None, separable=False, backend="numpy", Fbias=None, dtype=np.float64, tile_size=None):
+        if backend not in ("numpy", "numba"):
+            raise ValueError("backend must be \"numpy\" or \"numba\", got " + str(backend))
+        if backend == "numba" and numba_backend is None:
+            warnings.warn("numba is not installed, falling back to the numpy backend")
+            backend = "numpy"
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float64, np.float32):
+            raise ValueError("dtype must be float64 or float32, got " + str(dtype))
+        if dtype == np.float32 and backend == "numba":
+            raise ValueError("dtype float32 is only supported by the numpy backend")
+        if tile_size is not None and (cutoff is None or separable or backend != "numpy" or dtype != np.float64):
+            raise ValueError("tile_size requires a cutoff, and the default (numpy, float64, not separable) kernel evaluation")
+
+        self.stride = stride
+        self.bw = bw
+        self.kT = kT
+        self.min_grid = np.asarray(min_grid, dtype=float) if backend == "numba" else min_grid
+        self.max_grid = np.asarray(max_grid, dtype=float) if backend == "numba" else max_grid
+        self.nbins = nbins
+        self.WellTempered = WellTempered
+        self.periodic = periodic
+        self.cutoff = cutoff
+        self.separable = separable
+        self.backend = backend
+        self.dtype = dtype
+        self.tile_size = tile_size
+        self.Gamma_Factor = 1 if WellTempered < 1 else None  # set from the biasfactor of the first hill otherwise
+
+        self.gridx = np.linspace(min_grid[0], max_grid[0], nbins[0]).astype(dtype)
+        self.gridy = np.linspace(min_grid[1], max_grid[1], nbins[1]).astype(dtype)
+        self.shape = (len(self.gridy), len(self.gridx))
+        # Dense coordinates, for the full-grid kernel evaluation (stencils only use gridx and gridy, so tiled grids never allocate them)
+        [self.X, self.Y] = np.meshgrid(self.gridx, self.gridy) if tile_size is None else [None, None]
+        self.const = dtype.type(1 / (bw*np.sqrt(2*np.pi)*stride))
+        self.bw2 = dtype.type(bw**2)
+
+        # Initialize force terms
+        if tile_size is not None:
+            # Only the tiles touched by a kernel or hill are allocated and updated
+            if Fbias is not None:
+                [self.Fbias_x, self.Fbias_y] = [TiledGrid.from_dense(Fbias[0], tile_size), TiledGrid.from_dense(Fbias[1], tile_size)]
+            else:
+                [self.Fbias_x, self.Fbias_y] = [TiledGrid(self.shape, tile_size), TiledGrid(self.shape, tile_size)]
+        elif Fbias is None:
+            self.Fbias_x = np.zeros(nbins, dtype=dtype)
+            self.Fbias_y = np.zeros(nbins, dtype=dtype)
+        else:
+            self.Fbias_x = np.array(Fbias[0], dtype=dtype)
+            self.Fbias_y = np.array(Fbias[1], dtype=dtype)
+        if tile_size is not None:
+            for field in CHECKPOINT_FIELDS[2:]:
+                setattr(self, field, TiledGrid(self.shape, tile_size))
+        elif dtype == np.float32:
+            # E[x**2]-E[x]**2 and Ftot_den**2-Ftot_den2 cancel catastrophically in single precision: accumulate the weighted mean and M2 = sum pb_t * (dfds - mean)**2 instead
+            # (West's weighted Welford update), the cross terms 2 * sum_{i<j} pb_i * pb_j directly, and the density with Kahan compensation
+            for field in CHECKPOINT_FIELDS_FLOAT32[2:]:
+                setattr(self, field, np.zeros(nbins, dtype=dtype))
+            self._buffers = [np.zeros(nbins, dtype=dtype) for k in range(3)]
+        else:
+            self.Ftot_num_x = np.zeros(nbins)
+            self.Ftot_num_y = np.zeros(nbins)
+            self.Ftot_den = np.zeros(nbins)
+            self.Ftot_den2 = np.zeros(nbins)
+            self.ofv_x = np.zeros(nbins)
+            self.ofv_y = np.zeros(nbins)
+        self.ofe = np.zeros(nbins) if tile_size is None else TiledGrid(self.shape, tile_size)
+        self.ofe_history = []
+        self.n_windows = 0
+        self.timer = progress.PhaseTimer()
+        self._buffer = np.zeros(nbins, dtype=dtype) if tile_size is None else None  # tiles use buffers of their own size
+
+        # Online input not yet analysed: hills in the layout of load_HILLS_2D and [position_x, position_y]
+        self._pending_hills = []
+        self._pending_positions = [np.zeros(0), np.zeros(0)]
+        self._n_raw_hills = 0
+
+        if backend == "numba":
+            self._kernel_cutoff = np.inf if cutoff is None else float(cutoff)
+            self._periodic = np.broadcast_to(np.asarray(periodic, dtype=float), (2,)).copy()
+            self._no_density = np.zeros((0, 0))
+            self._pb_t = np.zeros(nbins)
+            self._Fpbt_x = np.zeros(nbins)
+            self._Fpbt_y = np.zeros(nbins)
+
+    def add_window(self, hill, data_x, data_y):
+        """Add one hill to the bias force, then the biased samples of its window to the sufficient statistics.
+
+        Args:
+            hill (array): Row of a HILLS array from load_HILLS_2D (time, CV1, CV2, sigma_CV1, sigma_CV2, height, biasfactor).
+            data_x (array): CV1 samples of the window, of length stride.
+            data_y (array): CV2 samples of the window, of length stride.
+        """
+        self.timer.start()
+        [X, Y, gridx, gridy] = [self.X, self.Y, self.gridx, self.gridy]
+        [min_grid, max_grid, periodic, cutoff, nbins] = [self.min_grid, self.max_grid, self.periodic, self.cutoff, self.nbins]
+        [const, kT, bw2] = [self.const, self.kT, self.bw2]
+        if self.Gamma_Factor is None:
+            self.Gamma_Factor = _gamma_factor(hill)
+        if self.dtype == np.float32:
+            # keep every kernel evaluation in single precision
+            [hill, data_x, data_y] = [np.asarray(hill, dtype=np.float32), np.asarray(data_x, dtype=np.float32), np.asarray(data_y, dtype=np.float32)]
+            kT = np.float32(kT)
+
+        # Build metadynamics potential
+        s_x = hill[1]  # center x-position of Gaussian
+        s_y = hill[2]  # center y-position of Gaussian
+        sigma_meta2_x = hill[3] ** 2  # width of Gaussian
+        sigma_meta2_y = hill[4] ** 2  # width of Gaussian
+        height_meta = hill[5] * self.dtype.type(self.Gamma_Factor)  # Height of Gaussian
+
+        if self.backend == "numba":
+            periodic_images = numba_backend.find_periodic_points(np.array([s_x]), np.array([s_y]), min_grid, max_grid, self._periodic)
+            numba_backend.deposit_kernels_2D(periodic_images, sigma_meta2_x, sigma_meta2_y, height_meta, 1.0, gridx, gridy, self._kernel_cutoff, self._no_density, self.Fbias_x, self.Fbias_y)
+        elif self.separable:
+            periodic_images = geometry.find_periodic_points(np.array([[s_x, s_y]]), min_grid, max_grid, periodic)
+            [Kx, Ky, dx, dy] = separable_kernels_2D(periodic_images, sigma_meta2_x, sigma_meta2_y, gridx, gridy, cutoff)
+            self.Fbias_x += (height_meta / sigma_meta2_x) * (Ky.T @ (Kx * dx))
+            self.Fbias_y += (height_meta / sigma_meta2_y) * ((Ky * dy).T @ Kx)
+        else:
+            periodic_images = geometry.find_periodic_points(np.array([[s_x, s_y]]), min_grid, max_grid, periodic)
+            for j in range(len(periodic_images)):
+                if cutoff is None:
+                    kernelmeta = np.exp(-0.5 * (((X - periodic_images[j][0]) ** 2) / sigma_meta2_x + ((Y - periodic_images[j][1]) ** 2) / sigma_meta2_y))  # potential erorr in calc. of s-s_t
+                    self.Fbias_x += height_meta * kernelmeta * ((X - periodic_images[j][0]) / sigma_meta2_x)
+                    self.Fbias_y += height_meta * kernelmeta * ((Y - periodic_images[j][1]) / sigma_meta2_y)
+                else:
+                    [stencil, dx, dy, kernelmeta] = kernel_stencil_2D(periodic_images[j][0], periodic_images[j][1], sigma_meta2_x, sigma_meta2_y, gridx, gridy, cutoff)
+                    if kernelmeta is None: continue
+                    self.Fbias_x[stencil] += height_meta * kernelmeta * (dx / sigma_meta2_x)
+                    self.Fbias_y[stencil] += height_meta * kernelmeta * (dy / sigma_meta2_y)
+
+        self.timer.stop("bias")
+
+        # Biased probability density component of the force
+        # Estimate the biased proabability density p_t ^ b(s)
+        if self.backend == "numba":
+            [pb_t, Fpbt_x, Fpbt_y] = [self._pb_t, self._Fpbt_x, self._Fpbt_y]
+            pb_t.fill(0)
+            Fpbt_x.fill(0)
+            Fpbt_y.fill(0)
+            periodic_images = numba_backend.find_periodic_points(data_x, data_y, min_grid, max_grid, self._periodic)
+            numba_backend.deposit_kernels_2D(periodic_images, bw2, bw2, const, kT, gridx, gridy, self._kernel_cutoff, pb_t, Fpbt_x, Fpbt_y)
+        elif self.separable:
+            periodic_images = geometry.find_periodic_points(np.column_stack((data_x, data_y)), min_grid, max_grid, periodic)
+            [Kx, Ky, dx, dy] = separable_kernels_2D(periodic_images, bw2, bw2, gridx, gridy, cutoff)
+            pb_t = const * (Ky.T @ Kx)
+            Fpbt_x = (const * kT / bw2) * (Ky.T @ (Kx * dx))
+            Fpbt_y = (const * kT / bw2) * ((Ky * dy).T @ Kx)
+        else:
+            if self.tile_size is not None:
+                [pb_t, Fpbt_x, Fpbt_y] = [TiledGrid(self.shape, self.tile_size) for k in range(3)]
+            else:
+                pb_t = np.zeros(nbins, dtype=self.dtype)
+                Fpbt_x = np.zeros(nbins, dtype=self.dtype)
+                Fpbt_y = np.zeros(nbins, dtype=self.dtype)
+            periodic_images = geometry.find_periodic_points(np.column_stack((data_x, data_y)), min_grid, max_grid, periodic)
+            for k in range(len(periodic_images)):
+                if cutoff is None:
+                    kernel = const * np.exp(- (1 / (2 * bw2)) * ((X - periodic_images[k][0]) ** 2 + (Y - periodic_images[k][1]) ** 2))
+                    pb_t += kernel
+                    Fpbt_x += kernel * kT * (X - periodic_images[k][0]) / bw2
+                    Fpbt_y += kernel * kT * (Y - periodic_images[k][1]) / bw2
+                else:
+                    [stencil, dx, dy, kernel] = kernel_stencil_2D(periodic_images[k][0], periodic_images[k][1], bw2, bw2, gridx, gridy, cutoff)
+                    if kernel is None: continue
+                    kernel = const * kernel
+                    pb_t[stencil] += kernel
+                    Fpbt_x[stencil] += kernel * kT * dx / bw2
+                    Fpbt_y[stencil] += kernel * kT * dy / bw2
+
+        self.timer.stop("kde")
+
+        # Accumulate the sufficient statistics of the Mean Force (in place, the mean force itself is only needed at checkpoints)
+        if self.dtype == np.float32:
+            self._accumulate_compensated(pb_t, Fpbt_x, Fpbt_y)
+        elif self.backend == "numba":
+            numba_backend.accumulate_2D(pb_t, Fpbt_x, Fpbt_y, self.Fbias_x, self.Fbias_y, self.Ftot_den, self.Ftot_den2, self.Ftot_num_x, self.Ftot_num_y, self.ofv_x, self.ofv_y)
+        elif self.tile_size is not None:
+            for key, pb_t_tile in pb_t.tiles.items():
+                _accumulate_2D(pb_t_tile, Fpbt_x.tiles[key], Fpbt_y.tiles[key], self.Fbias_x.tile(key), self.Fbias_y.tile(key), self.Ftot_den.tile(key), self.Ftot_den2.tile(key),
+                               self.Ftot_num_x.tile(key), self.Ftot_num_y.tile(key), self.ofv_x.tile(key), self.ofv_y.tile(key), np.empty_like(pb_t_tile))
+        else:
+            _accumulate_2D(pb_t, Fpbt_x, Fpbt_y, self.Fbias_x, self.Fbias_y, self.Ftot_den, self.Ftot_den2, self.Ftot_num_x, self.Ftot_num_y, self.ofv_x, self.ofv_y, self._buffer)
+        self.timer.stop("accumulate")
+
+        self.n_windows += 1
+
+    def _accumulate_compensated(self, pb_t, Fpbt_x, Fpbt_y):
+        """Single precision accumulation of one window: weighted Welford updates of the mean force and M2, cross terms of the density, and Kahan sum of pb_t."""
+        [delta, increment, weight] = self._buffers
+        # weight = pb_t / (Ftot_den + pb_t), the share of the updated density coming from this window
+        np.add(self.Ftot_den, pb_t, out=weight)
+        np.divide(pb_t, weight, out=weight, where=weight != 0)
+        for [Fpbt, Fbias, mean, M2] in [[Fpbt_x, self.Fbias_x, self.Ftot_mean_x, self.M2_x], [Fpbt_y, self.Fbias_y, self.Ftot_mean_y, self.M2_y]]:
+            dfds = np.divide(Fpbt, pb_t, out=Fpbt, where=pb_t != 0)
+            dfds += Fbias
+            np.subtract(dfds, mean, out=delta)
+            # mean += weight * delta, M2 += Ftot_den * weight * delta**2 (with Ftot_den before the update)
+            np.multiply(weight, delta, out=increment)
+            mean += increment
+            increment *= delta
+            increment *= self.Ftot_den
+            M2 += increment
+        # Ftot_den**2 - Ftot_den2 grows by 2 * pb_t * Ftot_den (before the update), a sum of positive terms
+        np.multiply(pb_t, self.Ftot_den, out=weight)
+        weight *= 2
+        self.Ftot_cross += weight
+        np.square(pb_t, out=weight)
+        self.Ftot_den2 += weight
+        _kahan_add(self.Ftot_den, self.Ftot_den_c, pb_t, delta, increment)
+
+    def statistics(self):
+        """Sufficient statistics of the mean force in double precision, as accumulated by the default float64 mode (reconstructed from the mean and M2 in float32 mode).
+
+        Returns:
+            list: [Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y, ofv_x, ofv_y]
+        """
+        if self.tile_size is not None:
+            return [getattr(self, field).to_dense() for field in ["Ftot_den", "Ftot_den2", "Ftot_num_x", "Ftot_num_y", "ofv_x", "ofv_y"]]
+        if self.dtype != np.float32:
+            return [self.Ftot_den, self.Ftot_den2, self.Ftot_num_x, self.Ftot_num_y, self.ofv_x, self.ofv_y]
+        Ftot_den = self.Ftot_den.astype(np.float64) - self.Ftot_den_c
+        Ftot_den2 = self.Ftot_den2.astype(np.float64)
+        [mean_x, mean_y] = [self.Ftot_mean_x.astype(np.float64), self.Ftot_mean_y.astype(np.float64)]
+        return [Ftot_den, Ftot_den2, Ftot_den * mean_x, Ftot_den * mean_y, self.M2_x + Ftot_den * mean_x**2, self.M2_y + Ftot_den * mean_y**2]
+
+    def update(self, new_hills, new_positions):
+        """Add newly written HILLS and position rows, and analyse every hill window that is now complete.
+        Window i needs the hills up to i-1 and the positions up to (i+1)*stride, so feeding the rows of finished files gives the same result as
+        MFI_2D on load_HILLS_2D and load_position_2D of those files.
+
+        Args:
+            new_hills (array): New rows of the HILLS file, as written by PLUMED (time, CV1, CV2, sigma_CV1, sigma_CV2, height, biasfactor).
+            new_positions (list): [new_position_x, new_position_y], new CV1 and CV2 values of the position file.
+
+        Returns:
+            int: number of hill windows analysed.
+        """
+        new_hills = np.asarray(new_hills, dtype=float)
+        for hill in (new_hills.reshape(-1, new_hills.shape[-1]) if new_hills.size else []):
+            if self._n_raw_hills == 0:
+                # As in load_HILLS_2D, the first window is analysed without bias
+                first_hill = np.array(hill, dtype=float)
+                first_hill[5] = 0
+                self._pending_hills.append(first_hill)
+            self._pending_hills.append(np.array(hill, dtype=float))
+            self._n_raw_hills += 1
+        self._pending_positions = [np.concatenate((self._pending_positions[0], new_positions[0])), np.concatenate((self._pending_positions[1], new_positions[1]))]
+
+        n_new_windows = min(len(self._pending_hills), len(self._pending_positions[0]) // self.stride)
+        for i in range(n_new_windows):
+            self.add_window(self._pending_hills[i], self._pending_positions[0][i * self.stride: (i + 1) * self.stride], self._pending_positions[1][i * self.stride: (i + 1) * self.stride])
+        del self._pending_hills[:n_new_windows]
+        self._pending_positions = [self._pending_positions[0][n_new_windows * self.stride:], self._pending_positions[1][n_new_windows * self.stride:]]
+        return n_new_windows
+
+    def mean_force(self):
+        """Current Mean Force.
+
+        Returns:
+            Ftot_x: CV1 component of the Mean Force.
+            Ftot_y: CV2 component of the Mean Force.
+        """
+        if self.dtype == np.float32:
+            return [self.Ftot_mean_x.astype(np.float64), self.Ftot_mean_y.astype(np.float64)]
+        if self.tile_size is not None:
+            return mean_force_2D(self.Ftot_num_x.to_dense(), self.Ftot_num_y.to_dense(), self.Ftot_den.to_dense())
+        return mean_force_2D(self.Ftot_num_x, self.Ftot_num_y, self.Ftot_den)
+
+    def compute_error(self):
+        """Compute the on the fly estimate of the local convergence, and append its grid average to ofe_history.
+
+        Returns:
+            ofe: array of size (nbins[0], nbins[1]) - on the fly estimate of the local convergence (a TiledGrid if tile_size is set).
+        """
+        self.timer.start()
+        if self.tile_size is not None:
+            # active tiles only, ofe is a TiledGrid
+            for key, Ftot_den in self.Ftot_den.tiles.items():
+                [Ftot_x, Ftot_y] = mean_force_2D(self.Ftot_num_x.tiles[key], self.Ftot_num_y.tiles[key], Ftot_den)
+                [self.ofe.tiles[key]] = mean_force_variance(Ftot_den, self.Ftot_den2.tiles[key], Ftot_x, Ftot_y, self.ofv_x.tiles[key], self.ofv_y.tiles[key])
+            self.ofe_history.append(self.ofe.sum() / (self.nbins[0]*self.nbins[1]))
+            self.timer.stop("error")
+            return self.ofe
+        if self.dtype == np.float32:
+            # variance and ratio straight from M2 and the cross terms, without the cancelling differences
+            [Ftot_den, Ftot_den2] = self.statistics()[:2]
+            # where the cross terms are below the float64 resolution of Ftot_den**2, Ftot_den**2 - Ftot_den2 cancels in float64 mode and the bin gets no error: do the same
+            Ftot_den_ratio = np.divide(Ftot_den2, self.Ftot_cross, out=np.zeros_like(Ftot_den), where=self.Ftot_cross > np.finfo(np.float64).eps * Ftot_den**2)
+            ofe_x = np.divide(self.M2_x, Ftot_den, out=np.zeros_like(Ftot_den), where=Ftot_den != 0) * Ftot_den_ratio
+            ofe_y = np.divide(self.M2_y, Ftot_den, out=np.zeros_like(Ftot_den), where=Ftot_den != 0) * Ftot_den_ratio
+            self.ofe = np.sqrt(abs(ofe_x) + abs(ofe_y))
+        else:
+            [Ftot_x, Ftot_y] = self.mean_force()
+            [self.ofe] = mean_force_variance(self.Ftot_den, self.Ftot_den2, Ftot_x, Ftot_y, self.ofv_x, self.ofv_y)
+        self.ofe_history.append(sum(sum(self.ofe)) / (self.nbins[0]*self.nbins[1]))
+        self.timer.stop("error")
+        return self.ofe
+
+    def results(self):
+        """Current results, in the layout returned by MFI_2D.
+
+        Returns:
+            [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y], see MFI_2D.
+        """
+        [Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y, ofv_x, ofv_y] = self.statistics()
+        if self.tile_size is None:
+            [Ftot_x, Ftot_y] = self.mean_force()
+            return [self.X, self.Y, Ftot_den, Ftot_x, Ftot_y, self.ofe, self.ofe_history, Ftot_den2, ofv_x, ofv_y]
+        # the dense output grids are only built here
+        [Ftot_x, Ftot_y] = mean_force_2D(Ftot_num_x, Ftot_num_y, Ftot_den)
+        [X, Y] = np.meshgrid(self.gridx, self.gridy)
+        return [X, Y, Ftot_den, Ftot_x, Ftot_y, self.ofe.to_dense(), self.ofe_history, Ftot_den2, ofv_x, ofv_y]
+
+    def save_checkpoint(self, file_name):
+        """Save the complete state of the accumulator (run parameters, bias force, accumulators, hill cursor and online buffers) to a versioned .npz checkpoint.
+        The file is written to a temporary file first and then renamed, so an interrupted save never corrupts the previous checkpoint.
+
+        Args:
+            file_name (str): Name of the checkpoint file.
+        """
+        state = {"checkpoint_version": CHECKPOINT_VERSION,
+                 "stride": self.stride, "bw": self.bw, "kT": self.kT, "min_grid": self.min_grid, "max_grid": self.max_grid, "nbins": self.nbins,
+                 "WellTempered": self.WellTempered, "periodic": self.periodic, "cutoff": np.nan if self.cutoff is None else self.cutoff,
+                 "separable": self.separable, "backend": self.backend, "dtype": self.dtype.name, "tile_size": np.nan if self.tile_size is None else self.tile_size, "Gamma_Factor": np.nan if self.Gamma_Factor is None else self.Gamma_Factor,
+                 "n_windows": self.n_windows, "n_raw_hills": self._n_raw_hills, "ofe_history": np.array(self.ofe_history),
+                 "pending_hills": np.array(self._pending_hills, dtype=float).reshape(len(self._pending_hills), -1) if self._pending_hills else np.zeros((0, 7)), "pending_position_x": self._pending_positions[0], "pending_position_y": self._pending_positions[1]}
+        for field in self._checkpoint_fields() + ["ofe"]:
+            value = getattr(self, field)
+            if isinstance(value, TiledGrid):
+                # one entry per allocated tile, "field@row_column"
+                for key, tile in value.tiles.items():
+                    state[field + "@" + str(key[0]) + "_" + str(key[1])] = tile
+            else:
+                state[field] = value
+
+        with open(file_name + ".tmp", "wb") as f:
+            np.savez(f, **state)
+        os.replace(file_name + ".tmp", file_name)
+
+    def _checkpoint_fields(self):
+        return CHECKPOINT_FIELDS_FLOAT32 if self.dtype == np.float32 else CHECKPOINT_FIELDS
+
+    @classmethod
+    def load_checkpoint(cls, file_name):
+        """Restore an accumulator saved with save_checkpoint.
+
+        Args:
+            file_name (str): Name of the checkpoint file.
+
+        Returns:
+            MFI2DAccumulator: the accumulator, ready to continue from the next hill window.
+        """
+        with np.load(file_name) as checkpoint:
+            state = {key: checkpoint[key] for key in checkpoint.files}
+        if "checkpoint_version" not in state or int(state["checkpoint_version"]) > CHECKPOINT_VERSION:
+            raise ValueError(file_name + " is not a checkpoint supported by this version of pyMFI")
+
+        accumulator = cls(stride=int(state["stride"]), bw=float(state["bw"]), kT=float(state["kT"]), min_grid=state["min_grid"], max_grid=state["max_grid"], nbins=state["nbins"],
+                          WellTempered=int(state["WellTempered"]), periodic=state["periodic"] if state["periodic"].ndim else int(state["periodic"]), cutoff=None if np.isnan(state["cutoff"]) else float(state["cutoff"]),
+                          separable=bool(state["separable"]), backend=str(state["backend"]), dtype=str(state.get("dtype", "float64")),
+                          tile_size=None if np.isnan(state.get("tile_size", np.nan)) else int(state["tile_size"]))
+        for field in accumulator._checkpoint_fields() + ["ofe"]:
+            if accumulator.tile_size is None:
+                getattr(accumulator, field)[...] = state[field]
+                continue
+            for key in state:
+                if key.startswith(field + "@"):
+                    getattr(accumulator, field).tiles[tuple(int(k) for k in key[len(field) + 1:].split("_"))] = state[key]
+        accumulator.Gamma_Factor = None if np.isnan(state["Gamma_Factor"]) else float(state["Gamma_Factor"])
+        accumulator.n_windows = int(state["n_windows"])
+        accumulator.ofe_history = list(state["ofe_history"])
+        accumulator._n_raw_hills = int(state["n_raw_hills"])
+        accumulator._pending_hills = list(state["pending_hills"])
+        accumulator._pending_positions = [state["pending_position_x"], state["pending_position_y"]]
+        return accumulator
+
 def MFI_2D( HILLS = "HILLS",\
      position_x = "position_x", position_y = "position_y",\
      bw = 1, kT = 1, min_grid=np.array((-np.pi, -np.pi)),\
      max_grid=np.array((np.pi, np.pi)),\
      nbins = np.array((200,200)),\
      log_pace = 10, error_pace = 200,\
-     WellTempered = 1, nhills = -1, periodic=0): 
+     WellTempered = 1, nhills = -1, periodic=0, cutoff=None, separable=False, backend="numpy", Fbias=None,\
+     checkpoint_name=None, resume_from=None, dtype=np.float64, tile_size=None, callback=None): 
     """Compute a time-independent estimate of the Mean Thermodynamic Force, i.e. the free energy gradient in 2D CV spaces. 
 
     Args:
@@ -99,7 +802,26 @@ def MFI_2D( HILLS = "HILLS",\
         error_pace (int, optional): Pace for the calculation of the on-the-fly measure of global convergence. Defaults to 200.
         WellTempered (int, optional): Is the simulation well tempered? . Defaults to 1.
         nhills (int, optional): Number of HILLS to analyse, -1 for the entire HILLS array. Defaults to -1, i.e. the entire dataset.
-        periodic (int, optional): Is the CV space periodic? 1 for yes. Defaults to 0. 
+        periodic (int or array, optional): Is the CV space periodic? 1 for yes, for both CVs or one value per CV, e.g. np.array((1, 0)). The period is the box length max_grid - min_grid. Defaults to 0. 
+        cutoff (float, optional): If set, every KDE kernel and metadynamics hill is only deposited on the grid points within cutoff standard deviations of its centre (periodic images are truncated in the same way). The neglected tails are smaller than exp(-cutoff**2/2) times the kernel peak, so in the sampled region the results match the full-grid evaluation to ~1E-3 relative for cutoff=5 and to ~1E-11 for cutoff=8. Bins further than cutoff*bw from every sample are left empty (zero density, force and error) instead of holding the extrapolated far tails, which also lowers ofe_history. Defaults to None, i.e. kernels are evaluated on the full grid.
+        separable (bool, optional): If True, the Gaussian kernels are factorised into 1D CV1 and CV2 vectors, and the biased probability density and bias force of a whole stride window are obtained from a few matrix products (multithreaded by BLAS) instead of one full-grid exponential per sample. The accumulated terms agree with the default evaluation to machine precision. Can be combined with cutoff. Defaults to False.
+        backend (str, optional): "numpy" or "numba". The numba backend runs the periodic images, kernel deposition and accumulation as compiled loops, parallel over the grid rows (the kernels are always factorised, so separable has no effect; cutoff is honoured). Falls back to "numpy", with a warning, if numba is not installed. Defaults to "numpy".
+        Fbias (list, optional): [Fbias_x, Fbias_y], bias force at the start of the analysis, e.g. from the hills deposited before HILLS[0] (see bias_force_2D). Defaults to None, i.e. the bias force starts from zero.
+        checkpoint_name (str, optional): If set, the state of the analysis is saved to this file (see MFI2DAccumulator.save_checkpoint) at every error_pace checkpoint and at the end. Defaults to None.
+        resume_from (str, optional): Checkpoint file of an interrupted analysis of the same HILLS and position arrays. The analysis continues from the first hill not yet analysed. The run parameters must match those stored in the checkpoint. Defaults to None.
+        dtype (optional): np.float64 or np.float32, precision of the grids (numpy backend only). In float32 mode the variance of the mean force is accumulated as a weighted running mean and sum of squared deviations (Welford),
+            and Ftot_den**2 - Ftot_den2 as a sum of its positive cross terms, so nothing cancels. Accuracy limits:
+            the ofe map matches float64 to ~1E-5 relative only in bins where the relative density is above 1E-10 and the cross terms are above 1E-8 of Ftot_den**2 (i.e. several windows contribute).
+            In bins essentially covered by a single window the float64 ofe is set by the round-off of Ftot_den**2 - Ftot_den2, and the two modes differ by up to 100%.
+            Bins whose per-window density underflows single precision (far tails, which float64 still fills) are left empty, with zero density, force and ofe.
+            ofe_history, a grid average dominated by those tails in float64, is therefore much lower and not comparable between the two modes (e.g. 1.26 instead of 5.79 for 250 hills of the Antoniu walker, 8.8 instead of 25.1 for 10 Alanine windows).
+            The accumulated grids take 40 instead of 64 bytes per bin. On the MFI_2D dtype cases of benchmarks/run_benchmarks.py the dense kernel evaluation is 2-3 times faster than float64, with a cutoff the gain is small. The returned grids are float64. Defaults to np.float64.
+        tile_size (int, optional): If set (requires cutoff), the bias force and accumulators are stored as tiles of tile_size x tile_size bins, allocated when a kernel or hill first touches them,
+            and the window updates and error estimates run on these active tiles only (see TiledGrid). Memory and time then scale with the visited region instead of the whole grid,
+            which pays off for fine grids (1000x1000 and up) of which a simulation explores a small part. The results are the same as with cutoff alone, and are returned as dense grids,
+            which set the memory floor (benchmarks/run_benchmarks.py --filter MFI_2D, 250 hills on 1000x1000 bins: 145 MB with cutoff=5, 95 MB with tile_size=64 as well). Defaults to None.
+        callback (callable or list, optional): Function(s) called with the progress events of the analysis (hill index, hills/s, time per phase, current average error, peak memory), see pyMFI.progress.
+            e.g. progress.JSONLinesHandler("MFI_log.jsonl") to log them as JSON lines. Defaults to None, i.e. progress.print_progress_2D; an empty list runs silently.
 
     Returns:
         X: array of size (nbins[0], nbins[1]) - CV1 grid positions
@@ -111,11 +833,7 @@ def MFI_2D( HILLS = "HILLS",\
         ofe_history: array of size (1, total_number_of_hills) - running estimate of the global convergence of the mean force.
     """
 
-    gridx = np.linspace(min_grid[0], max_grid[0], nbins[0])
-    gridy = np.linspace(min_grid[1], max_grid[1], nbins[1])
-    X, Y = np.meshgrid(gridx, gridy)
     stride = int(len(position_x) / len(HILLS[:,1]))     
-    const = (1 / (bw*np.sqrt(2*np.pi)*stride))
 
     if log_pace >= error_pace:
         log_pace=error_pace 
@@ -125,91 +843,147 @@ def MFI_2D( HILLS = "HILLS",\
         total_number_of_hills=nhills
     else:
         total_number_of_hills=len(HILLS[:,1])
-    bw2 = bw**2    
 
-    # Initialize force terms
-    Fbias_x = np.zeros(nbins)
-    Fbias_y = np.zeros(nbins)
-    Ftot_num_x = np.zeros(nbins)
-    Ftot_num_y = np.zeros(nbins)
-    Ftot_den = np.zeros(nbins)
-    Ftot_den2 = np.zeros(nbins)
-    ofv_x = np.zeros(nbins)
-    ofv_y = np.zeros(nbins)
-    ofe_history = []
-
-    print("Total no. of Gaussians analysed: " + str(total_number_of_hills))
+    if resume_from is None:
+        accumulator = MFI2DAccumulator(stride=stride, bw=bw, kT=kT, min_grid=min_grid, max_grid=max_grid, nbins=nbins, WellTempered=WellTempered,
+                                       periodic=periodic, cutoff=cutoff, separable=separable, backend=backend, Fbias=Fbias, dtype=dtype, tile_size=tile_size)
+    else:
+        if Fbias is not None:
+            raise ValueError("Fbias cannot be used together with resume_from")
+        accumulator = MFI2DAccumulator.load_checkpoint(resume_from)
+        parameters = {"stride": stride, "bw": bw, "kT": kT, "min_grid": min_grid, "max_grid": max_grid, "nbins": nbins, "WellTempered": WellTempered, "periodic": periodic, "cutoff": cutoff, "tile_size": tile_size}
+        for name, value in parameters.items():
+            if not np.array_equal(np.asarray(getattr(accumulator, name), dtype=float), np.asarray(np.nan if value is None else value, dtype=float), equal_nan=True):
+                raise ValueError("Cannot resume from " + resume_from + ": " + name + " differs from the checkpoint")
+        if accumulator.dtype != np.dtype(dtype):
+            raise ValueError("Cannot resume from " + resume_from + ": dtype differs from the checkpoint")
 
     # Definition Gamma Factor, allows to switch between WT and regular MetaD
     if WellTempered < 1: 
-        Gamma_Factor=1
+        accumulator.Gamma_Factor=1
     else:
-        gamma = HILLS[0, 6]
-        Gamma_Factor=(gamma - 1)/(gamma)
-      
-        
-    for i in range(total_number_of_hills):
-        # Build metadynamics potential
-        s_x = HILLS[i, 1]  # center x-position of Gaussian
-        s_y = HILLS[i, 2]  # center y-position of Gaussian
-        sigma_meta2_x = HILLS[i, 3] ** 2  # width of Gaussian
-        sigma_meta2_y = HILLS[i, 4] ** 2  # width of Gaussian
-        height_meta = HILLS[i, 5] * Gamma_Factor  # Height of Gaussian
-
-        periodic_images = find_periodic_point(s_x,s_y,min_grid,max_grid,periodic)
-        for j in range(len(periodic_images)):
-            kernelmeta = np.exp(-0.5 * (((X - periodic_images[j][0]) ** 2) / sigma_meta2_x + ((Y - periodic_images[j][1]) ** 2) / sigma_meta2_y))  # potential erorr in calc. of s-s_t
-            Fbias_x = Fbias_x + height_meta * kernelmeta * ((X - periodic_images[j][0]) / sigma_meta2_x);  
-            Fbias_y = Fbias_y + height_meta * kernelmeta * ((Y - periodic_images[j][1]) / sigma_meta2_y);  
+        accumulator.Gamma_Factor=_gamma_factor(HILLS[0])
 
-        # Biased probability density component of the force
-        # Estimate the biased proabability density p_t ^ b(s)
-        pb_t = np.zeros(nbins)
-        Fpbt_x = np.zeros(nbins)
-        Fpbt_y = np.zeros(nbins)
+    windows = ([HILLS[i], position_x[i * stride: (i + 1) * stride], position_y[i * stride: (i + 1) * stride]] for i in range(accumulator.n_windows, total_number_of_hills))
+    return _analyse_windows(accumulator, windows, total_number_of_hills, log_pace, error_pace, checkpoint_name, callback)
 
-        data_x = position_x[i * stride: (i + 1) * stride]
-        data_y = position_y[i * stride: (i + 1) * stride]
 
-        for j in range(stride):
-            periodic_images = find_periodic_point(data_x[j], data_y[j], min_grid, max_grid,periodic)
-            for k in range(len(periodic_images)):
-                kernel = const * np.exp(- (1 / (2 * bw2)) * ((X - periodic_images[k][0]) ** 2 + (Y - periodic_images[k][1]) ** 2)); 
-                pb_t = pb_t + kernel;
-                Fpbt_x = Fpbt_x + kernel * kT * (X - periodic_images[k][0]) / bw2
-                Fpbt_y = Fpbt_y + kernel * kT * (Y - periodic_images[k][1]) / bw2
-            
-        # Calculate Mean Force
-        Ftot_den = Ftot_den + pb_t;
-        # Calculate x-component of Force
-        dfds_x = np.divide(Fpbt_x, pb_t, out=np.zeros_like(Fpbt_x), where=pb_t != 0) + Fbias_x 
-        Ftot_num_x = Ftot_num_x + pb_t * dfds_x
-        Ftot_x = np.divide(Ftot_num_x, Ftot_den, out=np.zeros_like(Fpbt_x), where=Ftot_den != 0)
-        # Calculate y-component of Force
-        dfds_y = np.divide(Fpbt_y, pb_t, out=np.zeros_like(Fpbt_y), where=pb_t != 0) + Fbias_y 
-        Ftot_num_y = Ftot_num_y + pb_t * dfds_y
-        Ftot_y = np.divide(Ftot_num_y, Ftot_den, out=np.zeros_like(Fpbt_y), where=Ftot_den != 0)
-
-        #calculate on the fly error components
-        Ftot_den2 = Ftot_den2 + pb_t**2   
-        # on the fly variance of the mean force
-        ofv_x += pb_t * dfds_x**2
-        ofv_y += pb_t * dfds_y**2
+def MFI_2D_stream(hills_name = "HILLS", position_name = "position", stride = None, fields = None, block_rows = 100000, log_pace = 10, error_pace = 200, nhills = -1, checkpoint_name = None, callback = None, **kwargs):
+    """MFI_2D reading the HILLS and position files window by window (see stream_windows_2D), instead of from arrays holding the whole simulation.
+    Peak memory is set by the grids and block_rows, not by the length of the trajectory. The results are the same as MFI_2D on load_HILLS_2D and load_position_2D of the files.
+
+    Args:
+        hills_name (str, optional): Name of the HILLS file. Defaults to "HILLS".
+        position_name (str, optional): Name of the position (COLVAR) file. Defaults to "position".
+        stride (int, optional): Number of position samples per hill (PLUMED METAD PACE / PRINT STRIDE). Defaults to None, i.e. inferred from the number of rows of the files,
+            as MFI_2D infers it from the loaded arrays (see infer_stride_2D, which reads through both files once without parsing them).
+        fields (list, optional): Names of the CV1 and CV2 columns of the position file. Defaults to None, i.e. the two columns after time.
+        block_rows (int, optional): Number of position rows read from disk at a time. Defaults to 100000.
+        log_pace, error_pace, nhills, checkpoint_name, callback: see MFI_2D.
+        **kwargs: Arguments of MFI2DAccumulator (bw, kT, min_grid, max_grid, nbins, WellTempered, periodic, cutoff, separable, backend, Fbias).
+
+    Returns:
+        The same list as MFI_2D: [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y].
+    """
+    if log_pace >= error_pace:
+        log_pace=error_pace
+    total_number_of_hills = nhills if nhills > 0 else plumed_files.count_rows(hills_name)
+    if stride is None:
+        stride = infer_stride_2D(hills_name, position_name)
+    accumulator = MFI2DAccumulator(stride=stride, **kwargs)
+    windows = itertools.islice(stream_windows_2D(hills_name, position_name, stride=stride, fields=fields, block_rows=block_rows), total_number_of_hills)
+    return _analyse_windows(accumulator, windows, total_number_of_hills, log_pace, error_pace, checkpoint_name, callback)
+
+
+def _gamma_factor(hill):
+    """(gamma - 1) / gamma, scaling of the hill heights of a well-tempered run with the biasfactor gamma of hill (a row of load_HILLS_2D)."""
+    if len(hill) < 7:
+        raise ValueError("WellTempered=1 needs the biasf column of the HILLS file, use WellTempered=0 for a HILLS file without it")
+    return (hill[6] - 1) / hill[6]
+
+
+def _analyse_windows(accumulator, windows, total_number_of_hills, log_pace, error_pace, checkpoint_name, callback=None):
+    """Main loop of MFI_2D: add the windows to the accumulator, with the error estimate, progress events and checkpoints at their pace.
+
+    Returns:
+        accumulator.results(), see MFI_2D.
+    """
+    events = progress.Progress(progress.print_progress_2D if callback is None else callback, total_number_of_hills, accumulator.timer, first_hill=accumulator.n_windows)
+    events.emit("start", accumulator.n_windows)
+
+    for i, [hill, data_x, data_y] in enumerate(windows, start=accumulator.n_windows):
+        accumulator.add_window(hill, data_x, data_y)
 
         # Compute Variance of the mean force every 1/error_pace frequency
-        if (i + 1) % int(total_number_of_hills / error_pace) == 0:       
+        if (i + 1) % max(int(total_number_of_hills / error_pace), 1) == 0:       
             #calculate ofe (standard error)
-            [ofe] = mean_force_variance(Ftot_den,Ftot_den2,Ftot_x,Ftot_y,ofv_x,ofv_y)
-                   
-            ofe_history.append(sum(sum(ofe)) / (nbins[0]*nbins[1]))
+            accumulator.compute_error()
+            if checkpoint_name is not None:
+                accumulator.save_checkpoint(checkpoint_name)
+            events.emit("error", i + 1, accumulator.ofe_history[-1])
 
         if (i+1) % (total_number_of_hills/log_pace) == 0: 
-            print("|"+ str(i+1) + "/" + str(total_number_of_hills)+"|==> Average Mean Force Error: "+str(sum(sum(ofe)) / (nbins[0]*nbins[1])))
+            # no error yet if the log pace comes before the first error checkpoint
+            events.emit("log", i + 1, accumulator.ofe_history[-1] if accumulator.ofe_history else None)
             
-    return [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y]
+    if checkpoint_name is not None:
+        accumulator.save_checkpoint(checkpoint_name)
+    events.emit("end", accumulator.n_windows, accumulator.ofe_history[-1] if accumulator.ofe_history else None)
+
+    return accumulator.results()
+
 
+def bias_force_2D(HILLS, Gamma_Factor, gridx, gridy, min_grid, max_grid, periodic, cutoff=None, chunk_size=1000):
+    """Compute the bias force of a set of metadynamics hills at once, as used by MFI_2D.
+    The hills are processed in chunks with separable kernels, so the cost is a few matrix products per chunk.
+
+    Args:
+        HILLS (array): HILLS array (rows of time, CV1, CV2, sigma_CV1, sigma_CV2, height, biasfactor).
+        Gamma_Factor (float): Scaling of the hill heights, (gamma - 1) / gamma for WT-MetaD, 1 otherwise.
+        gridx (array): CV1 grid points.
+        gridy (array): CV2 grid points.
+        min_grid (array): Lower bound of the simulation domain.
+        max_grid (array): Upper bound of the simulation domain.
+        periodic (int or array): Is the CV space periodic? 1 for yes, for both CVs or one value per CV.
+        cutoff (float, optional): Truncate the hills beyond cutoff standard deviations. Defaults to None.
+        chunk_size (int, optional): Number of hills processed per matrix product. Defaults to 1000.
+
+    Returns:
+        Fbias_x: array of size (nbins[1], nbins[0]) - CV1 component of the bias force.
+        Fbias_y: array of size (nbins[1], nbins[0]) - CV2 component of the bias force.
+    """
+    Fbias_x = np.zeros((len(gridy), len(gridx)))
+    Fbias_y = np.zeros((len(gridy), len(gridx)))
+
+    for start in range(0, len(HILLS), chunk_size):
+        [centres, hill_index] = geometry.find_periodic_points(HILLS[start: start + chunk_size, 1:3], min_grid, max_grid, periodic, return_index=True)
+        hill_index += start
+        sigma2_x = HILLS[hill_index, 3][:, np.newaxis] ** 2
+        sigma2_y = HILLS[hill_index, 4][:, np.newaxis] ** 2
+        height = HILLS[hill_index, 5][:, np.newaxis] * Gamma_Factor
+
+        [Kx, Ky, dx, dy] = separable_kernels_2D(centres, sigma2_x, sigma2_y, gridx, gridy, cutoff)
+        Fbias_x += Ky.T @ (height * Kx * dx / sigma2_x)
+        Fbias_y += (height * Ky * dy / sigma2_y).T @ Kx
+
+    return [Fbias_x, Fbias_y]
+
+def mean_force_2D(Ftot_num_x, Ftot_num_y, Ftot_den):
+    """Compute the Mean Force from its accumulated numerator and the cumulative biased probability density.
+
+    Args:
+        Ftot_num_x (array): Cumulative sum of pb_t * dfds_x.
+        Ftot_num_y (array): Cumulative sum of pb_t * dfds_y.
+        Ftot_den (array): Cumulative biased probability density.
+
+    Returns:
+        Ftot_x: CV1 component of the Mean Force.
+        Ftot_y: CV2 component of the Mean Force.
+    """
+    Ftot_x = np.divide(Ftot_num_x, Ftot_den, out=np.zeros_like(Ftot_num_x), where=Ftot_den != 0)
+    Ftot_y = np.divide(Ftot_num_y, Ftot_den, out=np.zeros_like(Ftot_num_y), where=Ftot_den != 0)
+    return [Ftot_x, Ftot_y]
 
-#@jit
 def mean_force_variance(Ftot_den,Ftot_den2,Ftot_x,Ftot_y,ofv_x,ofv_y): 
    #calculate ofe (standard error)
     Ftot_den_ratio = np.divide(Ftot_den2, (Ftot_den**2 - Ftot_den2), out=np.zeros_like(Ftot_den), where=(Ftot_den**2 - Ftot_den2) != 0)
@@ -224,59 +998,298 @@ def mean_force_variance(Ftot_den,Ftot_den2,Ftot_x,Ftot_y,ofv_x,ofv_y):
 
 
 
-### Integration using Fast Fourier Transform (FFT integration) in 2D            
+def coarsen_2D(results, nbins):
+    """Derive the MFI_2D results on a coarser grid from the sufficient statistics of a fine-grid run, without re-analysing the trajectory.
+    Grid-convergence studies then need one MFI_2D pass at the finest resolution, followed by one coarsen_2D call per coarser resolution.
+
+    Along each CV, if (fine nbins - 1) is a multiple of (nbins - 1) the coarse grid points are a subset of the fine ones. As the KDE and bias force are evaluated pointwise,
+    the statistics are then simply subsampled, and the results match an MFI_2D run with the coarse nbins to machine precision. Otherwise the fine bins are pooled into nbins
+    consecutive blocks (of equal size if the fine nbins is a multiple of nbins): the density, numerator and variance sums are averaged over each block, the mean force and ofe
+    are recomputed from the pooled sums, and the grid coordinates are the block centres.
+    The pooled ofe is only approximate, and biased upwards: the block average of Ftot_den2 (the sum over windows of the squared densities) is larger than the sum of the squared
+    block-averaged densities, as the cross terms between the fine bins are missing, and the variation of the mean force within a block is counted as error. Pooled Ftot_den and
+    mean force are exact block averages; for an exact ofe, choose nbins such that the statistics are subsampled.
+
+    Args:
+        results (list): Output of MFI_2D (or MFI2DAccumulator.results()) on the fine grid.
+        nbins (array): number of bins in CV1,CV2 of the coarse grid, at most the fine nbins.
+
+    Returns:
+        The same list as MFI_2D on the coarse grid: [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y].
+        ofe_history is that of the fine run, as the past error maps are not stored.
+    """
+    [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y] = results
+    grids = [X, Y, Ftot_den, Ftot_den * Ftot_x, Ftot_den * Ftot_y, Ftot_den2, ofv_x, ofv_y]
+    # axis 1 of the grids is CV1, axis 0 is CV2
+    for axis, n_coarse in [(1, int(nbins[0])), (0, int(nbins[1]))]:
+        n_fine = X.shape[axis]
+        if n_coarse > n_fine or n_coarse < 1:
+            raise ValueError("nbins must be between 1 and the number of bins of the fine grid, " + str(n_fine))
+        if n_coarse == n_fine:
+            continue
+        if n_coarse > 1 and (n_fine - 1) % (n_coarse - 1) == 0:
+            grids = [np.take(grid, np.arange(0, n_fine, (n_fine - 1) // (n_coarse - 1)), axis=axis) for grid in grids]
+        else:
+            starts = np.linspace(0, n_fine, n_coarse + 1).astype(int)[:-1]
+            counts = np.diff(np.append(starts, n_fine))
+            shape = [1, 1]
+            shape[axis] = n_coarse
+            grids = [np.add.reduceat(grid, starts, axis=axis) / counts.reshape(shape) for grid in grids]
+
+    [X, Y, Ftot_den, Ftot_num_x, Ftot_num_y, Ftot_den2, ofv_x, ofv_y] = grids
+    [Ftot_x, Ftot_y] = mean_force_2D(Ftot_num_x, Ftot_num_y, Ftot_den)
+    [ofe] = mean_force_variance(Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y)
+    return [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y]
+
+
+### Integration using Fast Fourier Transform (FFT integration) in 2D
+class FFTIntegrator2D:
+    """FFT integration of mean force fields on a fixed grid, reusable across calls.
+    The grid and the Fourier-space integration kernels are built once, the transforms are real FFTs (scipy.fft.rfft2), and a whole stack of force fields
+    (e.g. the snapshots of a convergence study) is integrated in one batched transform, optionally multithreaded.
+    The result is that of the complex-FFT formulation (real part of the inverse transform), for even and odd nbins.
+
+    Args:
+        min_grid (array, optional): Lower bound of the simulation domain. Defaults to np.array((-np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain. Defaults to np.array((np.pi, np.pi)).
+        nbins (array, optional): number of bins in CV1,CV2. Defaults to np.array((200,200)).
+        workers (int, optional): Number of threads of scipy.fft, -1 for all CPUs. Defaults to None, i.e. one.
+    """
+
+    def __init__(self, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins=np.array((200,200)), workers=None):
+        self.nbins = nbins
+        self.workers = workers
+        gridx = np.linspace(min_grid[0], max_grid[0], nbins[0])
+        gridy = np.linspace(min_grid[1], max_grid[1], nbins[1])
+        grid_spacex = (max_grid[0] - min_grid[0]) / (nbins[0] - 1)
+        grid_spacey = (max_grid[1] - min_grid[1]) / (nbins[1] - 1)
+        self.X, self.Y = np.meshgrid(gridx, gridy)
+
+        #Frequencies of the real FFT layout: CV1 (last axis) only up to the Nyquist frequency
+        freq_x = np.fft.rfftfreq(nbins[0], grid_spacex)[np.newaxis, :]
+        freq_y = np.fft.fftfreq(nbins[1], grid_spacey)[:, np.newaxis]
+        freq_hypot = np.hypot(freq_x, freq_y)
+        freq_sq = np.where(freq_hypot != 0, freq_hypot ** 2, 1E-10)
+        self.kernel_x = freq_x / (2 * np.pi * 1j * freq_sq)
+        self.kernel_y = freq_y / (2 * np.pi * 1j * freq_sq)
+        # At the Nyquist frequency of an even grid the integration kernel is not antisymmetric, and its contribution is purely imaginary (dropped by the real part in FFT_intg_2D)
+        if nbins[0] % 2 == 0:
+            self.kernel_x[:, -1] = 0
+        if nbins[1] % 2 == 0:
+            self.kernel_y[nbins[1] // 2, :] = 0
+
+    def integrate(self, FX, FY):
+        """Integrate one force field, or a stack of them.
+
+        Args:
+            FX (array): CV1 component of the force, array of size (nbins[1], nbins[0]) or stack of size (n_fields, nbins[1], nbins[0]).
+            FY (array): CV2 component of the force, of the same size as FX.
+
+        Returns:
+            X: array of size (nbins[1], nbins[0]) - CV1 grid positions (a copy, owned by the caller).
+            Y: array of size (nbins[1], nbins[0]) - CV2 grid positions (a copy, owned by the caller).
+            fes: array of the size of FX - free energy surface(s), each with its minimum at zero.
+        """
+        fourier = scipy.fft.rfft2(FX, workers=self.workers) * self.kernel_x
+        fourier += scipy.fft.rfft2(FY, workers=self.workers) * self.kernel_y
+        fes = scipy.fft.irfft2(fourier, s=self.X.shape, workers=self.workers)
+        fes -= np.min(fes, axis=(-2, -1), keepdims=True)
+        return [self.X.copy(), self.Y.copy(), fes]
+
+@functools.lru_cache(maxsize=8)
+def _cached_fft_integrator(min_grid, max_grid, nbins):
+    integrator = FFTIntegrator2D(np.array(min_grid), np.array(max_grid), np.array(nbins))
+    # shared by every FFT_intg_2D call on this grid
+    for array in [integrator.X, integrator.Y, integrator.kernel_x, integrator.kernel_y]:
+        array.flags.writeable = False
+    return integrator
+
 def FFT_intg_2D(FX, FY, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins = np.array((200,200))):   
+    """Integrate a 2D mean force into a free energy surface with FFTs. The integrator of every grid is built once and cached (see FFTIntegrator2D).
+
+    Args:
+        FX (array): CV1 component of the Mean Force, array of size (nbins[1], nbins[0]), or a stack of size (n_fields, nbins[1], nbins[0]).
+        FY (array): CV2 component of the Mean Force, of the same size as FX.
+        min_grid (array, optional): Lower bound of the simulation domain. Defaults to np.array((-np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain. Defaults to np.array((np.pi, np.pi)).
+        nbins (array, optional): number of bins in CV1,CV2. Defaults to np.array((200,200)).
+
+    Returns:
+        X: CV1 grid positions.
+        Y: CV2 grid positions.
+        fes: free energy surface(s), with the minimum at zero.
+    """
+    integrator = _cached_fft_integrator(tuple(np.asarray(min_grid, dtype=float)), tuple(np.asarray(max_grid, dtype=float)), tuple(int(n) for n in nbins))
+    return integrator.integrate(FX, FY)
+
+#Equivalent to integration MS in Alanine dipeptide notebook.     
+def DCT_intg_2D(FX, FY, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins = np.array((200,200))):
+    """Integrate a 2D mean force into a free energy surface with discrete cosine transforms, for non-periodic CVs.
+    Same call as FFT_intg_2D, but with reflecting (Neumann) instead of periodic boundaries, so there is no wrap-around error at the edges of a non-periodic domain.
+    Solves the uniformly weighted least-squares problem of intgrad_2D (trapezoidal differences between neighbouring bins), whose normal equations are diagonal in the DCT-II basis.
+
+    Args:
+        FX (array): CV1 component of the Mean Force, array of size (nbins[1], nbins[0]), or a stack of size (n_fields, nbins[1], nbins[0]).
+        FY (array): CV2 component of the Mean Force, of the same size as FX.
+        min_grid (array, optional): Lower bound of the simulation domain. Defaults to np.array((-np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain. Defaults to np.array((np.pi, np.pi)).
+        nbins (array, optional): number of bins in CV1,CV2. Defaults to np.array((200,200)).
+
+    Returns:
+        X: CV1 grid positions.
+        Y: CV2 grid positions.
+        fes: free energy surface(s), with the minimum at zero.
+    """
+    gridx = np.linspace(min_grid[0], max_grid[0], nbins[0])
+    gridy = np.linspace(min_grid[1], max_grid[1], nbins[1])
+    X, Y = np.meshgrid(gridx, gridy)
+
+    # Free energy differences between neighbouring bins, and their divergence (right-hand side of the normal equations)
+    dfes_x = (FX[..., :, 1:] + FX[..., :, :-1]) * np.diff(gridx)[0] / 2
+    dfes_y = (FY[..., 1:, :] + FY[..., :-1, :]) * np.diff(gridy)[0] / 2
+    div = np.zeros(np.shape(FX))
+    div[..., :, 1:] += dfes_x
+    div[..., :, :-1] -= dfes_x
+    div[..., 1:, :] += dfes_y
+    div[..., :-1, :] -= dfes_y
+
+    # Eigenvalues of the Neumann Laplacian of the grid
+    eig_x = 2 - 2 * np.cos(np.pi * np.arange(nbins[0]) / nbins[0])
+    eig_y = 2 - 2 * np.cos(np.pi * np.arange(nbins[1]) / nbins[1])
+    eig = eig_y[:, np.newaxis] + eig_x[np.newaxis, :]
+    eig[0, 0] = 1
+
+    fourier = scipy.fft.dctn(div, type=2, axes=(-2, -1), norm="ortho") / eig
+    fourier[..., 0, 0] = 0
+    fes = scipy.fft.idctn(fourier, type=2, axes=(-2, -1), norm="ortho")
+    fes -= np.min(fes, axis=(-2, -1), keepdims=True)
+
+    return [X, Y, fes]
+
+def intg_2D(FX, FY, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins = np.array((200,200)), all_directions=False): 
+    """Integrate a 2D mean force into a free energy surface with cumulative sums (finite differences), vectorised over the grid.
+    By default the integration path runs along CV2 on the first column of the grid, then along CV1.
+    With all_directions=True, the free energy surface is the average of the 8 paths that start from the 4 corners of the grid, CV1 or CV2 first
+    (the MSintegral scheme of the alanine dipeptide scripts), which averages out the path dependence of a noisy mean force.
+
+    Args:
+        FX (array): CV1 component of the Mean Force, array of size (nbins[1], nbins[0]).
+        FY (array): CV2 component of the Mean Force, array of size (nbins[1], nbins[0]).
+        min_grid (array, optional): Lower bound of the simulation domain. Defaults to np.array((-np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain. Defaults to np.array((np.pi, np.pi)).
+        nbins (array, optional): number of bins in CV1,CV2. Defaults to np.array((200,200)).
+        all_directions (bool, optional): Average the 8 integration paths. Defaults to False.
+
+    Returns:
+        X: array of size (nbins[1], nbins[0]) - CV1 grid positions.
+        Y: array of size (nbins[1], nbins[0]) - CV2 grid positions.
+        fes: array of size (nbins[1], nbins[0]) - free energy surface, with the minimum at zero.
+    """
     
     gridx = np.linspace(min_grid[0], max_grid[0], nbins[0])
     gridy = np.linspace(min_grid[1], max_grid[1], nbins[1])
-    grid_spacex = (max_grid[0] - min_grid[0]) / (nbins[0] - 1)
-    grid_spacey = (max_grid[1] - min_grid[1]) / (nbins[1] - 1)
     X, Y = np.meshgrid(gridx, gridy)
 
-    #Calculate frequency
-    freq_1dx = np.fft.fftfreq(nbins[0], grid_spacex)
-    freq_1dy = np.fft.fftfreq(nbins[1], grid_spacey)
-    freq_x, freq_y = np.meshgrid(freq_1dx, freq_1dy)
-    freq_hypot = np.hypot(freq_x, freq_y)
-    freq_sq = np.where(freq_hypot != 0, freq_hypot ** 2, 1E-10)
-    #FFTransform and integration
-    fourier_x = (np.fft.fft2(FX) * freq_x) / (2 * np.pi * 1j * freq_sq)
-    fourier_y = (np.fft.fft2(FY) * freq_y) / (2 * np.pi * 1j * freq_sq)
-    #Reverse FFT
-    fes_x = np.real(np.fft.ifft2(fourier_x))
-    fes_y = np.real(np.fft.ifft2(fourier_y))
-    #Construct whole FES
-    fes = fes_x + fes_y
+    # Paths start from the corner (0,0) of the (possibly flipped) force; the sign of a flipped CV is reversed
+    flips = [(1, 1), (-1, 1), (1, -1), (-1, -1)] if all_directions else [(1, 1)]
+    fes_sum = np.zeros(X.shape)
+    for flip_y, flip_x in flips:
+        FdSx = np.cumsum(FX[::flip_y, ::flip_x], axis=1)*np.diff(gridx)[0]
+        FdSy = np.cumsum(FY[::flip_y, ::flip_x], axis=0)*np.diff(gridy)[0]
+
+        paths = [flip_y*(FdSy[:, :1] - FdSy[0, 0]) + flip_x*FdSx - flip_x*FdSx[:, :1]]
+        if all_directions: paths.append(flip_x*(FdSx[:1, :] - FdSx[0, 0]) + flip_y*FdSy - flip_y*FdSy[:1, :])
+        for fes in paths:
+            fes_sum += fes[::flip_y, ::flip_x] - np.min(fes)
+
+    fes = fes_sum / (2*len(flips) if all_directions else 1)
     fes = fes - np.min(fes)
+
     return [X, Y, fes]
 
-#Equivalent to integration MS in Alanine dipeptide notebook.     
-def intg_2D(FX, FY, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins = np.array((200,200))): 
-    """_summary_
+
+@functools.lru_cache(maxsize=8)
+def _gradient_operator_2D(nbins, periodic):
+    """Sparse finite-difference operator of the CV1 then CV2 edges of a grid of size (nbins[1], nbins[0]), as used by intgrad_2D.
+    Row k of the operator is f[end] - f[start] of edge k. Along a periodic CV the first and last grid points are the same point, and are tied by an extra edge.
+
+    Returns:
+        D: sparse array of size (n_edges, nbins[0]*nbins[1]).
+        starts: array of size (n_edges,) - flat index of the first bin of every edge.
+        ends: array of size (n_edges,) - flat index of the second bin of every edge.
+        n_edges_x: number of CV1 edges (the first rows of D), the CV2 edges follow.
+        wrap: boolean array of size (n_edges,) - edges tying the two ends of a periodic CV.
+    """
+    index = np.arange(nbins[0] * nbins[1]).reshape(nbins[1], nbins[0])
+    edges = []
+    for axis, periodic_axis in zip([1, 0], periodic):
+        start = np.moveaxis(index, axis, 0)
+        [start, end, wrap] = [start[:-1], start[1:], np.zeros(start[:-1].shape, dtype=bool)]
+        if periodic_axis:
+            start = np.concatenate([start, np.moveaxis(index, axis, 0)[-1:]])
+            end = np.concatenate([end, np.moveaxis(index, axis, 0)[:1]])
+            wrap = np.concatenate([wrap, np.ones(start[-1:].shape, dtype=bool)])
+        edges.append([start.ravel(), end.ravel(), wrap.ravel()])
+    [starts, ends, wrap] = [np.concatenate([edges[0][k], edges[1][k]]) for k in range(3)]
+    rows = np.arange(len(starts))
+    D = scipy.sparse.csr_array((np.concatenate([-np.ones(len(starts)), np.ones(len(ends))]), (np.concatenate([rows, rows]), np.concatenate([starts, ends]))), shape=(len(starts), nbins[0] * nbins[1]))
+    return [D, starts, ends, len(edges[0][0]), wrap]
+
+def intgrad_2D(FX, FY, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins = np.array((200,200)), weights=None, periodic=0, fes_guess=None, mask_threshold=1E-3, tol=1E-8, maxiter=None):
+    """Integrate a 2D mean force into a free energy surface by density-weighted least squares (the inverse gradient problem of intgrad2.m).
+    Every pair of neighbouring bins gives the equation fes[end] - fes[start] = (grid spacing) * (mean force at the two bins), weighted by the smaller weight of the two bins.
+    Bins with a weight below mask_threshold (relative to the largest weight) are masked, i.e. their equations get a negligible weight, so the free energy of unvisited
+    regions is a smooth continuation of the visited ones and does not depend on their (meaningless) mean force.
+    The normal equations are solved with Jacobi-preconditioned conjugate gradients, starting from fes_guess if given (e.g. the free energy surface of the last
+    error checkpoint). As tol is relative to the norm of the right-hand side, not to the residual of the guess, a warm start only saves a fraction of the iterations.
 
     Args:
-        FX (_type_): _description_
-        FY (_type_): _description_
-        min_grid (_type_, optional): _description_. Defaults to np.array((-np.pi, -np.pi)).
-        max_grid (_type_, optional): _description_. Defaults to np.array((np.pi, np.pi)).
-        nbins (_type_, optional): _description_. Defaults to np.array((200,200)).
+        FX (array): CV1 component of the Mean Force, array of size (nbins[1], nbins[0]).
+        FY (array): CV2 component of the Mean Force, array of size (nbins[1], nbins[0]).
+        min_grid (array, optional): Lower bound of the simulation domain. Defaults to np.array((-np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain. Defaults to np.array((np.pi, np.pi)).
+        nbins (array, optional): number of bins in CV1,CV2. Defaults to np.array((200,200)).
+        weights (array, optional): Weight of every bin, typically Ftot_den. Defaults to None, i.e. uniform weights.
+        periodic (int or array, optional): Is the CV space periodic? 1 for yes, for both CVs or one value per CV. Defaults to 0.
+        fes_guess (array, optional): Initial guess of the free energy surface, of size (nbins[1], nbins[0]). Defaults to None.
+        mask_threshold (float, optional): Relative weight below which bins are masked. Defaults to 1E-3.
+        tol (float, optional): Relative tolerance of the conjugate gradient solver. Defaults to 1E-8.
+        maxiter (int, optional): Maximum number of conjugate gradient iterations. Defaults to None, i.e. 10 times the number of bins.
 
     Returns:
-        _type_: _description_
+        X: array of size (nbins[1], nbins[0]) - CV1 grid positions.
+        Y: array of size (nbins[1], nbins[0]) - CV2 grid positions.
+        fes: array of size (nbins[1], nbins[0]) - free energy surface, with the minimum at zero.
     """
-    
     gridx = np.linspace(min_grid[0], max_grid[0], nbins[0])
     gridy = np.linspace(min_grid[1], max_grid[1], nbins[1])
     X, Y = np.meshgrid(gridx, gridy)
+    periodic = tuple(bool(p) for p in np.broadcast_to(np.asarray(periodic) != 0, (2,)))
+    [D, starts, ends, n_edges_x, wrap] = _gradient_operator_2D((int(nbins[0]), int(nbins[1])), periodic)
+
+    # Target differences (trapezoidal rule); the edges tying the two ends of a periodic CV join the same point
+    force = np.concatenate([np.ravel(FX)[starts[:n_edges_x]] + np.ravel(FX)[ends[:n_edges_x]], np.ravel(FY)[starts[n_edges_x:]] + np.ravel(FY)[ends[n_edges_x:]]])
+    spacing = np.concatenate([np.full(n_edges_x, np.diff(gridx)[0]), np.full(len(starts) - n_edges_x, np.diff(gridy)[0])]) / 2
+    spacing[wrap] = 0
+    target = spacing * force
 
-    FdSx = np.cumsum(FX, axis=1)*np.diff(gridx)[0]
-    FdSy = np.cumsum(FY, axis=0)*np.diff(gridy)[0]
+    if weights is None:
+        edge_weights = np.ones(len(starts))
+    else:
+        weights = np.ravel(weights) / np.max(weights)
+        edge_weights = np.minimum(weights[starts], weights[ends])
+        edge_weights = np.where(edge_weights >= mask_threshold, edge_weights, mask_threshold * 1E-3)
 
-    fes = np.zeros(FdSx.shape)
-    for i in range(fes.shape[0]):
-        for j in range(fes.shape[1]):
-            fes[i,j] += np.sum([FdSy[i,0], -FdSy[0,0], FdSx[i,j], -FdSx[i,0]])
+    A = (D.T * edge_weights) @ D
+    b = D.T @ (edge_weights * target)
+    preconditioner = scipy.sparse.diags_array(1 / A.diagonal())
+    x0 = None if fes_guess is None else np.ravel(fes_guess)
+    maxiter = maxiter if maxiter is not None else 10 * len(b)
+    [fes, info] = scipy.sparse.linalg.cg(A, b, x0=x0, rtol=tol, maxiter=maxiter, M=preconditioner)
+    if info > 0:
+        warnings.warn("intgrad_2D: conjugate gradients did not converge in " + str(maxiter) + " iterations")
 
+    fes = fes.reshape(X.shape)
     fes = fes - np.min(fes)
 
     return [X, Y, fes]
@@ -319,7 +1332,6 @@ def plot_recap_2D(X, Y, FES, TOTAL_DENSITY, CONVMAP, CONV_history,FES_lim=50,ofe
 
 
 # Patch independent simulations
-#@jit
 def patch_2D(master_array,nbins = np.array((200,200))):
 
     FX = np.zeros(nbins)
@@ -361,45 +1373,170 @@ def plot_patch_2D(X, Y, FES, TOTAL_DENSITY,lim=50):
     axs[1].set_title('Total Biased Probability Density',fontsize=11)
 
 
-#@jit
-def patch_2D_error(master,nbins = np.array((200,200))):
+def patch_2D_error(master,nbins = np.array((200,200)), dtype = np.float64):
+    """Patch the mean force of independent simulations, weighted by their biased probability density, and estimate the error of the patched mean force from the spread of the simulations.
+    The spread is computed in two passes, as sum(den * (F - F_patched)**2) / sum(den), which does not cancel like E[F**2] - E[F]**2 and is therefore also accurate in float32.
+
+    Args:
+        master (array): array of size (n_simulations, 6, nbins[1], nbins[0]) - [Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y] of every simulation.
+        nbins (array, optional): number of bins in CV1,CV2. Defaults to np.array((200,200)).
+        dtype (optional): np.float64 or np.float32, precision of the patched grids. Defaults to np.float64.
+
+    Returns:
+        Ftot_x: CV1 component of the patched Mean Force.
+        Ftot_y: CV2 component of the patched Mean Force.
+        Ftot_den: Patched biased probability density.
+        error: Error of the patched Mean Force.
+    """
+    Ftot_x = np.zeros(nbins, dtype=dtype)
+    Ftot_y = np.zeros(nbins, dtype=dtype)
+    Ftot_den = np.zeros(nbins, dtype=dtype)
+    Ftot_den2 = np.zeros(nbins, dtype=dtype)
+    error_x = np.zeros(nbins, dtype=dtype)
+    error_y = np.zeros(nbins, dtype=dtype)
 
-       
-    Ftot_x = np.zeros(nbins)
-    Ftot_y = np.zeros(nbins)
-    Ftot_den = np.zeros(nbins)
-    Ftot_den2 = np.zeros(nbins)
-    ofv_x = np.zeros(nbins)
-    ofv_y = np.zeros(nbins)
-    error_x = np.zeros(nbins)
-    error_y = np.zeros(nbins)
-    
     for i in np.arange(0,len(master)):
-        Ftot_x += master[i][0] * master[i][2]
-        Ftot_y += master[i][0] * master[i][3]
-        Ftot_den += master[i][0]
-        Ftot_den2 += master[i][1]
-        ofv_x += master[i][4]
-        ofv_y += master[i][5]
-        error_x += master[i][0] * (master[i][2]**2)
-        error_y += master[i][0] * (master[i][3]**2)
+        [den, den2, Fx, Fy] = [np.asarray(master[i][k], dtype=dtype) for k in range(4)]
+        Ftot_x += den * Fx
+        Ftot_y += den * Fy
+        Ftot_den += den
+        Ftot_den2 += den2
 
     Ftot_x = np.divide(Ftot_x, Ftot_den, out=np.zeros_like(Ftot_x), where=Ftot_den != 0)
     Ftot_y = np.divide(Ftot_y, Ftot_den, out=np.zeros_like(Ftot_y), where=Ftot_den != 0)
-        
-              
-    error_x = np.divide(error_x, Ftot_den, out=np.zeros_like(error_x), where=Ftot_den != 0) - (Ftot_x**2)
-    error_y = np.divide(error_y, Ftot_den, out=np.zeros_like(error_y), where=Ftot_den != 0) - (Ftot_y**2)
-       
+
+    for i in np.arange(0,len(master)):
+        [den, Fx, Fy] = [np.asarray(master[i][k], dtype=dtype) for k in (0, 2, 3)]
+        error_x += den * (Fx - Ftot_x)**2
+        error_y += den * (Fy - Ftot_y)**2
+
+    error = _patch_error_2D(Ftot_den, Ftot_den2, error_x, error_y)
+
+    return [Ftot_x,Ftot_y,Ftot_den,error]
+
+def _patch_error_2D(Ftot_den, Ftot_den2, error_x, error_y):
+    """Error of the patched mean force from the patched densities and the sums of den * (F - F_patched)**2 of the CV1 and CV2 components, see patch_2D_error."""
+    error_x = np.divide(error_x, Ftot_den, out=np.zeros_like(error_x), where=Ftot_den != 0)
+    error_y = np.divide(error_y, Ftot_den, out=np.zeros_like(error_y), where=Ftot_den != 0)
+
     ratio = np.divide(Ftot_den2, (Ftot_den**2 - Ftot_den2), out=np.zeros_like(error_x), where=(Ftot_den**2 - Ftot_den2) != 0)
     error_x = error_x * ratio
     error_y = error_y * ratio
         
-    error = np.sqrt(np.sqrt(error_x**2 + error_y**2))
+    return np.sqrt(np.sqrt(error_x**2 + error_y**2))
 
-    return [Ftot_x,Ftot_y,Ftot_den,error]
 
-        
-        
+def _resampled_error_2D(replicas, Ftot_x, Ftot_y, n_replicas, jackknife, integrate, min_grid, max_grid, nbins, integrator, confidence):
+    """Error of the patched mean force (and FES) from batches of resampled [Ftot_den, Ftot_num_x, Ftot_num_y], each of size (n_batch, n_bins), see bootstrap_2D and jackknife_2D."""
+    shape = np.shape(Ftot_x)
+    # sums of the deviations from the full estimate (shifted sums, which do not cancel like E[F**2] - E[F]**2)
+    [sum_x, sum_y, sum2_x, sum2_y] = [np.zeros(Ftot_x.size) for k in range(4)]
+    fes_replicas = []
+    for [den, num_x, num_y] in replicas:
+        Fx = np.divide(num_x, den, out=np.zeros_like(num_x), where=den != 0)
+        Fy = np.divide(num_y, den, out=np.zeros_like(num_y), where=den != 0)
+        if integrate:
+            fes_replicas.append(integrator(Fx.reshape((-1,) + shape), Fy.reshape((-1,) + shape), min_grid=min_grid, max_grid=max_grid, nbins=nbins)[2])
+        Fx -= Ftot_x.ravel()
+        Fy -= Ftot_y.ravel()
+        sum_x += Fx.sum(axis=0)
+        sum_y += Fy.sum(axis=0)
+        sum2_x += (Fx**2).sum(axis=0)
+        sum2_y += (Fy**2).sum(axis=0)
+
+    # bootstrap: sample variance of the replicas; jackknife: (n-1)/n times the sum of squared deviations
+    scale = (n_replicas - 1) / n_replicas if jackknife else 1 / (n_replicas - 1)
+    var_x = (sum2_x - sum_x**2 / n_replicas) * scale
+    var_y = (sum2_y - sum_y**2 / n_replicas) * scale
+    error = np.sqrt(np.abs(var_x) + np.abs(var_y)).reshape(shape)
+    if not integrate:
+        return [error, None, None, None, None]
+
+    FES = integrator(Ftot_x, Ftot_y, min_grid=min_grid, max_grid=max_grid, nbins=nbins)[2]
+    fes_replicas = np.concatenate(fes_replicas)
+    if jackknife:
+        FES_error = np.std(fes_replicas, axis=0) * np.sqrt(n_replicas - 1)
+        z = scipy.stats.norm.ppf(0.5 + confidence / 2)
+        [FES_lower, FES_upper] = [FES - z * FES_error, FES + z * FES_error]
+    else:
+        FES_error = np.std(fes_replicas, axis=0, ddof=1)
+        [FES_lower, FES_upper] = np.percentile(fes_replicas, [50 * (1 - confidence), 50 * (1 + confidence)], axis=0)
+    return [error, FES, FES_error, FES_lower, FES_upper]
+
+def bootstrap_2D(master, n_replicas=1000, integrate=False, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins=np.array((200,200)),
+                 integrator=FFT_intg_2D, confidence=0.95, batch_size=100, seed=None):
+    """Bootstrap error of the mean force patched from independent simulations (walkers), and optionally confidence bands of the free energy surface.
+    Every replica patches a resample (with replacement) of the walkers. All replicas of a batch are patched at once, as the product of a
+    (replicas x walkers) matrix of resampling counts with the stacked density-weighted forces of the walkers, and their forces are integrated as one stack.
+
+    Args:
+        master (array): array of size (n_walkers, 6, nbins[1], nbins[0]) - [Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y] of every walker, as for patch_2D_error.
+        n_replicas (int, optional): Number of bootstrap replicas. Defaults to 1000.
+        integrate (bool, optional): Also integrate every replica, for the error and confidence band of the free energy surface. Defaults to False.
+        min_grid (array, optional): Lower bound of the simulation domain (for the integration). Defaults to np.array((-np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain (for the integration). Defaults to np.array((np.pi, np.pi)).
+        nbins (array, optional): number of bins in CV1,CV2 (for the integration). Defaults to np.array((200,200)).
+        integrator (function, optional): Integrator accepting stacks of forces, FFT_intg_2D (periodic CVs) or DCT_intg_2D (non-periodic CVs). Defaults to FFT_intg_2D.
+        confidence (float, optional): Confidence level of the free energy band, from the percentiles of the replicas. Defaults to 0.95.
+        batch_size (int, optional): Number of replicas patched (and integrated) at once, which bounds the memory of the force replicas. Defaults to 100.
+        seed (int, optional): Seed of the random number generator. Defaults to None.
+
+    Returns:
+        Ftot_x: CV1 component of the patched Mean Force (all walkers).
+        Ftot_y: CV2 component of the patched Mean Force.
+        Ftot_den: Patched biased probability density.
+        error: Bootstrap standard error of the patched Mean Force, sqrt(var(Ftot_x) + var(Ftot_y)).
+        FES: free energy surface of the patched Mean Force (None if integrate is False).
+        FES_error: Bootstrap standard error of the free energy surface (None if integrate is False).
+        FES_lower: Lower bound of the confidence band of the free energy surface (None if integrate is False).
+        FES_upper: Upper bound of the confidence band of the free energy surface (None if integrate is False).
+    """
+    master = np.asarray(master)
+    n_walkers = len(master)
+    shape = master.shape[2:]
+    den = master[:, 0].reshape(n_walkers, -1)
+    [num_x, num_y] = [den * master[:, 2].reshape(n_walkers, -1), den * master[:, 3].reshape(n_walkers, -1)]
+    Ftot_den = den.sum(axis=0)
+    [Ftot_x, Ftot_y] = mean_force_2D(num_x.sum(axis=0), num_y.sum(axis=0), Ftot_den)
+    [Ftot_x, Ftot_y, Ftot_den] = [Ftot_x.reshape(shape), Ftot_y.reshape(shape), Ftot_den.reshape(shape)]
+
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(n_walkers, np.full(n_walkers, 1 / n_walkers), size=n_replicas).astype(float)
+    replicas = ([weights @ den, weights @ num_x, weights @ num_y] for weights in np.array_split(counts, max(1, int(np.ceil(n_replicas / batch_size)))))
+    return [Ftot_x, Ftot_y, Ftot_den] + _resampled_error_2D(replicas, Ftot_x, Ftot_y, n_replicas, False, integrate, min_grid, max_grid, nbins, integrator, confidence)
+
+def _leave_one_out_sums(values):
+    """Sum of all the rows of values but row i, for every row i, as the sum of the rows before i plus the sum of the rows after i, see jackknife_2D."""
+    before = np.zeros_like(values)
+    np.cumsum(values[:-1], axis=0, out=before[1:])
+    after = np.zeros_like(values)
+    np.cumsum(values[:0:-1], axis=0, out=after[-2::-1])
+    return before + after
+
+def jackknife_2D(master, integrate=False, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins=np.array((200,200)),
+                 integrator=FFT_intg_2D, confidence=0.95, batch_size=100):
+    """Leave-one-out jackknife error of the mean force patched from independent simulations (walkers), and optionally of the free energy surface.
+    The replica without walker i is the sum of the walkers before i plus the sum of the walkers after i (exclusive cumulative sums), so all replicas cost two passes over the walkers.
+    Unlike the total of all walkers minus walker i, this does not cancel in the bins dominated by walker i.
+
+    Args:
+        master (array): array of size (n_walkers, 6, nbins[1], nbins[0]) - [Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y] of every walker, as for patch_2D_error.
+        integrate, min_grid, max_grid, nbins, integrator, batch_size: see bootstrap_2D.
+        confidence (float, optional): Confidence level of the free energy band, FES -/+ z * FES_error with the normal quantile z. Defaults to 0.95.
+
+    Returns:
+        The same list as bootstrap_2D: [Ftot_x, Ftot_y, Ftot_den, error, FES, FES_error, FES_lower, FES_upper], with jackknife errors.
+    """
+    master = np.asarray(master)
+    n_walkers = len(master)
+    shape = master.shape[2:]
+    den = master[:, 0].reshape(n_walkers, -1)
+    [num_x, num_y] = [den * master[:, 2].reshape(n_walkers, -1), den * master[:, 3].reshape(n_walkers, -1)]
+    [total_den, total_x, total_y] = [den.sum(axis=0), num_x.sum(axis=0), num_y.sum(axis=0)]
+    [Ftot_x, Ftot_y] = mean_force_2D(total_x, total_y, total_den)
+    [Ftot_x, Ftot_y, Ftot_den] = [Ftot_x.reshape(shape), Ftot_y.reshape(shape), total_den.reshape(shape)]
 
-        
\ No newline at end of file
+    [den, num_x, num_y] = [_leave_one_out_sums(den), _leave_one_out_sums(num_x), _leave_one_out_sums(num_y)]
+    batches = np.array_split(np.arange(n_walkers), max(1, int(np.ceil(n_walkers / batch_size))))
+    replicas = ([den[batch], num_x[batch], num_y[batch]] for batch in batches)
+    return [Ftot_x, Ftot_y, Ftot_den] + _resampled_error_2D(replicas, Ftot_x, Ftot_y, n_walkers, True, integrate, min_grid, max_grid, nbins, integrator, confidence)
@@ -2,10 +2,17 @@ import glob
 import matplotlib.pyplot as plt
 import scipy.integrate as integrate
 import numpy as np
+from . import plumed_files
+from . import progress
 
-def load_HILLS(hills_name = "HILLS"):
+def load_HILLS(hills_name = "HILLS", cache = False):
+    """Load a 1D HILLS file, selecting the columns by name from the FIELDS header, with an optional binary sidecar cache (see plumed_files.load_plumed_file).
+
+    Returns:
+        array of size (number_of_hills, 5) - time, CV, sigma, height, biasfactor, shifted so that row i is the last hill deposited before the i-th window of positions.
+    """
     for file in glob.glob(hills_name):
-        hills = np.loadtxt(file)
+        hills = np.array(plumed_files.load_plumed_file(file, plumed_files.hills_fields(file, 1), cache=cache))
         hills = hills[:-1]
         hills0 = hills[0]
         hills0[3] = 0
@@ -13,20 +20,51 @@ def load_HILLS(hills_name = "HILLS"):
     return hills
 
 #Load the trajectory (position) data
-def load_position(position_name = "position"):
+def load_position(position_name = "position", field = None, cache = False):
+    """Load the CV from a 1D position (COLVAR) file, i.e. the column field of the FIELDS header (default: the column after time). The last row is discarded."""
     for file1 in glob.glob(position_name):
-        colvar = np.loadtxt(file1)
-    return colvar[:-1, 1]
+        colvar = plumed_files.load_plumed_file(file1, [field] if field is not None else (plumed_files.read_fields(file1) or [0, 1])[1:2], cache=cache)
+    return colvar[:-1, 0]
 
 ### Algorithm to run 1D MFI
 #Run MFI algorithm with on the fly error calculation
-def MFI_1D(HILLS = "HILLS", position = "position", bw = 1, kT = 1, min_grid=2, max_grid=2, nbins = 101, log_pace = 10, error_pace = 200, WellTempered=0):    
+def MFI_1D(HILLS = "HILLS", position = "position", bw = 1, kT = 1, min_grid=2, max_grid=2, nbins = 101, log_pace = 10, error_pace = 200, WellTempered=0, callback=None, cutoff=None, block_size=2**16):    
+    """Compute a time-independent estimate of the Mean Thermodynamic Force in a 1D CV space.
+    The hill windows are analysed in blocks: the kernels of all the samples of a block are evaluated in one (windows, stride, nbins) array,
+    and the bias force and sufficient statistics after every window of the block are obtained by cumulative sums (in the same order as one sample at a time, so the results do not depend on block_size).
+
+    Args:
+        HILLS (array, optional): HILLS array of size (number_of_hills, 5), as returned by load_HILLS: time, CV, sigma, height, biasfactor. Defaults to "HILLS".
+        position (array, optional): CV array, as returned by load_position. Its length divided by the number of hills is the stride, the number of positions per hill. Defaults to "position".
+        bw (float, optional): Scalar, bandwidth for the construction of the KDE estimate of the biased probability density. Defaults to 1.
+        kT (float, optional): Scalar, kT. Defaults to 1.
+        min_grid (float, optional): Lower bound of the simulation domain. Defaults to 2.
+        max_grid (float, optional): Upper bound of the simulation domain. Defaults to 2.
+        nbins (int, optional): number of bins in CV. Defaults to 101.
+        log_pace (int, optional): Pace for outputting progress and convergence. Defaults to 10.
+        error_pace (int, optional): Pace for the calculation of the on-the-fly measure of global convergence. Defaults to 200.
+        WellTempered (int, optional): Is the simulation well tempered? Defaults to 0.
+        callback (callable or list, optional): Function(s) called with the progress events of the analysis (hill index, hills/s, time per phase, current average error, peak memory), see pyMFI.progress.
+            e.g. progress.JSONLinesHandler("MFI_log.jsonl") to log them as JSON lines. Defaults to None, i.e. progress.print_progress_1D; an empty list runs silently.
+        cutoff (float, optional): If set, every KDE kernel and metadynamics hill is only deposited on the grid points within cutoff standard deviations of its centre, see MFI.MFI_2D.
+            The cost per sample then no longer grows with nbins, which pays off for fine grids (10^4 bins and up). Defaults to None, i.e. kernels are evaluated on the full grid.
+        block_size (int, optional): Approximate number of kernel values evaluated per block (at least one hill window per block), which bounds the memory used (blocks that fit in the CPU cache are the fastest). Defaults to 2**16.
+
+    Returns:
+        grid: array of size (nbins) - CV grid positions
+        Ftot_den: array of size (nbins) - Cumulative biased probability density, equivalent to an unbiased histogram of samples in CV space.
+        Ftot: array of size (nbins) - Mean Force.
+        ofe: array of size (nbins) - on the fly estimate of the local convergence
+        ofe_history: list - running estimate of the global convergence of the mean force, one value every total_number_of_hills / error_pace hills.
+    """
     
     grid = np.linspace(min_grid, max_grid, nbins)
     stride = int(len(position) / len(HILLS[:,1]))     
     const = (1 / (bw*np.sqrt(2*np.pi)*stride))
     total_number_of_hills=len(HILLS[:,1])
     bw2 = bw**2    
+    kernel_width = len(grid) if cutoff is None else min(stencil_width_1D(grid, cutoff * bw), len(grid))
+    windows = max(int(block_size / max(stride * kernel_width, len(grid))), 1)  # hill windows per block
 
     # initialise force terms
     Fbias = np.zeros(len(grid))
@@ -43,49 +81,124 @@ def MFI_1D(HILLS = "HILLS", position = "position", bw = 1, kT = 1, min_grid=2, m
         gamma = HILLS[0, 4]
         Gamma_Factor=(gamma - 1)/(gamma)
 
+    timer = progress.PhaseTimer()
+    events = progress.Progress(progress.print_progress_1D if callback is None else callback, total_number_of_hills, timer)
+    events.emit("start", 0)
+    error_stride = max(int(total_number_of_hills / error_pace), 1)
+    log_stride = max(int(total_number_of_hills / log_pace), 1)
 
-    for i in range(total_number_of_hills):
-        # Build metadynamics potential
-        s = HILLS[i, 1]  # center position of Gaussian
-        sigma_meta2 = HILLS[i, 2] ** 2  # width of Gaussian
-        gamma = HILLS[i, 4]  # scaling factor of Gaussian
-        height_meta = HILLS[i, 3] * Gamma_Factor  # Height of Gaussian
-
-        kernelmeta = np.exp(-0.5 * (((grid - s) ** 2) / (sigma_meta2)))
-        Fbias = Fbias + height_meta * kernelmeta * ((grid - s) / (sigma_meta2))  # Bias force due to Metadynamics potentials
-
-        # Estimate the biased proabability density
-        pb_t = np.zeros(len(grid))
-        Fpbt = np.zeros(len(grid))
-        data = position[i * stride: (i + 1) * stride]  # positons of window of constant bias force.
-        for j in range(stride):
-            kernel = const * np.exp(- (grid - data[j]) ** 2 / (2 * bw2))  # probability density of 1 datapoint
-            pb_t = pb_t + kernel  # probability density of window
-            Fpbt = Fpbt + kT * kernel * (grid - data[j]) / bw2
-
-        # Estimate of the Mean Force and error  for terms
-        Ftot_den = Ftot_den + pb_t  # total probability density
-        dfds = np.divide(Fpbt, pb_t, out=np.zeros_like(Fpbt), where=pb_t != 0) + Fbias
-        Ftot_num = Ftot_num + pb_t * dfds
-        Ftot = np.divide(Ftot_num, Ftot_den, out=np.zeros_like(Ftot_num), where=Ftot_den != 0)  # total force
-        
-        #additional terms for error calculation
-        Ftot_den2 = Ftot_den2 + pb_t ** 2 #sum of (probability densities)^2
-        ofv = ofv + pb_t * (dfds ** 2)   #sum of (weighted mean force of window)^2
-
-        #Calculate error
-        if (i + 1) % int(total_number_of_hills / error_pace) == 0:
-            #ofe 
-            Ftot_den_ratio = np.divide(Ftot_den2, (Ftot_den ** 2 - Ftot_den2), out=np.zeros_like(Ftot_den), where=Ftot_den > 1E-10)
-            ofe = np.divide(ofv, Ftot_den, out=np.zeros_like(ofv), where=Ftot_den > 1E-10) - Ftot ** 2
-            ofe = ofe * Ftot_den_ratio
-            ofe = np.sqrt(ofe)
-            ofe_history.append(sum(ofe)/nbins)
-            if (i + 1) % int(total_number_of_hills / log_pace) == 0:
-                print(str(round((i + 1) / total_number_of_hills * 100, 0)) + "%   OFE =", round(ofe_history[-1],4))
+    for first in range(0, total_number_of_hills, windows):
+        last = min(first + windows, total_number_of_hills)
+        # Build metadynamics potential after every hill of the block
+        timer.start()
+        s = HILLS[first:last, 1, np.newaxis]  # center position of Gaussian
+        sigma_meta2 = HILLS[first:last, 2, np.newaxis] ** 2  # width of Gaussian
+        height_meta = HILLS[first:last, 3, np.newaxis] * Gamma_Factor  # Height of Gaussian
+
+        if cutoff is None:
+            kernelmeta = np.exp(-0.5 * (((grid - s) ** 2) / (sigma_meta2)))
+            Fbias_block = height_meta * kernelmeta * ((grid - s) / (sigma_meta2))  # Bias force due to Metadynamics potentials
+        else:
+            [index, ds, inside] = kernel_stencils_1D(s, sigma_meta2, grid, cutoff)
+            kernelmeta = np.exp(-0.5 * ((ds ** 2) / (sigma_meta2[..., np.newaxis])))
+            Fbias_block = np.where(inside, height_meta[..., np.newaxis] * kernelmeta * (ds / (sigma_meta2[..., np.newaxis])), 0)
+            Fbias_block = np.bincount(index.ravel(), Fbias_block.ravel(), (last - first) * len(grid)).reshape(last - first, len(grid))
+        Fbias_block = _cumulate(Fbias, Fbias_block)
+        Fbias = Fbias_block[-1]
+        timer.stop("bias")
+
+        # Estimate the biased proabability density of every window of the block
+        data = position[first * stride: last * stride].reshape(last - first, stride, 1)  # positons of windows of constant bias force.
+        if cutoff is None:
+            ds = grid - data
+        else:
+            [index, ds, inside] = kernel_stencils_1D(data.reshape(last - first, stride), bw2, grid, cutoff)
+        kernel = np.square(ds)  # probability density of every datapoint, const * np.exp(- ds ** 2 / (2 * bw2)) evaluated in place
+        np.negative(kernel, out=kernel)
+        kernel /= 2 * bw2
+        np.exp(kernel, out=kernel)
+        kernel *= const
+        Fpbt = np.multiply(kernel, kT)  # kT * kernel * ds / bw2 evaluated in place
+        Fpbt *= ds
+        Fpbt /= bw2
+        if cutoff is None:
+            pb_t = kernel.sum(axis=1)  # probability density of window
+            Fpbt = Fpbt.sum(axis=1)
+        else:
+            pb_t = np.bincount(index.ravel(), np.where(inside, kernel, 0).ravel(), (last - first) * len(grid)).reshape(last - first, len(grid))
+            Fpbt = np.bincount(index.ravel(), np.where(inside, Fpbt, 0).ravel(), (last - first) * len(grid)).reshape(last - first, len(grid))
+        del kernel, ds
+        timer.stop("kde")
+
+        # Estimate of the Mean Force and error  for terms (sufficient statistics only, the total force is computed at checkpoints)
+        dfds = np.divide(Fpbt, pb_t, out=Fpbt, where=pb_t != 0)  # Fpbt is zero wherever pb_t is
+        dfds += Fbias_block
+        Ftot_num_block = _cumulate(Ftot_num, pb_t * dfds)
+        ofv_block = _cumulate(ofv, pb_t * (dfds ** 2))  #sum of (weighted mean force of window)^2
+        Ftot_den2_block = _cumulate(Ftot_den2, pb_t ** 2)  #sum of (probability densities)^2
+        Ftot_den_block = _cumulate(Ftot_den, pb_t)  # total probability density
+        Ftot_num, ofv, Ftot_den2, Ftot_den = Ftot_num_block[-1], ofv_block[-1], Ftot_den2_block[-1], Ftot_den_block[-1]
+        timer.stop("accumulate")
+
+        #Calculate error at the checkpoints of the block
+        for i in range(first, last):
+            if (i + 1) % error_stride == 0:
+                w = i - first
+                Ftot = np.divide(Ftot_num_block[w], Ftot_den_block[w], out=np.zeros(len(grid)), where=Ftot_den_block[w] != 0)  # total force
+                #ofe 
+                Ftot_den_diff = Ftot_den_block[w] ** 2 - Ftot_den2_block[w]  # zero in bins reached by a single kernel (e.g. with a cutoff)
+                Ftot_den_ratio = np.divide(Ftot_den2_block[w], Ftot_den_diff, out=np.zeros(len(grid)), where=(Ftot_den_block[w] > 1E-10) & (Ftot_den_diff != 0))
+                ofe = np.divide(ofv_block[w], Ftot_den_block[w], out=np.zeros(len(grid)), where=Ftot_den_block[w] > 1E-10) - Ftot ** 2
+                ofe = ofe * Ftot_den_ratio
+                ofe = np.sqrt(np.clip(ofe, 0, None))  # negative only by round-off
+                ofe_history.append(sum(ofe)/nbins)
+                timer.stop("error")
+                events.emit("error", i + 1, ofe_history[-1])
+                if (i + 1) % log_stride == 0:
+                    events.emit("log", i + 1, ofe_history[-1])
+
+    Ftot = np.divide(Ftot_num, Ftot_den, out=np.zeros_like(Ftot_num), where=Ftot_den != 0)  # total force
+    events.emit("end", total_number_of_hills, ofe_history[-1] if ofe_history else None)
                  
     return [grid, Ftot_den, Ftot, ofe, ofe_history]
 
+
+def _cumulate(total, terms):
+    """Running totals total + terms[0], total + terms[0] + terms[1], ... of a (windows, nbins) array of terms, summed in the same order as one window at a time (terms is overwritten)."""
+    terms[0] += total
+    return np.cumsum(terms, axis=0, out=terms)
+
+
+def stencil_width_1D(grid, radius):
+    """Number of grid points that can lie within radius of a coordinate, i.e. the width of the stencils of kernel_stencils_1D."""
+    return int(np.floor(2 * radius / (grid[1] - grid[0]))) + 2
+
+
+def kernel_stencils_1D(centres, sigma2, grid, cutoff):
+    """Grid points within cutoff standard deviations of a set of kernel centres, as fixed-width stencils for np.bincount.
+
+    Args:
+        centres (array): (rows, n) kernel centres. The kernels of row r are deposited on row r of a (rows, nbins) array.
+        sigma2 (float or array): Variance of the kernels, broadcastable to centres.
+        grid (array): Grid points.
+        cutoff (float): Truncation radius, in units of standard deviations.
+
+    Returns:
+        list: [index, ds, inside] - (rows, n, width) arrays of flat indices into the raveled (rows, nbins) array, distances grid - centre of the stencil points,
+            and mask of the points within the grid and cutoff (the kernel values outside it must be set to zero).
+    """
+    radius = cutoff * np.sqrt(sigma2)
+    grid_space = grid[1] - grid[0]
+    width = stencil_width_1D(grid, np.max(radius))
+    lower = np.ceil((centres - radius - grid[0]) / grid_space).astype(int)  # as MFI.find_stencil, one kernel at a time
+    points = lower[..., np.newaxis] + np.arange(width)
+    inside = (points >= 0) & (points < len(grid))
+    points = np.clip(points, 0, len(grid) - 1)
+    ds = grid[points] - centres[..., np.newaxis]
+    inside &= ds ** 2 <= cutoff ** 2 * np.asarray(sigma2)[..., np.newaxis]
+    index = points + len(grid) * np.arange(len(centres)).reshape((-1,) + (1,) * (points.ndim - 1))
+    return [index, ds, inside]
+
         
 # Integrate Ftot, obtain FES 
 def intg_1D(x,F):
@@ -0,0 +1,235 @@
+"""Mean Force Integration for any number of CVs (e.g. 3 torsions of a peptide).
+
+Grids have one axis per CV, in the order of the CVs (np.meshgrid(..., indexing="ij") layout), i.e. axis k is CV k+1.
+Gaussian kernels are factorised into 1D factors along each CV, and the grid sums are evaluated as matrix products in chunks of the first axis,
+so the temporary arrays stay small compared to the accumulated grids.
+"""
+import glob
+import numpy as np
+from . import geometry
+from . import plumed_files
+from . import progress
+
+
+def load_HILLS_nD(hills_name = "HILLS", ncvs = 3, cache = False):
+    """Load a HILLS file of ncvs CVs, selecting the columns by name from the FIELDS header (see plumed_files.hills_fields).
+    As in MFI.load_HILLS_2D, the hills are shifted by one row, with a first hill of zero height.
+
+    Args:
+        hills_name (str, optional): Name of the HILLS file. Defaults to "HILLS".
+        ncvs (int, optional): Number of CVs. Defaults to 3.
+        cache (bool, optional): Store and reuse a binary .npy sidecar of the file. Defaults to False.
+
+    Returns:
+        array of size (number_of_hills, 2*ncvs+3) - time, CVs, sigmas, height, biasfactor (without the biasfactor column, only needed with WellTempered=1, if the file has none).
+    """
+    for file in glob.glob(hills_name):
+        hills = plumed_files.load_plumed_file(file, plumed_files.hills_fields(file, ncvs), cache=cache)
+        hills = np.concatenate(([hills[0]], hills[:-1]))
+        hills[0][2 * ncvs + 1] = 0
+    return hills
+
+def load_position_nD(position_name = "position", ncvs = 3, fields = None, cache = False):
+    """Load the CVs from a position (COLVAR) file. The last row is discarded.
+
+    Args:
+        position_name (str, optional): Name of the position file. Defaults to "position".
+        ncvs (int, optional): Number of CVs. Defaults to 3.
+        fields (list, optional): Names of the CV columns in the FIELDS header. Defaults to None, i.e. the ncvs columns after time.
+        cache (bool, optional): Store and reuse a binary .npy sidecar of the file. Defaults to False.
+
+    Returns:
+        array of size (number_of_positions, ncvs).
+    """
+    for file1 in glob.glob(position_name):
+        if fields is None:
+            fields = (plumed_files.read_fields(file1) or list(range(ncvs + 1)))[1:ncvs + 1]
+        colvar = plumed_files.load_plumed_file(file1, fields, cache=cache)
+    return colvar[:-1]
+
+def _kernel_sum(factors):
+    """sum_z prod_k factors[k][z, i_k], as an array of size (n_0, ..., n_d-1): outer products of the first factors, contracted with the last one by a matrix product."""
+    if len(factors) == 1:
+        return factors[0].sum(axis=0)
+    outer = factors[0]
+    for factor in factors[1:-1]:
+        outer = (outer[:, :, np.newaxis] * factor[:, np.newaxis, :]).reshape(len(factor), -1)
+    return (outer.T @ factors[-1]).reshape(tuple(factor.shape[1] for factor in factors))
+
+def deposit_kernels_nD(centres, sigma2, grids, height, force_scale, density, forces, chunk_size = 8):
+    """Add a set of Gaussian kernels, and the kernels times their CV displacement, to grids (in place), in chunks of the first grid axis.
+
+    density += height * K
+    forces[k] += height * force_scale * K * (s_k - centre_k) / sigma2[k]
+
+    Args:
+        centres (array): array of size (n_kernels, ncvs) - kernel centres.
+        sigma2 (array): Variance of the kernels along each CV.
+        grids (list): 1D grid points of every CV.
+        height (float): Prefactor of the kernels.
+        force_scale (float): Additional prefactor of the force terms.
+        density (array): Grid updated with the kernels, or None to skip it.
+        forces (list): Grids updated with the force terms of every CV.
+        chunk_size (int, optional): Number of grid points along the first CV evaluated at once. Defaults to 8.
+    """
+    ncvs = len(grids)
+    factors = []
+    slopes = []
+    for k in range(ncvs):
+        displacement = grids[k][np.newaxis, :] - centres[:, [k]]
+        factors.append(np.exp(-0.5 * displacement ** 2 / sigma2[k]))
+        slopes.append(factors[k] * displacement / sigma2[k])
+
+    for start in range(0, len(grids[0]), chunk_size):
+        stop = min(start + chunk_size, len(grids[0]))
+        chunk = [factors[0][:, start:stop]] + factors[1:]
+        if density is not None:
+            density[start:stop] += height * _kernel_sum(chunk)
+        for k in range(ncvs):
+            terms = list(chunk)
+            terms[k] = slopes[0][:, start:stop] if k == 0 else slopes[k]
+            forces[k][start:stop] += (height * force_scale) * _kernel_sum(terms)
+
+def mean_force_variance_nD(Ftot_den, Ftot_den2, Ftot, ofv):
+    """On the fly estimate of the local convergence of an N-dimensional mean force (see MFI.mean_force_variance).
+
+    Returns:
+        ofe: array of size nbins.
+    """
+    Ftot_den_ratio = np.divide(Ftot_den2, (Ftot_den**2 - Ftot_den2), out=np.zeros_like(Ftot_den), where=(Ftot_den**2 - Ftot_den2) != 0)
+    ofe = np.zeros_like(Ftot_den)
+    for F, v in zip(Ftot, ofv):
+        ofe += abs((np.divide(v, Ftot_den, out=np.zeros_like(v), where=Ftot_den != 0) - F**2) * Ftot_den_ratio)
+    return np.sqrt(ofe)
+
+### Main Mean Force Integration
+def MFI_nD(HILLS = "HILLS", position = "position", bw = 1, kT = 1, min_grid = np.array((-np.pi, -np.pi, -np.pi)), max_grid = np.array((np.pi, np.pi, np.pi)),
+           nbins = np.array((100, 100, 100)), log_pace = 10, error_pace = 200, WellTempered = 1, nhills = -1, periodic = 0, chunk_size = 8, callback = None):
+    """Compute a time-independent estimate of the Mean Thermodynamic Force, i.e. the free energy gradient, in CV spaces of any dimension.
+
+    Args:
+        HILLS (array): HILLS array from load_HILLS_nD.
+        position (array): array of size (number_of_positions, ncvs) from load_position_nD.
+        bw (float, optional): Scalar, bandwidth for the construction of the KDE estimate of the biased probability density. Defaults to 1.
+        kT (float, optional): Scalar, kT. Defaults to 1.
+        min_grid (array, optional): Lower bound of the simulation domain. Defaults to np.array((-np.pi, -np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain. Defaults to np.array((np.pi, np.pi, np.pi)).
+        nbins (array, optional): number of bins along each CV. Defaults to np.array((100, 100, 100)).
+        log_pace (int, optional): Pace for outputting progress and convergence. Defaults to 10.
+        error_pace (int, optional): Pace for the calculation of the on-the-fly measure of global convergence. Defaults to 200.
+        WellTempered (int, optional): Is the simulation well tempered? Defaults to 1.
+        nhills (int, optional): Number of HILLS to analyse, -1 for the entire HILLS array. Defaults to -1.
+        periodic (int or array, optional): Is the CV space periodic? 1 for yes, for all CVs or one value per CV. Defaults to 0.
+        chunk_size (int, optional): Number of grid points along the first CV for which the kernels are evaluated at once. Defaults to 8.
+        callback (callable or list, optional): Function(s) called with the progress events of the analysis, see pyMFI.progress. Defaults to None, i.e. progress.print_progress_2D.
+
+    Returns:
+        grids: list of the 1D grid points along each CV.
+        Ftot_den: array of size nbins - Cumulative biased probability density.
+        Ftot: list with the components of the Mean Force along each CV, arrays of size nbins.
+        ofe: array of size nbins - on the fly estimate of the local convergence.
+        ofe_history: running estimate of the global convergence of the mean force.
+        Ftot_den2: array of size nbins - Cumulative sum of the squared biased probability density.
+        ofv: list with the cumulative sums of pb_t * dfds**2 along each CV.
+    """
+    ncvs = len(nbins)
+    grids = [np.linspace(min_grid[k], max_grid[k], nbins[k]) for k in range(ncvs)]
+    shape = tuple(int(n) for n in nbins)
+    stride = int(len(position) / len(HILLS[:,1]))
+    const = (1 / (bw*np.sqrt(2*np.pi)*stride))
+    bw2 = bw**2
+    total_number_of_hills = nhills if nhills > 0 else len(HILLS[:,1])
+    if log_pace >= error_pace:
+        log_pace = error_pace
+
+    # Initialize force terms
+    Fbias = [np.zeros(shape) for k in range(ncvs)]
+    Ftot_num = [np.zeros(shape) for k in range(ncvs)]
+    ofv = [np.zeros(shape) for k in range(ncvs)]
+    Ftot_den = np.zeros(shape)
+    Ftot_den2 = np.zeros(shape)
+    pb_t = np.zeros(shape)
+    Fpbt = [np.zeros(shape) for k in range(ncvs)]
+    ofe = np.zeros(shape)
+    ofe_history = []
+
+    timer = progress.PhaseTimer()
+    events = progress.Progress(progress.print_progress_2D if callback is None else callback, total_number_of_hills, timer)
+    events.emit("start", 0)
+
+    # Definition Gamma Factor, allows to switch between WT and regular MetaD
+    if WellTempered < 1:
+        Gamma_Factor = 1
+    else:
+        gamma = HILLS[0, 2 * ncvs + 2]
+        Gamma_Factor = (gamma - 1)/(gamma)
+
+    for i in range(total_number_of_hills):
+        # Build metadynamics potential
+        timer.start()
+        hill = HILLS[i]
+        images = geometry.find_periodic_points(hill[np.newaxis, 1:ncvs + 1], min_grid, max_grid, periodic)
+        deposit_kernels_nD(images, hill[ncvs + 1:2 * ncvs + 1] ** 2, grids, hill[2 * ncvs + 1] * Gamma_Factor, 1.0, None, Fbias, chunk_size)
+        timer.stop("bias")
+
+        # Estimate the biased proabability density p_t ^ b(s) and its force term
+        pb_t.fill(0)
+        for F in Fpbt:
+            F.fill(0)
+        images = geometry.find_periodic_points(position[i * stride: (i + 1) * stride], min_grid, max_grid, periodic)
+        deposit_kernels_nD(images, np.full(ncvs, bw2), grids, const, kT, pb_t, Fpbt, chunk_size)
+        timer.stop("kde")
+
+        # Accumulate the sufficient statistics of the Mean Force
+        Ftot_den += pb_t
+        Ftot_den2 += pb_t**2
+        for k in range(ncvs):
+            dfds = np.divide(Fpbt[k], pb_t, out=Fpbt[k], where=pb_t != 0)
+            dfds += Fbias[k]
+            Ftot_num[k] += pb_t * dfds
+            ofv[k] += pb_t * dfds**2
+        timer.stop("accumulate")
+
+        # Compute Variance of the mean force every 1/error_pace frequency
+        if (i + 1) % max(int(total_number_of_hills / error_pace), 1) == 0:
+            Ftot = [np.divide(num, Ftot_den, out=np.zeros_like(num), where=Ftot_den != 0) for num in Ftot_num]
+            ofe = mean_force_variance_nD(Ftot_den, Ftot_den2, Ftot, ofv)
+            ofe_history.append(np.mean(ofe))
+            timer.stop("error")
+            events.emit("error", i + 1, ofe_history[-1])
+
+        if (i+1) % (total_number_of_hills/log_pace) == 0:
+            events.emit("log", i + 1, ofe_history[-1] if ofe_history else None)
+
+    Ftot = [np.divide(num, Ftot_den, out=np.zeros_like(num), where=Ftot_den != 0) for num in Ftot_num]
+    events.emit("end", total_number_of_hills, ofe_history[-1] if ofe_history else None)
+    return [grids, Ftot_den, Ftot, ofe, ofe_history, Ftot_den2, ofv]
+
+### Integration using Fast Fourier Transform (FFT integration) in N dimensions
+def FFT_intg_nD(Ftot, min_grid = np.array((-np.pi, -np.pi, -np.pi)), max_grid = np.array((np.pi, np.pi, np.pi)), nbins = np.array((100, 100, 100))):
+    """Integrate an N-dimensional mean force into a free energy surface with FFTs (the N-dimensional extension of MFI.FFT_intg_2D, for periodic CV spaces).
+
+    Args:
+        Ftot (list): Components of the Mean Force along each CV, arrays of size nbins.
+        min_grid (array, optional): Lower bound of the simulation domain. Defaults to np.array((-np.pi, -np.pi, -np.pi)).
+        max_grid (array, optional): Upper bound of the simulation domain. Defaults to np.array((np.pi, np.pi, np.pi)).
+        nbins (array, optional): number of bins along each CV. Defaults to np.array((100, 100, 100)).
+
+    Returns:
+        grids: list of the 1D grid points along each CV.
+        fes: array of size nbins - free energy surface, with its minimum at zero.
+    """
+    ncvs = len(nbins)
+    grids = [np.linspace(min_grid[k], max_grid[k], nbins[k]) for k in range(ncvs)]
+    grid_space = [(max_grid[k] - min_grid[k]) / (nbins[k] - 1) for k in range(ncvs)]
+
+    #Calculate frequency
+    freq = np.meshgrid(*[np.fft.fftfreq(nbins[k], grid_space[k]) for k in range(ncvs)], indexing="ij")
+    freq_sq = sum(f**2 for f in freq)
+    freq_sq = np.where(freq_sq != 0, freq_sq, 1E-10)
+    #FFTransform and integration
+    fourier = sum(np.fft.fftn(F) * f for F, f in zip(Ftot, freq)) / (2 * np.pi * 1j * freq_sq)
+    #Reverse FFT
+    fes = np.real(np.fft.ifftn(fourier))
+    fes = fes - np.min(fes)
+    return [grids, fes]
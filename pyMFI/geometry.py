@@ -0,0 +1,82 @@
+"""Periodic geometry of CV spaces: periodic images of kernel centres, minimum-image displacements and harmonic restraints, vectorised over arrays of points.
+
+The box is [min_grid, max_grid] along every CV, and periodic is a flag (0 or 1) for all CVs or one flag per CV. The period of a periodic CV is max_grid - min_grid.
+"""
+import itertools
+import numpy as np
+
+
+def find_periodic_points(points, min_grid, max_grid, periodic, return_index=False):
+    """Periodic images of an array of points, for Gaussian kernels centred on them.
+    Along every periodic CV, a point within a quarter of the box length of an edge gets a copy shifted by one period towards the other edge; copies along several CVs are combined.
+    The images of each point directly follow it, in the order of MFI.find_periodic_point (for 2 CVs: point, CV1 copy, CV2 copy, CV1+CV2 copy).
+
+    Args:
+        points (array): array of size (n_points, n_cvs) - e.g. the samples of a window or the centre of a hill.
+        min_grid (array): Lower bound of the simulation domain.
+        max_grid (array): Upper bound of the simulation domain.
+        periodic (int or array): Is the CV space periodic? 1 for yes, for all CVs or one value per CV.
+        return_index (bool, optional): Also return, for every image, the row of points it is a copy of. Defaults to False.
+
+    Returns:
+        array of size (n_images, n_cvs) - the points and their periodic images (with the dtype of points).
+        index: array of size (n_images,) - only if return_index is True.
+    """
+    points = np.asarray(points)
+    if not np.issubdtype(points.dtype, np.floating):
+        points = points.astype(float)
+    n_cvs = points.shape[1]
+    periodic = np.broadcast_to(np.asarray(periodic) != 0, (n_cvs,))
+    min_grid = np.asarray(min_grid, dtype=points.dtype)
+    max_grid = np.asarray(max_grid, dtype=points.dtype)
+    length = max_grid - min_grid
+    grid_ext = 0.25 * length
+
+    shift = np.where(points < min_grid + grid_ext, length, np.where(points > max_grid - grid_ext, -length, 0)).astype(points.dtype)
+    shift[:, ~periodic] = 0
+    # combinations of shifted CVs, CV1 varying fastest: (0,0), (1,0), (0,1), (1,1) for 2 CVs
+    combinations = np.array(list(itertools.product((0, 1), repeat=n_cvs)), dtype=bool)[:, ::-1]
+    images = points[:, np.newaxis, :] + combinations[np.newaxis, :, :] * shift[:, np.newaxis, :]
+    keep = np.all((shift[:, np.newaxis, :] != 0) | ~combinations[np.newaxis, :, :], axis=2)
+    if return_index:
+        return [images[keep], np.nonzero(keep)[0]]
+    return images[keep]
+
+def minimum_image(displacement, min_grid, max_grid, periodic):
+    """Wrap displacements along periodic CVs into [-L/2, L/2], L = max_grid - min_grid being the period.
+
+    Args:
+        displacement (array): array of size (..., n_cvs) - displacements, one column per CV.
+        min_grid (array): Lower bound of the simulation domain.
+        max_grid (array): Upper bound of the simulation domain.
+        periodic (int or array): Is the CV space periodic? 1 for yes, for all CVs or one value per CV.
+
+    Returns:
+        array of the size of displacement - the minimum-image displacements (unchanged along non-periodic CVs).
+    """
+    displacement = np.asarray(displacement, dtype=float)
+    length = np.asarray(max_grid, dtype=float) - np.asarray(min_grid, dtype=float)
+    periodic = np.broadcast_to(np.asarray(periodic) != 0, (displacement.shape[-1],))
+    return displacement - np.where(periodic, length * np.round(displacement / length), 0)
+
+def harmonic_restraint_2D(centre, kappa, X, Y, min_grid, max_grid, periodic):
+    """Force and potential of a harmonic restraint 1/2 * kappa * d**2 on a 2D grid, with minimum-image distances d along periodic CVs.
+
+    Args:
+        centre (array): CV1, CV2 centre of the restraint.
+        kappa (array): CV1, CV2 force constants.
+        X (array): CV1 grid positions.
+        Y (array): CV2 grid positions.
+        min_grid (array): Lower bound of the simulation domain.
+        max_grid (array): Upper bound of the simulation domain.
+        periodic (int or array): Is the CV space periodic? 1 for yes, for all CVs or one value per CV.
+
+    Returns:
+        F_harmonic_x: array of the size of X - CV1 component of the restraint force (gradient of the potential).
+        F_harmonic_y: array of the size of X - CV2 component of the restraint force.
+        P_harmonic_x: array of the size of X - CV1 part of the restraint potential.
+        P_harmonic_y: array of the size of X - CV2 part of the restraint potential.
+    """
+    displacement = minimum_image(np.stack((X - centre[0], Y - centre[1]), axis=-1), min_grid, max_grid, periodic)
+    [dx, dy] = [displacement[..., 0], displacement[..., 1]]
+    return [kappa[0] * dx, kappa[1] * dy, kappa[0] / 2 * dx**2, kappa[1] / 2 * dy**2]
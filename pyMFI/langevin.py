@@ -1,3 +1,4 @@
+import contextlib
 import numpy as np
 
 def run_2D(pace=100, nsteps=100000, sigma=0.1, height=0.5, biasfactor=10, ipos=np.array([-1,-1]),tag=1):
@@ -34,3 +35,157 @@ dimension 2
 nstep {}
 ipos {},{}
 periodic false""".format(nsteps,ipos[0],ipos[1]),file=f)
+
+
+# Potentials of run_2D and run_2D_Invernizzi (PLUMED MATHEVAL functions) as force functions: [Fx, Fy] = -grad V(x, y)
+def force_2D(x, y):
+    return [-(28*x**3 - 46*x), -(28*y**3 - 46*y)]
+
+def force_2D_Invernizzi(x, y):
+    return [-(4*1.34549*x**3 + 3*1.90211*x**2*y + 2*3.92705*x*y**2 - 2*6.44246*x - 1.90211*y**3 + 5.58721*y + 1.33481),
+            -(1.90211*x**3 + 2*3.92705*x**2*y - 3*1.90211*x*y**2 + 5.58721*x + 4*1.34549*y**3 - 2*5.55754*y + 0.904586)]
+
+POTENTIALS = {"2D": force_2D, "Invernizzi": force_2D_Invernizzi}
+
+
+def _interpolate(grid, origin, grid_space, positions):
+    """Bilinear interpolation of per-walker grids of size (nwalkers, ny, nx, n_fields) at the positions (nwalkers, 2) of the walkers, zero outside the grid.
+
+    Returns:
+        array of size (nwalkers, n_fields).
+    """
+    [nwalkers, ny, nx, n_fields] = grid.shape
+    scaled = (positions - origin) / grid_space
+    inside = (scaled[:, 0] >= 0) & (scaled[:, 0] <= nx - 1) & (scaled[:, 1] >= 0) & (scaled[:, 1] <= ny - 1)
+    index = np.minimum(scaled.astype(int), np.array((nx - 2, ny - 2)))
+    index = np.maximum(index, 0)
+    [wx, wy] = [scaled[:, :1] - index[:, :1], scaled[:, 1:] - index[:, 1:]]
+    # flat index of the lower left corner, and the values at the four corners of the cell of every walker
+    corner = (np.arange(nwalkers) * ny + index[:, 1]) * nx + index[:, 0]
+    values = grid.reshape(-1, n_fields)[corner + np.array((0, 1, nx, nx + 1))[:, np.newaxis]]
+    value = (1 - wy) * ((1 - wx) * values[0] + wx * values[1]) + wy * ((1 - wx) * values[2] + wx * values[3])
+    return value * inside[:, np.newaxis]
+
+
+def simulate_2D(potential="2D", nwalkers=1, nsteps=100000, tstep=0.005, friction=1, temperature=1, pace=100, stride=10, sigma=0.1, height=0.5, biasfactor=10,
+                ipos=np.array([-1,-1]), min_grid=np.array((-3, -3)), max_grid=np.array((3, 3)), grid_bin=np.array((300, 300)), overdamped=False, seed=None,
+                hills_name="HILLS_{}", position_name="position_{}", block_steps=10000):
+    """Well-tempered metadynamics of independent walkers on a 2D potential with a Langevin integrator in NumPy, vectorised over the walkers.
+    Replaces the plumed pesmd runs set up by run_2D and run_2D_Invernizzi: every walker writes a HILLS and a position file in the PLUMED format read by MFI.load_HILLS_2D and MFI.load_position_2D.
+    As in PLUMED with GRID_MIN/GRID_MAX/GRID_BIN, the bias of every walker is accumulated on a grid (within 6.25 sigma of the hill centres) and interpolated (bilinearly) at the walker position.
+    Positions are written every stride steps from step 0, hills are deposited every pace steps from step pace, with the height written by PLUMED for well-tempered
+    metadynamics (height * exp(-V_bias / (temperature * (biasfactor - 1))) * biasfactor / (biasfactor - 1)).
+
+    Args:
+        potential (str or callable, optional): "2D" (potential of run_2D), "Invernizzi" (potential of run_2D_Invernizzi), or a function force(x, y) returning [Fx, Fy], the force of the potential on arrays of positions. Defaults to "2D".
+        nwalkers (int, optional): Number of independent walkers. Defaults to 1.
+        nsteps (int, optional): Number of time steps. Defaults to 100000.
+        tstep (float, optional): Time step. Defaults to 0.005.
+        friction (float, optional): Friction coefficient of the Langevin thermostat. Defaults to 1.
+        temperature (float, optional): Temperature, kT in the energy units of the potential. Defaults to 1.
+        pace (int, optional): Number of steps between hills (PLUMED METAD PACE). Defaults to 100.
+        stride (int, optional): Number of steps between positions (PLUMED PRINT STRIDE). Defaults to 10.
+        sigma (float, optional): Width of the hills. Defaults to 0.1.
+        height (float, optional): Initial height of the hills. Defaults to 0.5.
+        biasfactor (float, optional): Bias factor of well-tempered metadynamics, None for standard metadynamics. Defaults to 10.
+        ipos (array, optional): Initial position, the same (2,) for every walker or one row per walker (nwalkers, 2). Defaults to np.array([-1,-1]).
+        min_grid (array, optional): Lower bound of the bias grid. Defaults to np.array((-3, -3)).
+        max_grid (array, optional): Upper bound of the bias grid. Defaults to np.array((3, 3)).
+        grid_bin (array, optional): Number of bins of the bias grid along CV1, CV2 (PLUMED GRID_BIN). Defaults to np.array((300, 300)).
+        overdamped (bool, optional): Overdamped (Brownian) dynamics instead of underdamped Langevin dynamics (BAOAB, unit mass). Defaults to False.
+        seed (int, optional): Seed of the random number generator. Defaults to None.
+        hills_name (str, optional): Name of the HILLS files, formatted with the walker index. Defaults to "HILLS_{}".
+        position_name (str, optional): Name of the position files, formatted with the walker index. Defaults to "position_{}".
+        block_steps (int, optional): Number of steps between writes to the files, which bounds the memory used by the output. Defaults to 10000.
+
+    Returns:
+        list of [hills_name, position_name] of every walker.
+    """
+    force = POTENTIALS[potential] if isinstance(potential, str) else potential
+    rng = np.random.default_rng(seed)
+    kT = temperature
+    gridx = np.linspace(min_grid[0], max_grid[0], grid_bin[0] + 1)
+    gridy = np.linspace(min_grid[1], max_grid[1], grid_bin[1] + 1)
+    [origin, grid_space] = [np.array((gridx[0], gridy[0])), np.array((gridx[1] - gridx[0], gridy[1] - gridy[0]))]
+    # bias potential and the two components of the bias force of every walker
+    bias = np.zeros((nwalkers, len(gridy), len(gridx), 3))
+
+    positions = np.array(np.broadcast_to(np.asarray(ipos, dtype=float), (nwalkers, 2)))
+    velocities = np.sqrt(kT) * rng.standard_normal((nwalkers, 2))
+    [c1, c2] = [np.exp(-friction * tstep), np.sqrt(1 - np.exp(-2 * friction * tstep))]
+
+    def total_force(positions):
+        [fx, fy] = force(positions[:, 0], positions[:, 1])
+        forces = _interpolate(bias, origin, grid_space, positions)[:, 1:]
+        forces[:, 0] += fx
+        forces[:, 1] += fy
+        return forces
+
+    # hills are deposited on a window of the grid reaching 6.25 sigma from the walker, like the DP2CUTOFF of PLUMED
+    window = np.minimum(2 * np.ceil(6.25 * sigma / grid_space).astype(int) + 2, np.array((len(gridx), len(gridy))))
+
+    def deposit(positions):
+        vbias = _interpolate(bias, origin, grid_space, positions)[:, 0]
+        heights = height * np.exp(-vbias / (kT * (biasfactor - 1))) if biasfactor is not None else np.full(nwalkers, height)
+        # first grid point of the window of every walker, kept inside the grid
+        start = np.round((positions - origin) / grid_space).astype(int) - window // 2
+        start = np.clip(start, 0, np.array((len(gridx), len(gridy))) - window)
+        [ix, iy] = [start[:, :1] + np.arange(window[0]), start[:, 1:] + np.arange(window[1])]
+        [dx, dy] = [gridx[ix] - positions[:, :1], gridy[iy] - positions[:, 1:]]
+        [gx, gy] = [np.exp(-dx**2 / (2 * sigma**2)), np.exp(-dy**2 / (2 * sigma**2))]
+        kernel = heights[:, np.newaxis, np.newaxis] * gy[:, :, np.newaxis] * gx[:, np.newaxis, :]
+        kernels = np.stack((kernel, kernel * (dx / sigma**2)[:, np.newaxis, :], kernel * (dy / sigma**2)[:, :, np.newaxis]), axis=-1)
+        for walker in range(nwalkers):
+            # slices of the window, much faster than fancy indexing all the walkers at once
+            bias[walker, start[walker, 1]: start[walker, 1] + window[1], start[walker, 0]: start[walker, 0] + window[0]] += kernels[walker]
+        return heights * biasfactor / (biasfactor - 1) if biasfactor is not None else heights
+
+    names = [[hills_name.format(walker), position_name.format(walker)] for walker in range(nwalkers)]
+    with contextlib.ExitStack() as stack:
+        hills_files = [stack.enter_context(open(name[0], "w")) for name in names]
+        position_files = [stack.enter_context(open(name[1], "w")) for name in names]
+        for f in hills_files:
+            f.write("#! FIELDS time p.x p.y sigma_p.x sigma_p.y height biasf\n#! SET multivariate false\n#! SET kerneltype gaussian\n")
+        for f in position_files:
+            f.write("#! FIELDS time p.x p.y\n")
+
+        def write(position_rows, hill_rows):
+            # rows are (time, array of size (nwalkers, ...)), written walker by walker
+            if position_rows:
+                times = np.array([row[0] for row in position_rows])
+                values = np.stack([row[1] for row in position_rows], axis=1)
+                for walker, f in enumerate(position_files):
+                    np.savetxt(f, np.column_stack((times, values[walker])), fmt=" %f", delimiter="")
+            if hill_rows:
+                times = np.array([row[0] for row in hill_rows])
+                values = np.stack([row[1] for row in hill_rows], axis=1)
+                written = np.stack([row[2] for row in hill_rows], axis=1)
+                widths = np.full((len(times), 2), sigma)
+                biasf = np.full(len(times), biasfactor if biasfactor is not None else 1)
+                for walker, f in enumerate(hills_files):
+                    np.savetxt(f, np.column_stack((times, values[walker], widths, written[walker], biasf)), fmt="%23.16g", delimiter="")
+
+        position_rows = [[0.0, positions.copy()]]
+        hill_rows = []
+        forces = total_force(positions)
+        for step in range(1, nsteps + 1):
+            if overdamped:
+                positions += forces * tstep / friction + np.sqrt(2 * kT * tstep / friction) * rng.standard_normal((nwalkers, 2))
+            else:
+                velocities += 0.5 * tstep * forces
+                positions += 0.5 * tstep * velocities
+                velocities = c1 * velocities + c2 * np.sqrt(kT) * rng.standard_normal((nwalkers, 2))
+                positions += 0.5 * tstep * velocities
+            if step % pace == 0:
+                hill_rows.append([step * tstep, positions.copy(), deposit(positions)])
+            forces = total_force(positions)
+            if not overdamped:
+                velocities += 0.5 * tstep * forces
+            if step % stride == 0:
+                position_rows.append([step * tstep, positions.copy()])
+            if step % block_steps == 0:
+                write(position_rows, hill_rows)
+                [position_rows, hill_rows] = [[], []]
+        write(position_rows, hill_rows)
+
+    return names
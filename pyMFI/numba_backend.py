@@ -0,0 +1,153 @@
+"""Compiled (Numba) versions of the MFI_2D hot loops.
+
+Importing this module requires numba. MFI.MFI_2D(..., backend="numba") uses it and falls back to the NumPy backend when numba is not installed.
+All grids have the layout of np.meshgrid(gridx, gridy), i.e. rows are CV2 and columns are CV1.
+
+The parallel analyses of pyMFI.parallel fork worker processes. After a fork, numba's default TBB threading layer hangs the parent process at exit,
+and the OpenMP layer aborts the workers that use it, so this module selects the workqueue layer, unless the NUMBA_THREADING_LAYER environment variable chooses one.
+"""
+import os
+
+import numpy as np
+from numba import config, njit, prange
+
+if "NUMBA_THREADING_LAYER" not in os.environ:
+    config.THREADING_LAYER = "workqueue"
+
+
+@njit(cache=True)
+def find_periodic_points(x_coords, y_coords, min_grid, max_grid, periodic):
+    """Compiled equivalent of geometry.find_periodic_points for a whole window of 2D points.
+
+    Args:
+        x_coords (array): CV1 coordinates.
+        y_coords (array): CV2 coordinates.
+        min_grid (array): Lower bound of the simulation domain.
+        max_grid (array): Upper bound of the simulation domain.
+        periodic (array): Is CV1, CV2 periodic? 1.0 for yes. The period is the box length max_grid - min_grid.
+
+    Returns:
+        array of size (n_images, 2) - the points and their periodic copies.
+    """
+    length = max_grid - min_grid
+    grid_ext = 0.25 * length
+    images = np.empty((4 * len(x_coords), 2))
+    n = 0
+    for k in range(len(x_coords)):
+        x = x_coords[k]
+        y = y_coords[k]
+        images[n, 0] = x
+        images[n, 1] = y
+        n += 1
+        shift_x = 0.0
+        shift_y = 0.0
+        if periodic[0] != 0:
+            if x < min_grid[0] + grid_ext[0]:
+                shift_x = length[0]
+            elif x > max_grid[0] - grid_ext[0]:
+                shift_x = -length[0]
+        if periodic[1] != 0:
+            if y < min_grid[1] + grid_ext[1]:
+                shift_y = length[1]
+            elif y > max_grid[1] - grid_ext[1]:
+                shift_y = -length[1]
+        if shift_x != 0:
+            images[n, 0] = x + shift_x
+            images[n, 1] = y
+            n += 1
+        if shift_y != 0:
+            images[n, 0] = x
+            images[n, 1] = y + shift_y
+            n += 1
+        if shift_x != 0 and shift_y != 0:
+            images[n, 0] = x + shift_x
+            images[n, 1] = y + shift_y
+            n += 1
+    return images[:n]
+
+
+@njit(parallel=True, cache=True)
+def deposit_kernels_2D(images, sigma2_x, sigma2_y, height, force_scale, gridx, gridy, cutoff, density, force_x, force_y):
+    """Add a set of Gaussian kernels, and the kernels times their CV displacement, to grids (in place).
+    Each kernel is factorised into 1D CV1 and CV2 terms, and the grid rows are processed in parallel.
+
+    density += height * K
+    force_x += height * force_scale * K * (X - x_k) / sigma2_x
+    force_y += height * force_scale * K * (Y - y_k) / sigma2_y
+
+    Args:
+        images (array): array of size (n_kernels, 2) - kernel centres.
+        sigma2_x (float): Variance of the kernels along CV1.
+        sigma2_y (float): Variance of the kernels along CV2.
+        height (float): Prefactor of the kernels.
+        force_scale (float): Additional prefactor of the force terms.
+        gridx (array): CV1 grid points.
+        gridy (array): CV2 grid points.
+        cutoff (float): Kernels are truncated beyond cutoff standard deviations, use np.inf for no truncation.
+        density (array): Grid updated with the kernels. Pass an empty array of size (0, 0) to skip it.
+        force_x (array): Grid updated with the CV1 force term.
+        force_y (array): Grid updated with the CV2 force term.
+    """
+    n_kernels = images.shape[0]
+    nx = len(gridx)
+    ny = len(gridy)
+    cutoff2 = cutoff ** 2
+    kx = np.empty((n_kernels, nx))
+    kdx = np.empty((n_kernels, nx))
+    for k in prange(n_kernels):
+        for ix in range(nx):
+            dx = gridx[ix] - images[k, 0]
+            if dx * dx > cutoff2 * sigma2_x:
+                kx[k, ix] = 0.0
+                kdx[k, ix] = 0.0
+            else:
+                kx[k, ix] = np.exp(-0.5 * dx * dx / sigma2_x)
+                kdx[k, ix] = kx[k, ix] * dx / sigma2_x
+    with_density = density.shape[0] > 0
+    for iy in prange(ny):
+        for k in range(n_kernels):
+            dy = gridy[iy] - images[k, 1]
+            if dy * dy > cutoff2 * sigma2_y:
+                continue
+            ky = height * np.exp(-0.5 * dy * dy / sigma2_y)
+            ky_force = force_scale * ky
+            ky_dy = ky_force * dy / sigma2_y
+            for ix in range(nx):
+                if with_density:
+                    density[iy, ix] += ky * kx[k, ix]
+                force_x[iy, ix] += ky_force * kdx[k, ix]
+                force_y[iy, ix] += ky_dy * kx[k, ix]
+
+
+@njit(parallel=True, cache=True)
+def accumulate_2D(pb_t, Fpbt_x, Fpbt_y, Fbias_x, Fbias_y, Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y, ofv_x, ofv_y):
+    """Fused, in place update of the sufficient statistics of the Mean Force with the contribution of one window.
+
+    Args:
+        pb_t (array): Biased probability density of the window.
+        Fpbt_x (array): CV1 KDE force term of the window (sum of kernel * kT * (X - x_k) / bw**2).
+        Fpbt_y (array): CV2 KDE force term of the window.
+        Fbias_x (array): CV1 bias force.
+        Fbias_y (array): CV2 bias force.
+        Ftot_den (array): Cumulative biased probability density.
+        Ftot_den2 (array): Cumulative sum of pb_t**2.
+        Ftot_num_x (array): Cumulative sum of pb_t * dfds_x.
+        Ftot_num_y (array): Cumulative sum of pb_t * dfds_y.
+        ofv_x (array): Cumulative sum of pb_t * dfds_x**2.
+        ofv_y (array): Cumulative sum of pb_t * dfds_y**2.
+    """
+    ny, nx = pb_t.shape
+    for iy in prange(ny):
+        for ix in range(nx):
+            p = pb_t[iy, ix]
+            dfds_x = Fbias_x[iy, ix]
+            dfds_y = Fbias_y[iy, ix]
+            if p != 0:
+                dfds_x += Fpbt_x[iy, ix] / p
+                dfds_y += Fpbt_y[iy, ix] / p
+            Ftot_den[iy, ix] += p
+            Ftot_den2[iy, ix] += p * p
+            Ftot_num_x[iy, ix] += p * dfds_x
+            Ftot_num_y[iy, ix] += p * dfds_y
+            ofv_x[iy, ix] += p * dfds_x * dfds_x
+            ofv_y[iy, ix] += p * dfds_y * dfds_y
@@ -0,0 +1,276 @@
+"""Parallel analysis of metadynamics simulations with MFI."""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import MFI
+
+# Per-walker fields written to the shared result block, in the order expected by MFI.patch_2D_error
+WALKER_FIELDS = ["Ftot_den", "Ftot_den2", "Ftot_x", "Ftot_y", "ofv_x", "ofv_y"]
+
+
+def _run_walker(index, source, shm_name, shape, MFI_2D_kwargs, store_directory=None):
+    """Run MFI_2D on one walker and write its terms into row index of the shared result block, or as walker index of a WalkerStore.
+
+    Args:
+        index (int): Row of the shared result block.
+        source (tuple): (HILLS, position) of the walker, see MFI_2D_walkers.
+        shm_name (str): Name of the shared memory block.
+        shape (tuple): Shape of the shared result block.
+        MFI_2D_kwargs (dict): Keyword arguments of MFI.MFI_2D.
+        store_directory (str, optional): Directory of a WalkerStore, used instead of the shared result block. Defaults to None.
+
+    Returns:
+        ofe_history: running estimate of the global convergence of the walker.
+    """
+    HILLS, position = source
+    if isinstance(HILLS, str):
+        HILLS = MFI.load_HILLS_2D(hills_name=HILLS)
+    if isinstance(position, str):
+        position = MFI.load_position_2D(position_name=position)
+
+    [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y] = MFI.MFI_2D(HILLS=HILLS, position_x=position[0], position_y=position[1], **MFI_2D_kwargs)
+    if store_directory is not None:
+        WalkerStore(store_directory).write(index, [Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y])
+        return ofe_history
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        results = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for k, field in enumerate([Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y]):
+            results[index, k] = field
+        del results
+    finally:
+        shm.close()
+    return ofe_history
+
+
+def MFI_2D_walkers(sources, nworkers=None, nbins=np.array((200,200)), store=None, **MFI_2D_kwargs):
+    """Analyse independent simulations (walkers) with MFI_2D in a process pool, and patch them together.
+    Each worker writes its terms straight into a shared memory block, so the grids are never pickled back to the parent process.
+
+    Args:
+        sources (list): One (HILLS, position) tuple per walker. HILLS is a HILLS file name or an array from MFI.load_HILLS_2D, position is a position file name or [position_x, position_y] from MFI.load_position_2D.
+        nworkers (int, optional): Number of worker processes. Defaults to None, i.e. the number of CPUs.
+        nbins (array, optional): number of bins in CV1,CV2. Defaults to np.array((200,200)).
+        store (WalkerStore, optional): If set, every worker appends the terms of its walker to this on-disk store instead of a shared memory block holding all the walkers,
+            and the walkers are patched by streaming over the store (see patch_2D_reduce), so memory does not grow with the number of walkers. Defaults to None.
+        **MFI_2D_kwargs: Further keyword arguments passed to MFI.MFI_2D (bw, kT, min_grid, max_grid, periodic, log_pace, error_pace, callback, ...). The workers run silently (callback=[]) unless a callback is passed,
+            which is then called in every worker process, so it must be picklable (e.g. progress.JSONLinesHandler).
+
+    Returns:
+        Ftot_x: array of size (nbins[0], nbins[1]) - CV1 component of the patched Mean Force.
+        Ftot_y: array of size (nbins[0], nbins[1]) - CV2 component of the patched Mean Force.
+        Ftot_den: array of size (nbins[0], nbins[1]) - Patched biased probability density.
+        error: array of size (nbins[0], nbins[1]) - Error of the patched Mean Force, see MFI.patch_2D_error.
+        ofe_history: list with the ofe_history of every walker.
+    """
+    MFI_2D_kwargs["nbins"] = nbins
+    MFI_2D_kwargs.setdefault("callback", [])
+    if store is not None:
+        first = store.next_index()
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = [executor.submit(_run_walker, first + index, source, None, None, MFI_2D_kwargs, store.directory) for index, source in enumerate(sources)]
+            ofe_history = [future.result() for future in futures]
+        return patch_2D_reduce(store, nworkers) + [ofe_history]
+
+    shape = (len(sources), len(WALKER_FIELDS), nbins[1], nbins[0])
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float64).itemsize)
+    try:
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = [executor.submit(_run_walker, index, source, shm.name, shape, MFI_2D_kwargs) for index, source in enumerate(sources)]
+            ofe_history = [future.result() for future in futures]
+
+        master = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        [Ftot_x, Ftot_y, Ftot_den, error] = MFI.patch_2D_error(master, nbins=nbins)
+        del master
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return [Ftot_x, Ftot_y, Ftot_den, error, ofe_history]
+
+
+class WalkerStore:
+    """On-disk store of per-walker MFI results, one .npy file of size (6, nbins[1], nbins[0]) with the WALKER_FIELDS per walker, read back memory-mapped.
+    The store is indexed walker by walker like a master array, so it can be passed to MFI.patch_2D_error, MFI.bootstrap_2D etc., and to patch_2D_reduce,
+    which patches it with a few grids in memory whatever the number of walkers.
+
+    Walkers are identified by the index they were written with. The store itself is indexed by position among the walkers found at the last len() (or indices()) call,
+    so gaps left by walkers that failed or were removed are skipped, and walkers written meanwhile by other processes are only seen after the next len().
+
+    Args:
+        directory (str): Directory of the store, created if needed. Walkers already stored there are kept.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._indices = None
+
+    def file_name(self, index):
+        return os.path.join(self.directory, "walker_%06d.npy" % index)
+
+    def indices(self):
+        """Sorted indices of the walkers stored in the directory (partly written walkers are not listed)."""
+        matches = [re.fullmatch(r"walker_(\d+)\.npy", name) for name in os.listdir(self.directory)]
+        self._indices = sorted(int(match.group(1)) for match in matches if match is not None)
+        return self._indices
+
+    def __len__(self):
+        return len(self.indices())
+
+    def __getitem__(self, position):
+        indices = self._indices if self._indices is not None else self.indices()
+        if not -len(indices) <= position < len(indices):
+            raise IndexError("no walker at position " + str(position) + " of " + self.directory)
+        return self.load(indices[position])
+
+    def __iter__(self):
+        for index in self.indices():
+            yield self.load(index)
+
+    def load(self, index):
+        """Terms of walker index, memory-mapped."""
+        return np.load(self.file_name(index), mmap_mode="r")
+
+    def write(self, index, fields):
+        """Store the terms of walker index.
+
+        Args:
+            index (int): Index of the walker.
+            fields (list): [Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y] of the walker.
+        """
+        temporary_name = os.path.join(self.directory, ".walker_%06d.%d.tmp" % (index, os.getpid()))
+        with open(temporary_name, "wb") as f:
+            np.save(f, np.array(fields, dtype=np.float64))
+        os.replace(temporary_name, self.file_name(index))  # never leaves a partly written walker
+
+    def next_index(self):
+        """Index following the largest index stored."""
+        indices = self.indices()
+        return indices[-1] + 1 if indices else 0
+
+    def append(self, results):
+        """Store the results of MFI.MFI_2D (the list it returns) as the next walker.
+
+        Returns:
+            int: index of the walker.
+        """
+        [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y] = results
+        index = self.next_index()
+        self.write(index, [Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y])
+        return index
+
+
+def _reduce_walkers(directory, indices, Ftot=None):
+    """Sums over the walkers indices (see WalkerStore.indices) of a WalkerStore: [Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y] if Ftot is None,
+    else the sums of den * (F - Ftot)**2 [error_x, error_y] for the patched mean force Ftot = [Ftot_x, Ftot_y] (second pass of MFI.patch_2D_error)."""
+    store = WalkerStore(directory)
+    sums = None
+    for index in indices:
+        walker = store.load(index)
+        [den, Fx, Fy] = [walker[0], walker[2], walker[3]]
+        terms = [den, walker[1], den * Fx, den * Fy] if Ftot is None else [den * (Fx - Ftot[0])**2, den * (Fy - Ftot[1])**2]
+        if sums is None:
+            sums = [np.array(term) for term in terms]
+        else:
+            for total, term in zip(sums, terms):
+                total += term
+    return sums
+
+
+def patch_2D_reduce(store, nworkers=1):
+    """Patch the walkers of a WalkerStore, as MFI.patch_2D_error, streaming over the walkers so that only a few grids are held in memory.
+    With nworkers > 1 the walkers are split into nworkers contiguous groups, reduced in parallel processes (each reading its walkers from disk), and the group sums are added.
+
+    Args:
+        store (WalkerStore): Per-walker results.
+        nworkers (int, optional): Number of worker processes, None for the number of CPUs. Defaults to 1, i.e. a single pass in this process.
+
+    Returns:
+        The same list as MFI.patch_2D_error: [Ftot_x, Ftot_y, Ftot_den, error].
+    """
+    groups = [group for group in np.array_split(np.array(store.indices(), dtype=int), nworkers if nworkers is not None else os.cpu_count()) if len(group) > 0]
+
+    def reduce(Ftot=None):
+        if len(groups) == 1:
+            return _reduce_walkers(store.directory, groups[0], Ftot)
+        with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+            partial = list(executor.map(_reduce_walkers, [store.directory] * len(groups), groups, [Ftot] * len(groups)))
+        for sums in partial[1:]:
+            for total, term in zip(partial[0], sums):
+                total += term
+        return partial[0]
+
+    [Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y] = reduce()
+    [Ftot_x, Ftot_y] = MFI.mean_force_2D(Ftot_num_x, Ftot_num_y, Ftot_den)
+    [error_x, error_y] = reduce([Ftot_x, Ftot_y])
+    return [Ftot_x, Ftot_y, Ftot_den, MFI._patch_error_2D(Ftot_den, Ftot_den2, error_x, error_y)]
+
+
+def _run_segment(HILLS, position_x, position_y, Fbias, MFI_2D_kwargs):
+    """Run MFI_2D on one segment of hills, starting from the bias force of the hills before it.
+
+    Returns:
+        list of the summable terms of the segment: [Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y, ofv_x, ofv_y].
+    """
+    # by default the error of the segment is only computed once, at its end, and the worker runs silently
+    MFI_2D_kwargs = dict({"error_pace": 1, "callback": []}, **MFI_2D_kwargs)
+    [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y] = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, Fbias=Fbias, **MFI_2D_kwargs)
+    return [Ftot_den, Ftot_den2, Ftot_x * Ftot_den, Ftot_y * Ftot_den, ofv_x, ofv_y]
+
+
+def MFI_2D_segments(HILLS, position_x, position_y, nsegments=4, nworkers=None, bw=1, kT=1, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins=np.array((200,200)), WellTempered=1, nhills=-1, periodic=0, **MFI_2D_kwargs):
+    """Time-segmented parallel MFI_2D of a single long simulation.
+    The hills are split into nsegments consecutive segments. The bias force at the start of every segment is built at once from the hills before it (MFI.bias_force_2D),
+    then the segments are analysed by MFI_2D in separate processes and their sufficient statistics are summed. This gives the result of the serial loop (to rounding).
+
+    Args:
+        HILLS (array): HILLS array from MFI.load_HILLS_2D.
+        position_x (array): CV1 array.
+        position_y (array): CV2 array.
+        nsegments (int, optional): Number of segments. Defaults to 4.
+        nworkers (int, optional): Number of worker processes. Defaults to None, i.e. the number of CPUs.
+        bw, kT, min_grid, max_grid, nbins, WellTempered, nhills, periodic: see MFI.MFI_2D.
+        **MFI_2D_kwargs: Further keyword arguments passed to MFI.MFI_2D (cutoff, separable, backend, log_pace, error_pace, callback). The workers run silently (callback=[]) unless a callback is passed,
+            which is then called in every worker process, so it must be picklable (e.g. progress.JSONLinesHandler). error_pace defaults to 1, i.e. the error of every segment is only computed at its end.
+
+    Returns:
+        The same list as MFI.MFI_2D: [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y].
+        ofe_history holds the global error at the end of every segment.
+    """
+    gridx = np.linspace(min_grid[0], max_grid[0], nbins[0])
+    gridy = np.linspace(min_grid[1], max_grid[1], nbins[1])
+    X, Y = np.meshgrid(gridx, gridy)
+    stride = int(len(position_x) / len(HILLS[:,1]))
+    total_number_of_hills = nhills if nhills > 0 else len(HILLS[:,1])
+    Gamma_Factor = 1 if WellTempered < 1 else MFI._gamma_factor(HILLS[0])
+    cutoff = MFI_2D_kwargs.get("cutoff")
+    MFI_2D_kwargs.update(bw=bw, kT=kT, min_grid=min_grid, max_grid=max_grid, nbins=nbins, WellTempered=WellTempered, periodic=periodic)
+
+    bounds = np.linspace(0, total_number_of_hills, nsegments + 1).astype(int)
+    Fbias = [np.zeros((nbins[1], nbins[0])), np.zeros((nbins[1], nbins[0]))]
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        futures = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if stop == start: continue
+            futures.append(executor.submit(_run_segment, HILLS[start:stop], position_x[start * stride: stop * stride], position_y[start * stride: stop * stride], Fbias, MFI_2D_kwargs))
+            # Bias force at the start of the next segment
+            [dFbias_x, dFbias_y] = MFI.bias_force_2D(HILLS[start:stop], Gamma_Factor, gridx, gridy, min_grid, max_grid, periodic, cutoff)
+            Fbias = [Fbias[0] + dFbias_x, Fbias[1] + dFbias_y]
+
+        [Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y, ofv_x, ofv_y] = [np.zeros((nbins[1], nbins[0])) for k in range(6)]
+        ofe_history = []
+        for future in futures:
+            segment = future.result()
+            for total, term in zip([Ftot_den, Ftot_den2, Ftot_num_x, Ftot_num_y, ofv_x, ofv_y], segment):
+                total += term
+            [Ftot_x, Ftot_y] = MFI.mean_force_2D(Ftot_num_x, Ftot_num_y, Ftot_den)
+            [ofe] = MFI.mean_force_variance(Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y)
+            ofe_history.append(sum(sum(ofe)) / (nbins[0]*nbins[1]))
+
+    return [X, Y, Ftot_den, Ftot_x, Ftot_y, ofe, ofe_history, Ftot_den2, ofv_x, ofv_y]
@@ -0,0 +1,184 @@
+"""Fast reader for PLUMED output files (HILLS, COLVAR, position) with an optional binary sidecar cache."""
+import itertools
+import json
+import os
+
+import numpy as np
+
+# Version of the sidecar cache layout, increase when it changes
+CACHE_VERSION = 1
+
+
+def read_fields(file_name):
+    """Read the column names from the "#! FIELDS" header of a PLUMED file.
+
+    Args:
+        file_name (str): Name of the file.
+
+    Returns:
+        list: Names of the columns, or None if the file has no FIELDS header.
+    """
+    with open(file_name, "r") as f:
+        for line in f:
+            if not line.startswith("#"):
+                return None
+            if line.startswith("#! FIELDS"):
+                return line.split()[2:]
+    return None
+
+
+def read_text(file_name, ncols):
+    """Read the numeric rows of a PLUMED file, skipping comment lines (e.g. repeated headers after a restart).
+    The whole file is parsed by one np.loadtxt call (whose parser is written in C since NumPy 1.23), and the columns are checked against ncols.
+
+    Args:
+        file_name (str): Name of the file.
+        ncols (int): Number of columns.
+
+    Returns:
+        array of size (nrows, ncols).
+    """
+    data = np.loadtxt(file_name, comments="#", dtype=np.float64, ndmin=2)
+    if data.size and data.shape[1] != ncols:
+        raise ValueError(file_name + " does not contain rows of " + str(ncols) + " columns")
+    return data.reshape(-1, ncols)
+
+
+def _cache_names(file_name):
+    return [file_name + ".npy", file_name + ".npy.json"]
+
+
+def _cache_key(file_name):
+    status = os.stat(file_name)
+    return {"cache_version": CACHE_VERSION, "size": status.st_size, "mtime_ns": status.st_mtime_ns}
+
+
+def _columns(file_name, all_fields, fields):
+    """Column indices of fields (a slice of all columns if fields is None)."""
+    if fields is None:
+        return slice(None)
+    if all_fields is None:
+        return list(fields)
+    missing = [field for field in fields if field not in all_fields]
+    if missing:
+        raise KeyError(file_name + " has no field(s) " + ", ".join(missing) + ", available fields: " + ", ".join(all_fields))
+    return [all_fields.index(field) for field in fields]
+
+
+def load_plumed_file(file_name, fields=None, cache=False):
+    """Load a PLUMED file, selecting the columns by their name in the "#! FIELDS" header.
+    With cache=True the whole table is also stored in a .npy sidecar next to the file, keyed on the size and modification time of the file.
+    Later loads of the unchanged file memory-map the sidecar, so the returned columns are views of it and no data is copied.
+
+    Args:
+        file_name (str): Name of the file.
+        fields (list, optional): Names of the columns to return (or column indices for files without a FIELDS header). Defaults to None, i.e. all columns.
+        cache (bool, optional): Use (and create or refresh) the binary sidecar. Defaults to False.
+
+    Returns:
+        array of size (nrows, len(fields)) - the selected columns.
+    """
+    all_fields = read_fields(file_name)
+    columns = _columns(file_name, all_fields, fields)
+
+    data = None
+    if cache:
+        [cache_name, key_name] = _cache_names(file_name)
+        key = _cache_key(file_name)
+        try:
+            with open(key_name, "r") as f:
+                if json.load(f) == key:
+                    data = np.load(cache_name, mmap_mode="r")
+        except (OSError, ValueError):
+            data = None
+
+    if data is None:
+        if all_fields is not None:
+            ncols = len(all_fields)
+        else:
+            with open(file_name, "r") as f:
+                ncols = len(next(line for line in f if line.strip() and not line.startswith("#")).split())
+        data = read_text(file_name, ncols)
+        if cache:
+            try:
+                with open(cache_name + ".tmp", "wb") as f:
+                    np.save(f, data)
+                os.replace(cache_name + ".tmp", cache_name)
+                with open(key_name, "w") as f:
+                    json.dump(key, f)
+            except OSError:
+                pass  # e.g. read-only data directory, the data are still returned
+
+    if isinstance(columns, slice):
+        return data
+    if len(columns) > 0 and columns == list(range(columns[0], columns[-1] + 1)):
+        return data[:, columns[0]: columns[-1] + 1]  # contiguous columns: view, no copy
+    return data[:, columns]
+
+
+def hills_fields(file_name, ncvs):
+    """Names of the (time, CVs, sigmas, height, biasfactor) columns of a HILLS file, in the order used by pyMFI.
+    The biasfactor column is only needed for well-tempered runs: for a file without a biasf field it is left out, as are the other fields of a file without FIELDS header (all its columns are read).
+
+    Args:
+        file_name (str): Name of the HILLS file.
+        ncvs (int): Number of CVs.
+
+    Returns:
+        list: Names of the columns, or None (all columns) if the file has no FIELDS header.
+    """
+    return select_hills_fields(read_fields(file_name), ncvs, file_name)
+
+
+def select_hills_fields(all_fields, ncvs, file_name="HILLS"):
+    """Names of the (time, CVs, sigmas, height, biasfactor) columns among the FIELDS of a HILLS file, see hills_fields.
+
+    Args:
+        all_fields (list): Names of the columns of the FIELDS header, None for a file without header.
+        ncvs (int): Number of CVs.
+        file_name (str, optional): Name of the file, for the error message. Defaults to "HILLS".
+
+    Returns:
+        list: Names of the columns (without biasf if the file has none), or None (all columns) if all_fields is None.
+    """
+    if all_fields is None:
+        return None
+    cvs = [field for field in all_fields[1:] if "sigma_" + field in all_fields][:ncvs]
+    if len(cvs) != ncvs:
+        raise ValueError(file_name + " does not have the FIELDS of a " + str(ncvs) + "D HILLS file")
+    return [all_fields[0]] + cvs + ["sigma_" + cv for cv in cvs] + ["height"] + (["biasf"] if "biasf" in all_fields else [])
+
+
+def iter_plumed_file(file_name, fields=None, block_rows=100000):
+    """Read a PLUMED file in blocks of rows, so that only one block is held in memory at a time.
+
+    Args:
+        file_name (str): Name of the file.
+        fields (list, optional): Names of the columns to return (or column indices for files without a FIELDS header). Defaults to None, i.e. all columns.
+        block_rows (int, optional): Number of rows per block. Defaults to 100000.
+
+    Yields:
+        array of size (n, len(fields)) - the selected columns of the next n <= block_rows rows.
+    """
+    columns = _columns(file_name, read_fields(file_name), fields)
+    usecols = None if isinstance(columns, slice) else columns
+    with open(file_name, "r") as f:
+        lines = (line for line in f if line.strip() and not line.startswith("#"))
+        while True:
+            block = list(itertools.islice(lines, block_rows))
+            if not block:
+                return
+            yield np.loadtxt(block, usecols=usecols, dtype=np.float64, ndmin=2)
+
+
+def count_rows(file_name):
+    """Number of data (non-comment) rows of a PLUMED file, counted without parsing the numbers.
+
+    Args:
+        file_name (str): Name of the file.
+
+    Returns:
+        int: number of rows.
+    """
+    with open(file_name, "rb") as f:
+        return sum(1 for line in f if line.strip() and not line.startswith(b"#"))
@@ -0,0 +1,108 @@
+"""Progress and telemetry events of the MFI analysis loops (MFI.MFI_2D, MFI.MFI_2D_stream, MFI1D.MFI_1D, MFInD.MFI_nD).
+
+The loops report their progress by calling callback(event) for every callback passed to them. An event is a dict of JSON-serialisable values:
+    event: "start", "error" (at every error checkpoint), "log" (at every log_pace checkpoint) or "end".
+    hill: number of hills analysed so far.
+    total_hills: number of hills to analyse.
+    elapsed: wall time since the start of the analysis, in seconds.
+    hills_per_s: hills analysed per second since the start of the analysis.
+    phase_times: wall time spent so far in every phase of the analysis (bias, kde, accumulate, error), in seconds.
+    ofe: latest grid average of the on the fly error estimate, None before the first error checkpoint.
+    peak_memory_mb: peak resident memory of the process in MB, None where it is not available.
+"""
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # e.g. Windows
+    resource = None
+
+# Phases timed by PhaseTimer, in the order they run for every hill window
+PHASES = ["bias", "kde", "accumulate", "error"]
+
+
+def peak_memory_mb():
+    """Peak resident memory of the process in MB, or None if the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, kB elsewhere
+
+
+class PhaseTimer:
+    """Wall time spent in every phase of an analysis loop: start() marks the beginning of a phase, stop(phase) adds the time since the last mark to phase."""
+
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self._mark = time.perf_counter()
+
+    def start(self):
+        self._mark = time.perf_counter()
+
+    def stop(self, phase):
+        now = time.perf_counter()
+        self.times[phase] += now - self._mark
+        self._mark = now
+
+
+class Progress:
+    """Build the events of one analysis loop and pass them to its callbacks.
+
+    Args:
+        callback (callable or list): Function(s) called with every event.
+        total_hills (int): Number of hills to analyse.
+        timer (PhaseTimer, optional): Timer of the phases of the loop. Defaults to None, i.e. a new one.
+        first_hill (int, optional): Number of hills already analysed (e.g. when resuming from a checkpoint). Defaults to 0.
+    """
+
+    def __init__(self, callback, total_hills, timer=None, first_hill=0):
+        self.callbacks = list(callback) if isinstance(callback, (list, tuple)) else [callback]
+        self.total_hills = total_hills
+        self.timer = timer if timer is not None else PhaseTimer()
+        self.first_hill = first_hill
+        self.start_time = time.perf_counter()
+
+    def emit(self, event, hill, ofe=None):
+        """Call the callbacks with an event after hill hills, see the module docstring for its fields."""
+        elapsed = time.perf_counter() - self.start_time
+        event = {"event": event, "hill": int(hill), "total_hills": int(self.total_hills), "elapsed": elapsed,
+                 "hills_per_s": (hill - self.first_hill) / elapsed if elapsed > 0 else None, "phase_times": dict(self.timer.times),
+                 "ofe": None if ofe is None else float(ofe), "peak_memory_mb": peak_memory_mb()}
+        for callback in self.callbacks:
+            callback(event)
+
+
+def print_progress_2D(event):
+    """Default callback of MFI_2D, MFI_2D_stream and MFI_nD: print the number of hills at the start and the average error at every log checkpoint."""
+    if event["event"] == "start":
+        print("Total no. of Gaussians analysed: " + str(event["total_hills"]))
+    elif event["event"] == "log":
+        ofe = "not computed yet" if event["ofe"] is None else str(event["ofe"])
+        print("|"+ str(event["hill"]) + "/" + str(event["total_hills"])+"|==> Average Mean Force Error: "+ofe)
+
+
+def print_progress_1D(event):
+    """Default callback of MFI_1D: print the progress and average error at every log checkpoint."""
+    if event["event"] == "log" and event["ofe"] is not None:
+        print(str(round(event["hill"] / event["total_hills"] * 100, 0)) + "%   OFE =", round(event["ofe"], 4))
+
+
+class JSONLinesHandler:
+    """Callback writing every event as one line of JSON to a file (appended, and flushed at every event so the file can be followed while the analysis runs).
+
+    Args:
+        file_name (str): Name of the output file.
+        events (list, optional): Types of events to write. Defaults to None, i.e. all events.
+    """
+
+    def __init__(self, file_name, events=None):
+        self.file_name = file_name
+        self.events = events
+
+    def __call__(self, event):
+        if self.events is not None and event["event"] not in self.events:
+            return
+        with open(self.file_name, "a") as f:
+            f.write(json.dumps(event) + "\n")
@@ -9,9 +9,10 @@ setup(
     author_email='m.salvalaglio@ucl.ac.uk',
     license='MIT',
     packages=['pyMFI'],
-    install_requires=['scipy',
+    install_requires=['scipy>=1.12',
                       'numpy',                     
                       ],
+    extras_require={'numba': ['numba']},
 
     classifiers=[
         'Development Status :: 1 - Planning',
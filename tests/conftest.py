@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def synthetic_2D():
+    """Tiny well-tempered metadynamics-like run on [-pi, pi]^2, in the layout of MFI.load_HILLS_2D and load_position_2D: [HILLS, position_x, position_y]."""
+    rng = np.random.default_rng(0)
+    nhills, stride = 40, 5
+    position = np.cumsum(rng.normal(0, 0.15, (nhills * stride, 2)), axis=0)
+    position = (position + np.pi) % (2 * np.pi) - np.pi
+    HILLS = np.zeros((nhills, 7))
+    HILLS[:, 0] = np.arange(nhills)
+    HILLS[:, 1:3] = position[::stride]
+    HILLS[:, 3:5] = 0.3
+    HILLS[:, 5] = 1.0 * np.exp(-np.arange(nhills) / nhills)
+    HILLS[:, 6] = 10
+    HILLS[0, 5] = 0
+    return [HILLS, position[:, 0], position[:, 1]]
+
+
+MFI_2D_OPTIONS = dict(bw=0.2, kT=1, min_grid=np.array((-np.pi, -np.pi)), max_grid=np.array((np.pi, np.pi)), nbins=np.array((31, 31)), error_pace=4, log_pace=2)
+
+
+@pytest.fixture
+def synthetic_2D_files(tmp_path, synthetic_2D):
+    """The synthetic_2D run written as PLUMED HILLS and position files (the position file has one extra last row, discarded by MFI.load_position_2D): [hills_name, position_name]."""
+    [HILLS, position_x, position_y] = synthetic_2D
+    hills = HILLS.copy()
+    hills[0, 5] = hills[1, 5]
+    [hills_name, position_name] = [str(tmp_path / "HILLS"), str(tmp_path / "position")]
+    np.savetxt(hills_name, hills, header="FIELDS time p.x p.y sigma_p.x sigma_p.y height biasf\nSET multivariate false", comments="#! ")
+    positions = np.column_stack((np.arange(len(position_x) + 1), np.append(position_x, 0), np.append(position_y, 0)))
+    np.savetxt(position_name, positions, header="FIELDS time p.x p.y", comments="#! ")
+    return [hills_name, position_name]
@@ -0,0 +1,49 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from pyMFI import MFI1D
+
+
+def synthetic_1D(nhills=60, stride=10, seed=0):
+    """Tiny well-tempered metadynamics-like HILLS and position arrays, in the layout of MFI1D.load_HILLS and load_position."""
+    rng = np.random.default_rng(seed)
+    position = np.cumsum(rng.normal(0, 0.05, nhills * stride)) % 2 - 1
+    HILLS = np.zeros((nhills, 5))
+    HILLS[:, 0] = np.arange(nhills)
+    HILLS[:, 1] = position[::stride]
+    HILLS[:, 2] = 0.1
+    HILLS[:, 3] = 0.5 * np.exp(-np.arange(nhills) / nhills)
+    HILLS[:, 4] = 10
+    HILLS[0, 3] = 0
+    return [HILLS, position]
+
+
+def run_MFI_1D(**kwargs):
+    [HILLS, position] = synthetic_1D()
+    return MFI1D.MFI_1D(HILLS=HILLS, position=position, bw=0.05, min_grid=-1.5, max_grid=1.5, nbins=121, log_pace=5, error_pace=20, WellTempered=1, callback=[], **kwargs)
+
+
+@pytest.mark.parametrize("options", [{"block_size": 1}, {"block_size": 10**9}, {"cutoff": 1000}])
+def test_MFI_1D_matches_dense(options):
+    reference = run_MFI_1D()
+    results = run_MFI_1D(**options)
+    for result, expected in zip(results, reference):
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("cutoff", [None, 3, 8])
+def test_MFI_1D_error_is_finite(cutoff):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        [grid, Ftot_den, Ftot, ofe, ofe_history] = run_MFI_1D(cutoff=cutoff)
+    assert np.all(np.isfinite(ofe)) and np.all(np.isfinite(ofe_history))
+    assert len(ofe_history) == 20
+
+
+def test_MFI_1D_cutoff_converges():
+    [grid, Ftot_den, Ftot, ofe, ofe_history] = run_MFI_1D()
+    Ftot_cutoff = run_MFI_1D(cutoff=8)[2]
+    visited = Ftot_den > 1E-3 * Ftot_den.max()
+    np.testing.assert_allclose(Ftot_cutoff[visited], Ftot[visited], rtol=0, atol=1E-8 * np.abs(Ftot[visited]).max())
@@ -0,0 +1,194 @@
+import functools
+
+import numpy as np
+import pytest
+
+from pyMFI import MFI
+
+from conftest import MFI_2D_OPTIONS
+
+# Ftot_den, Ftot_x, Ftot_y, ofe, Ftot_den2, ofv_x, ofv_y
+TERMS = [2, 3, 4, 5, 7, 8, 9]
+
+
+def run_MFI_2D(synthetic_2D, **kwargs):
+    [HILLS, position_x, position_y] = synthetic_2D
+    return MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, periodic=1, **{**MFI_2D_OPTIONS, "callback": [], **kwargs})
+
+
+def assert_results_close(results, reference, rtol):
+    for k in TERMS:
+        # ofe amplifies the round-off of Ftot_den**2 - Ftot_den2 in the bins covered by a single window
+        tolerance = max(rtol, 1E-9) if k == 5 else rtol
+        np.testing.assert_allclose(results[k], reference[k], rtol=tolerance, atol=tolerance * np.abs(reference[k]).max())
+
+
+def walker_master(synthetic_2D, nwalkers=4):
+    """[Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y] of the synthetic run split into nwalkers consecutive walkers."""
+    [HILLS, position_x, position_y] = synthetic_2D
+    stride = len(position_x) // len(HILLS)
+    master = []
+    for hills in np.array_split(np.arange(len(HILLS)), nwalkers):
+        positions = slice(hills[0] * stride, (hills[-1] + 1) * stride)
+        results = run_MFI_2D([HILLS[hills], position_x[positions], position_y[positions]])
+        master.append([results[k] for k in [2, 7, 3, 4, 8, 9]])
+    return np.array(master)
+
+
+@pytest.mark.parametrize("options", [{"cutoff": 50}, {"separable": True}, {"separable": True, "cutoff": 50}])
+def test_MFI_2D_fast_paths_match_dense(synthetic_2D, options):
+    assert_results_close(run_MFI_2D(synthetic_2D, **options), run_MFI_2D(synthetic_2D), 1E-12)
+
+
+def test_float32_error_matches_float64_where_several_windows_contribute(synthetic_2D):
+    reference = run_MFI_2D(synthetic_2D)
+    results = run_MFI_2D(synthetic_2D, dtype=np.float32)
+    [Ftot_den, Ftot_den2] = [reference[2], reference[7]]
+    several_windows = (Ftot_den > 1E-10 * Ftot_den.max()) & (Ftot_den**2 - Ftot_den2 > 1E-8 * Ftot_den**2)
+    assert several_windows.sum() > 100
+    np.testing.assert_allclose(results[5][several_windows], reference[5][several_windows], rtol=1E-4)
+    np.testing.assert_allclose(results[3][several_windows], reference[3][several_windows], rtol=1E-4, atol=1E-4 * np.abs(reference[3]).max())
+
+
+def test_FFT_intg_2D_returns_grids_owned_by_the_caller():
+    nbins = np.array((20, 20))
+    X, Y = np.meshgrid(np.linspace(-np.pi, np.pi, 20), np.linspace(-np.pi, np.pi, 20))
+    [FX, FY] = [np.cos(X) * np.sin(Y), np.sin(X) * np.cos(Y)]
+    [X1, Y1, fes1] = MFI.FFT_intg_2D(FX, FY, nbins=nbins)
+    X1 += 1
+    Y1 *= 2
+    [X2, Y2, fes2] = MFI.FFT_intg_2D(FX, FY, nbins=nbins)
+    np.testing.assert_array_equal(X2, X)
+    np.testing.assert_array_equal(Y2, Y)
+    np.testing.assert_array_equal(fes2, fes1)
+
+
+@pytest.mark.parametrize("integrator", [MFI.FFT_intg_2D, MFI.intg_2D, functools.partial(MFI.intg_2D, all_directions=True)])
+def test_integrators_recover_a_periodic_surface(integrator):
+    for n in [64, 128]:
+        X, Y = np.meshgrid(np.linspace(-np.pi, np.pi, n), np.linspace(-np.pi, np.pi, n))
+        expected = np.sin(X) * np.sin(Y)
+        expected -= expected.min()
+        [FX, FY] = [np.cos(X) * np.sin(Y), np.sin(X) * np.cos(Y)]
+        fes = integrator(FX, FY, nbins=np.array((n, n)))[2]
+        # the integrators are first order in the grid spacing
+        np.testing.assert_allclose(fes, expected, atol=2 * 2 * np.pi / (n - 1))
+
+
+def test_DCT_intg_2D_matches_unweighted_intgrad_2D():
+    nbins = np.array((24, 24))
+    [min_grid, max_grid] = [np.array((-2, -2)), np.array((2, 2))]
+    X, Y = np.meshgrid(np.linspace(-2, 2, 24), np.linspace(-2, 2, 24))
+    rng = np.random.default_rng(1)
+    # a non-periodic force with a non-conservative (noise) part, for which the least-squares solution matters
+    [FX, FY] = [4 * X**3 - 4 * X + rng.normal(0, 0.5, X.shape), 2 * Y + rng.normal(0, 0.5, X.shape)]
+    fes = MFI.DCT_intg_2D(FX, FY, min_grid=min_grid, max_grid=max_grid, nbins=nbins)[2]
+    reference = MFI.intgrad_2D(FX, FY, min_grid=min_grid, max_grid=max_grid, nbins=nbins, tol=1E-12)[2]
+    np.testing.assert_allclose(fes, reference, atol=1E-8 * reference.max())
+
+
+def test_MFI_2D_stream_infers_the_stride(synthetic_2D_files):
+    [hills_name, position_name] = synthetic_2D_files
+    HILLS = MFI.load_HILLS_2D(hills_name=hills_name)
+    [position_x, position_y] = MFI.load_position_2D(position_name=position_name)
+    reference = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, periodic=1, callback=[], **MFI_2D_OPTIONS)
+    results = MFI.MFI_2D_stream(hills_name=hills_name, position_name=position_name, periodic=1, callback=[], **MFI_2D_OPTIONS)
+    for result, expected in zip(results, reference):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_follow_MFI_2D_selects_the_columns_by_name(synthetic_2D, synthetic_2D_files, tmp_path):
+    [HILLS, position_x, position_y] = synthetic_2D
+    [hills_name, position_name] = synthetic_2D_files
+    reference = MFI.MFI_2D(HILLS=MFI.load_HILLS_2D(hills_name=hills_name), position_x=position_x, position_y=position_y, periodic=1, callback=[], **MFI_2D_OPTIONS)
+    options = {key: value for key, value in MFI_2D_OPTIONS.items() if key not in ("error_pace", "log_pace")}
+
+    # the same run, with an extra column and the height and biasf columns swapped in HILLS, and an extra column before the CVs in position
+    hills = np.loadtxt(hills_name)
+    np.savetxt(str(tmp_path / "HILLS_extra"), np.column_stack((hills[:, :3], np.ones(len(hills)), hills[:, 3:5], hills[:, 6], hills[:, 5])),
+               header="FIELDS time p.x p.y extra sigma_p.x sigma_p.y biasf height", comments="#! ")
+    positions = np.loadtxt(position_name)
+    np.savetxt(str(tmp_path / "position_extra"), np.column_stack((positions[:, 0], -positions[:, 1], positions[:, 1:])), header="FIELDS time extra p.x p.y", comments="#! ")
+
+    for [hills_file, position_file, fields] in [[hills_name, position_name, None], [str(tmp_path / "HILLS_extra"), str(tmp_path / "position_extra"), ["p.x", "p.y"]]]:
+        accumulator = next(MFI.follow_MFI_2D(hills_name=hills_file, position_name=position_file, stride=len(position_x) // len(HILLS), fields=fields, poll_interval=0, timeout=0, periodic=1, **options))
+        assert accumulator.n_windows == len(HILLS)
+        for k, [result, expected] in enumerate(zip(accumulator.results(), reference)):
+            if k != 6:  # ofe_history is only computed once here
+                np.testing.assert_array_equal(result, expected)
+
+
+def test_coarsen_2D_subsampling_matches_MFI_2D(synthetic_2D):
+    [HILLS, position_x, position_y] = synthetic_2D
+    fine = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, callback=[], **MFI_2D_OPTIONS)
+    options = dict(MFI_2D_OPTIONS, nbins=np.array((16, 16)))
+    coarse = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, callback=[], **options)
+    subsampled = MFI.coarsen_2D(fine, options["nbins"])
+    for k in [0, 1, 2, 3, 4, 5, 7, 8, 9]:
+        np.testing.assert_allclose(subsampled[k], coarse[k], rtol=1E-12, atol=1E-12)
+
+
+def test_MFI_2D_numba_backend_matches_numpy(synthetic_2D):
+    pytest.importorskip("numba")
+    assert_results_close(run_MFI_2D(synthetic_2D, backend="numba"), run_MFI_2D(synthetic_2D), 1E-10)
+
+
+def test_MFI_2D_resumes_from_checkpoint(synthetic_2D, tmp_path):
+    checkpoint_name = str(tmp_path / "checkpoint.npz")
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt(event):
+        if event["event"] == "error" and event["hill"] >= 20:
+            raise Interrupted
+
+    with pytest.raises(Interrupted):
+        run_MFI_2D(synthetic_2D, checkpoint_name=checkpoint_name, callback=interrupt)
+    results = run_MFI_2D(synthetic_2D, resume_from=checkpoint_name)
+    reference = run_MFI_2D(synthetic_2D)
+    for result, expected in zip(results, reference):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_MFI_2D_tiles_match_cutoff(synthetic_2D):
+    reference = run_MFI_2D(synthetic_2D, cutoff=5)
+    assert_results_close(run_MFI_2D(synthetic_2D, cutoff=5, tile_size=8), reference, 1E-12)
+
+
+def test_MFI_2D_cutoff_truncates_only_the_far_tails(synthetic_2D):
+    reference = run_MFI_2D(synthetic_2D)
+    results = run_MFI_2D(synthetic_2D, cutoff=8)
+    visited = reference[2] > 1E-3 * reference[2].max()
+    for k in [2, 3, 4]:
+        np.testing.assert_allclose(results[k][visited], reference[k][visited], rtol=1E-9, atol=1E-10 * np.abs(reference[k]).max())
+
+
+def test_jackknife_2D_matches_leave_one_out_loop(synthetic_2D):
+    master = walker_master(synthetic_2D)
+    n_walkers = len(master)
+    replicas = []
+    for i in range(n_walkers):
+        [Fx, Fy, den, error] = MFI.patch_2D_error(np.delete(master, i, axis=0), nbins=MFI_2D_OPTIONS["nbins"])
+        replicas.append([Fx, Fy])
+    replicas = np.array(replicas)
+    variance = (n_walkers - 1) / n_walkers * ((replicas - replicas.mean(axis=0))**2).sum(axis=0)
+    for batch_size in [1, 100]:
+        error = MFI.jackknife_2D(master, batch_size=batch_size)[3]
+        np.testing.assert_allclose(error, np.sqrt(variance[0] + variance[1]), rtol=1E-8, atol=1E-10 * error.max())
+
+
+def test_bootstrap_2D_matches_resampling_loop(synthetic_2D):
+    master = walker_master(synthetic_2D)
+    n_walkers = len(master)
+    counts = np.random.default_rng(3).multinomial(n_walkers, np.full(n_walkers, 1 / n_walkers), size=50)
+    replicas = np.array([MFI.patch_2D_error(np.repeat(master, count, axis=0), nbins=MFI_2D_OPTIONS["nbins"])[:2] for count in counts])
+    variance = replicas.var(axis=0, ddof=1)
+    for batch_size in [7, 100]:
+        error = MFI.bootstrap_2D(master, n_replicas=50, batch_size=batch_size, seed=3)[3]
+        np.testing.assert_allclose(error, np.sqrt(variance[0] + variance[1]), rtol=1E-8, atol=1E-10 * error.max())
+
+    # identical walkers: every replica is the full estimate
+    identical = np.repeat(master[:1], 3, axis=0)
+    assert np.abs(MFI.bootstrap_2D(identical, n_replicas=20, seed=0)[3]).max() < 1E-10
+    assert np.abs(MFI.jackknife_2D(identical)[3]).max() < 1E-10
@@ -0,0 +1,30 @@
+import numpy as np
+from pyMFI import MFI, MFInD
+from conftest import MFI_2D_OPTIONS
+
+
+def test_MFI_nD_matches_MFI_2D(synthetic_2D):
+    [HILLS, position_x, position_y] = synthetic_2D
+    results_2D = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, periodic=1, callback=[], **MFI_2D_OPTIONS)
+    [grids, Ftot_den, Ftot, ofe, ofe_history, Ftot_den2, ofv] = MFInD.MFI_nD(HILLS=HILLS, position=np.column_stack((position_x, position_y)), periodic=1, callback=[], **MFI_2D_OPTIONS)
+
+    # MFI_nD grids are indexed (CV1, CV2), MFI_2D grids (CV2, CV1)
+    np.testing.assert_allclose(grids[0], results_2D[0][0])
+    np.testing.assert_allclose(grids[1], results_2D[1][:, 0])
+    for [k, term] in [[2, Ftot_den], [3, Ftot[0]], [4, Ftot[1]], [7, Ftot_den2], [8, ofv[0]], [9, ofv[1]]]:
+        np.testing.assert_allclose(term.T, results_2D[k], rtol=1E-12, atol=1E-12 * np.abs(results_2D[k]).max())
+    # ofe amplifies the round-off of Ftot_den**2 - Ftot_den2 in the bins covered by a single window
+    np.testing.assert_allclose(ofe.T, results_2D[5], rtol=1E-9, atol=1E-9 * np.abs(results_2D[5]).max())
+    assert len(ofe_history) == len(results_2D[6])
+    np.testing.assert_allclose(ofe_history[-1], results_2D[6][-1], rtol=1E-9)
+
+
+def test_FFT_intg_nD_matches_FFT_intg_2D(synthetic_2D):
+    [HILLS, position_x, position_y] = synthetic_2D
+    [X, Y, Ftot_den, Ftot_x, Ftot_y] = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, periodic=1, callback=[], **MFI_2D_OPTIONS)[:5]
+    [min_grid, max_grid, nbins] = [MFI_2D_OPTIONS["min_grid"], MFI_2D_OPTIONS["max_grid"], MFI_2D_OPTIONS["nbins"]]
+
+    fes_2D = MFI.FFT_intg_2D(Ftot_x, Ftot_y, min_grid, max_grid, nbins)[2]
+    [grids, fes] = MFInD.FFT_intg_nD([Ftot_x.T, Ftot_y.T], min_grid, max_grid, nbins)
+    np.testing.assert_allclose(grids[0], X[0])
+    np.testing.assert_allclose(fes.T, fes_2D, rtol=1E-12, atol=1E-12 * fes_2D.max())
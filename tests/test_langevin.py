@@ -0,0 +1,38 @@
+import numpy as np
+
+from pyMFI import MFI, langevin
+
+
+def test_simulate_2D_writes_files_read_by_MFI(tmp_path):
+    [nsteps, pace, stride, height, biasfactor] = [3000, 100, 10, 0.5, 10]
+    names = langevin.simulate_2D(nwalkers=2, nsteps=nsteps, pace=pace, stride=stride, height=height, biasfactor=biasfactor, seed=0, block_steps=1000,
+                                 hills_name=str(tmp_path / "HILLS_{}"), position_name=str(tmp_path / "position_{}"))
+    for [hills_name, position_name] in names:
+        HILLS = MFI.load_HILLS_2D(hills_name=hills_name)
+        [position_x, position_y] = MFI.load_position_2D(position_name=position_name)
+        assert HILLS.shape == (nsteps // pace, 7)
+        assert position_x.shape == position_y.shape == (nsteps // stride,)
+        assert len(position_x) // len(HILLS) == pace // stride
+        # hills are deposited at the position printed at the same step
+        np.testing.assert_allclose(HILLS[1:, 1], position_x[pace // stride::pace // stride][:len(HILLS) - 1], atol=1E-6)
+
+        # well-tempered heights start at height * biasfactor / (biasfactor - 1) on the unbiased surface, and decrease as the walker fills its well
+        heights = HILLS[1:, 5]
+        np.testing.assert_allclose(heights[0], height * biasfactor / (biasfactor - 1), rtol=1E-12)
+        assert np.all(heights <= heights[0])
+        assert heights[-10:].mean() < heights[:10].mean()
+        np.testing.assert_array_equal(HILLS[:, 6], biasfactor)
+
+
+def test_interpolate_is_exact_for_a_plane():
+    [origin, grid_space] = [np.array((-1.0, -2.0)), np.array((0.1, 0.2))]
+    [gridx, gridy] = [origin[0] + grid_space[0] * np.arange(21), origin[1] + grid_space[1] * np.arange(11)]
+    X, Y = np.meshgrid(gridx, gridy)
+    # one walker per plane, with two fields each
+    planes = np.stack([np.stack((1 + 2 * X - 3 * Y, -X + 0.5 * Y), axis=-1), np.stack((4 * Y, 2 - X), axis=-1)])
+    positions = np.array(((0.37, -1.23), (gridx[-1], gridy[-1])))
+    expected = np.array(((1 + 2 * 0.37 + 3 * 1.23, -0.37 - 0.5 * 1.23), (4 * gridy[-1], 2 - gridx[-1])))
+    np.testing.assert_allclose(langevin._interpolate(planes, origin, grid_space, positions), expected, rtol=1E-12)
+    # zero outside the grid
+    outside = np.array(((gridx[-1] + 0.01, 0.0), (0.0, gridy[0] - 0.01)))
+    np.testing.assert_array_equal(langevin._interpolate(planes, origin, grid_space, outside), 0)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from pyMFI import MFI, parallel
+
+from conftest import MFI_2D_OPTIONS
+
+
+def random_walkers(nwalkers, nbins=(8, 6), seed=0):
+    """Per-walker terms [Ftot_den, Ftot_den2, Ftot_x, Ftot_y, ofv_x, ofv_y] with positive densities."""
+    rng = np.random.default_rng(seed)
+    master = rng.normal(size=(nwalkers, 6, nbins[1], nbins[0]))
+    master[:, 0] = rng.uniform(0.5, 2, size=(nwalkers, nbins[1], nbins[0]))
+    master[:, 1] = master[:, 0] ** 2 * rng.uniform(0.1, 0.5, size=(nwalkers, nbins[1], nbins[0]))
+    return master
+
+
+def test_walker_store_skips_gaps_and_temporary_files(tmp_path):
+    master = random_walkers(4)
+    store = parallel.WalkerStore(str(tmp_path))
+    for index, walker in zip([0, 1, 3], master):
+        store.write(index, walker)
+    (tmp_path / ".walker_000004.123.tmp").write_bytes(b"partly written")
+    (tmp_path / "walker_000005.npy.tmp.npy").write_bytes(b"partly written")
+
+    assert len(store) == 3 and store.indices() == [0, 1, 3]
+    np.testing.assert_array_equal(store[-1], master[2])
+    assert store.append([None, None, *master[3][[0, 2, 3]], None, None, master[3][1], master[3][4], master[3][5]]) == 4
+    np.testing.assert_array_equal(np.asarray(store), master)
+
+
+def test_patch_2D_reduce_matches_patch_2D_error(tmp_path):
+    master = random_walkers(5)
+    store = parallel.WalkerStore(str(tmp_path))
+    for index, walker in enumerate(master):
+        store.write(2 * index, walker)
+    reference = MFI.patch_2D_error(master, nbins=(6, 8))
+    for nworkers in [1, 2]:
+        for result, expected in zip(parallel.patch_2D_reduce(store, nworkers), reference):
+            np.testing.assert_allclose(result, expected, rtol=1E-12, atol=1E-14)
+
+
+def test_MFI_2D_segments_matches_serial_and_is_silent(synthetic_2D, capfd):
+    [HILLS, position_x, position_y] = synthetic_2D
+    options = {key: value for key, value in MFI_2D_OPTIONS.items() if key not in ("error_pace", "log_pace")}
+    reference = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, periodic=1, callback=[], **options)
+    capfd.readouterr()
+    results = parallel.MFI_2D_segments(HILLS, position_x, position_y, nsegments=3, nworkers=2, periodic=1, **options)
+    assert capfd.readouterr().out == ""
+    for k in [2, 3, 4, 7, 8, 9]:  # Ftot_den, Ftot_x, Ftot_y, Ftot_den2, ofv_x, ofv_y
+        np.testing.assert_allclose(results[k], reference[k], rtol=1E-9, atol=1E-12 * np.abs(reference[k]).max())
+    assert len(results[6]) == 3
+
+
+def test_MFI_2D_walkers_matches_patch_2D_error(synthetic_2D):
+    [HILLS, position_x, position_y] = synthetic_2D
+    sources = [(HILLS, [position_x, position_y]), (HILLS[::-1].copy(), [position_x[::-1].copy(), position_y[::-1].copy()])]
+    master = []
+    for hills, [x, y] in sources:
+        results = MFI.MFI_2D(HILLS=hills, position_x=x, position_y=y, periodic=1, callback=[], **MFI_2D_OPTIONS)
+        master.append([results[k] for k in [2, 7, 3, 4, 8, 9]])
+    reference = MFI.patch_2D_error(np.array(master), nbins=MFI_2D_OPTIONS["nbins"])
+    results = parallel.MFI_2D_walkers(sources, nworkers=2, periodic=1, **MFI_2D_OPTIONS)
+    for result, expected in zip(results[:4], reference):
+        np.testing.assert_allclose(result, expected, rtol=1E-12, atol=1E-12 * np.abs(expected).max())
+    assert len(results[4]) == 2
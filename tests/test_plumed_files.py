@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from pyMFI import MFI, plumed_files
+
+
+def test_load_plumed_file_cache_matches_text(synthetic_2D_files):
+    [hills_name, position_name] = synthetic_2D_files
+    for file_name in [hills_name, position_name]:
+        reference = plumed_files.load_plumed_file(file_name)
+        for k in range(2):  # creates, then reads the sidecar
+            np.testing.assert_array_equal(plumed_files.load_plumed_file(file_name, cache=True), reference)
+
+    # a changed file refreshes the sidecar
+    positions = np.loadtxt(position_name)[:-3]
+    np.savetxt(position_name, positions, header="FIELDS time p.x p.y", comments="#! ")
+    np.testing.assert_array_equal(plumed_files.load_plumed_file(position_name, ["p.y"], cache=True), positions[:, 2:3])
+    np.testing.assert_array_equal(MFI.load_HILLS_2D(hills_name=hills_name, cache=True), MFI.load_HILLS_2D(hills_name=hills_name))
+
+
+def test_HILLS_without_biasf_load_for_non_well_tempered_runs(synthetic_2D_files, tmp_path):
+    [hills_name, position_name] = synthetic_2D_files
+    hills = np.loadtxt(hills_name)[:, :6]
+    metad_name = str(tmp_path / "HILLS_metad")
+    np.savetxt(metad_name, hills, header="FIELDS time p.x p.y sigma_p.x sigma_p.y height", comments="#! ")
+    HILLS = MFI.load_HILLS_2D(hills_name=metad_name)
+    np.testing.assert_array_equal(HILLS, MFI.load_HILLS_2D(hills_name=hills_name)[:, :6])
+
+    [position_x, position_y] = MFI.load_position_2D(position_name=position_name)
+    options = dict(nbins=np.array((21, 21)), bw=0.2, periodic=1, WellTempered=0, callback=[])
+    reference = MFI.MFI_2D(HILLS=MFI.load_HILLS_2D(hills_name=hills_name), position_x=position_x, position_y=position_y, **options)
+    results = MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, **options)
+    streamed = MFI.MFI_2D_stream(hills_name=metad_name, position_name=position_name, **options)
+    for result, stream, expected in zip(results, streamed, reference):
+        np.testing.assert_array_equal(result, expected)
+        np.testing.assert_array_equal(stream, expected)
+    with pytest.raises(ValueError, match="biasf"):
+        MFI.MFI_2D(HILLS=HILLS, position_x=position_x, position_y=position_y, **dict(options, WellTempered=1))